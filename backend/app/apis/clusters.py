@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Query, Depends, HTTPException, Response
+import asyncpg # Per il type hint della connessione
+
+from app.crud import crud_clusters_async as crud_clusters
+from app.core.clusters import CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM, cell_zoom
+from app.core.response_cache import response_cache, snap_bbox_to_tiles
+from app.db.async_database import get_async_db_connection
+
+router = APIRouter()
+
+@router.get("")
+async def get_clusters_endpoint(
+    west: float = Query(..., description="Longitudine ovest"),
+    south: float = Query(..., description="Latitudine sud"),
+    east: float = Query(..., description="Longitudine est"),
+    north: float = Query(..., description="Latitudine nord"),
+    zoom: int = Query(..., ge=CLUSTER_MIN_ZOOM, le=CLUSTER_MAX_ZOOM, description="Livello di zoom della mappa"),
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
+) -> Response:
+    """
+    Restituisce gli edifici aggregati in celle (cluster) per gli zoom in cui la mappa
+    non mostra i singoli edifici: un punto per cella con i conteggi di edifici,
+    edifici predisposti e TFO. I conteggi sono letti dalla tabella precalcolata
+    catasto_cluster_celle, aggiornata dai trigger a ogni scrittura.
+    """
+    # Il bbox viene allineato alle celle della griglia: stesse celle, stessa voce in cache
+    tile_range, snapped_bbox = snap_bbox_to_tiles(west, south, east, north, cell_zoom(zoom))
+    cache_key = ("clusters", zoom, tile_range)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    generation = response_cache.generation
+    try:
+        x_min, y_min, x_max, y_max = tile_range
+        body = await crud_clusters.get_clusters_by_tile_range(
+            db_conn=db_conn, zoom=zoom, x_min=x_min, y_min=y_min, x_max=x_max, y_max=y_max
+        )
+        response_cache.put(cache_key, body, snapped_bbox, generation)
+        return Response(content=body, media_type="application/json")
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Errore API /clusters: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore interno del server nel recupero dei cluster: {str(e)}")
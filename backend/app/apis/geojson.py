@@ -1,36 +1,109 @@
-from fastapi import APIRouter, Query, Depends, HTTPException
-from typing import Any
-import psycopg2 # Per il type hint della connessione
+from fastapi import APIRouter, Query, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import asyncpg # Per il type hint della connessione
 
-from app.crud import crud_geojson
-from app.db.database import get_db_connection
+from app.crud import crud_geojson_async as crud_geojson
+from app.crud import crud_data_version_async as crud_data_version
+from app.core.config import settings
+from app.core.compression import accepted_values
+from app.core.data_version import make_validators, conditional_headers, is_not_modified, not_modified_response, same_version
+from app.core.pagination import decode_cursor
+from app.core.response_cache import response_cache, snap_bbox_to_tiles
+from app.db.async_database import get_async_db_connection
 
 router = APIRouter()
 
+FLATGEOBUF_MEDIA_TYPE = "application/flatgeobuf"
+
+def _wants_flatgeobuf(request: Request) -> bool:
+    """Negoziazione del formato: FlatGeobuf solo se richiesto esplicitamente in Accept (q > 0)."""
+    return FLATGEOBUF_MEDIA_TYPE in accepted_values(request.headers.get("accept", ""))
+
+def _bbox_response(body: bytes, media_type: str, validators, next_cursor: Optional[str]) -> Response:
+    headers = conditional_headers(validators)
+    headers["Vary"] = "Accept" # Stesso URL, formati diversi in base ad Accept
+    if media_type == FLATGEOBUF_MEDIA_TYPE:
+        # FlatGeobuf non ha posto per il cursore: la pagina successiva è indicata nell'intestazione
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        if not body:
+            return Response(status_code=204, headers=headers) # Nessun edificio nella pagina
+    return Response(content=body, media_type=media_type, headers=headers)
+
 @router.get("/bbox")
-def get_geojson_by_bbox_endpoint(
+async def get_geojson_by_bbox_endpoint(
+    request: Request,
     west: float = Query(..., description="Longitudine ovest"),
     south: float = Query(..., description="Latitudine sud"),
     east: float = Query(..., description="Longitudine est"),
     north: float = Query(..., description="Latitudine nord"),
-    zoom: int = Query(..., description="Livello di zoom"), # zoom passato ma non usato da crud_geojson
-    db_conn: psycopg2.extensions.connection = Depends(get_db_connection) # type: ignore
-) -> dict[str, Any]:
+    zoom: int = Query(..., ge=0, le=24, description="Livello di zoom (determina il livello di dettaglio delle geometrie)"),
+    stream: bool = Query(False, description="Invia il FeatureCollection in streaming (memoria costante, nessuna cache)"),
+    cursor: Optional[str] = Query(None, description="Cursore 'next' restituito dalla pagina precedente"),
+    limit: int = Query(settings.GEOJSON_PAGE_SIZE, ge=1, le=settings.GEOJSON_MAX_PAGE_SIZE, description="Edifici per pagina"),
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
+) -> Response:
     """
     Restituisce le abitazioni come GeoJSON con indicazione 'predisposto_fibra'.
-    Restituisce poligoni e centroidi come feature separate.
+    Restituisce poligoni e centroidi come feature separate; sotto lo zoom 14
+    restituisce solo i centroidi, sopra semplifica i poligoni in base allo zoom.
+    Il bbox viene allineato alle tile dello zoom richiesto, così le risposte sono
+    riutilizzabili dalla cache anche dopo piccoli spostamenti della mappa.
+    Con stream=true le righe sono lette a blocchi da un cursore lato server e
+    scritte man mano nella risposta.
+    I risultati sono paginati per id: se 'next' non è null, la pagina successiva
+    si ottiene ripetendo la richiesta con cursor=<next>.
+    Con Accept: application/flatgeobuf la pagina è in formato FlatGeobuf (binario,
+    una feature per edificio con il centroide nelle proprietà) e il cursore della
+    pagina successiva è nell'intestazione X-Next-Cursor.
+    Le risposte hanno ETag/Last-Modified legati alla versione dei dati: se la copia
+    del client è ancora valida la risposta è 304, senza eseguire la query delle feature.
     """
-    try:
-        features = crud_geojson.get_features_by_bbox(
-            db_conn=db_conn, west=west, south=south, east=east, north=north # zoom=zoom
+    after_id = 0
+    if cursor:
+        after_id = decode_cursor(cursor).get("id")
+        if type(after_id) is not int: # bool è una sottoclasse di int: {"id": true} non è un cursore valido
+            raise HTTPException(status_code=400, detail="Cursore di paginazione non valido.")
+    media_type = FLATGEOBUF_MEDIA_TYPE if _wants_flatgeobuf(request) else "application/json"
+    tile_range, snapped_bbox = snap_bbox_to_tiles(west, south, east, north, zoom)
+    cache_key = ("bbox", media_type, zoom, tile_range, after_id, limit)
+    # Versione letta prima della query: i dati restituiti sono almeno aggiornati a questa versione.
+    # Letta anche se la risposta è in cache, che non vede le scritture degli altri processi
+    validators = make_validators(await crud_data_version.get_data_version(db_conn), cache_key)
+    if is_not_modified(request, validators):
+        return not_modified_response(validators)
+    cached = response_cache.get_entry(cache_key)
+    if cached is not None:
+        body, (cached_validators, next_cursor) = cached
+        if same_version(cached_validators, validators):
+            return _bbox_response(body, media_type, validators, next_cursor)
+    snapped_west, snapped_south, snapped_east, snapped_north = snapped_bbox
+    if stream and media_type == "application/json":
+        # La connessione della dependency viene restituita al pool solo dopo l'invio dell'ultimo blocco
+        chunks = await crud_geojson.stream_features_by_bbox(
+            db_conn=db_conn, west=snapped_west, south=snapped_south, east=snapped_east, north=snapped_north,
+            zoom=zoom, after_id=after_id, limit=limit, chunk_size=settings.GEOJSON_STREAM_CHUNK_SIZE
         )
-        return {"type": "FeatureCollection", "features": features}
+        return StreamingResponse(chunks, media_type="application/json", headers=conditional_headers(validators))
+    generation = response_cache.generation
+    try:
+        next_cursor = None # Nel GeoJSON il cursore è già nel corpo ('next')
+        if media_type == FLATGEOBUF_MEDIA_TYPE:
+            body, next_cursor = await crud_geojson.get_flatgeobuf_by_bbox(
+                db_conn=db_conn, west=snapped_west, south=snapped_south, east=snapped_east, north=snapped_north, zoom=zoom,
+                after_id=after_id, limit=limit
+            )
+        else:
+            body = await crud_geojson.get_feature_collection_by_bbox(
+                db_conn=db_conn, west=snapped_west, south=snapped_south, east=snapped_east, north=snapped_north, zoom=zoom,
+                after_id=after_id, limit=limit
+            )
+        response_cache.put(cache_key, body, snapped_bbox, generation, meta=(validators, next_cursor))
+        return _bbox_response(body, media_type, validators, next_cursor)
     except HTTPException as e: # Rilancia le HTTPException dal CRUD
         raise e
     except Exception as e:
         # Log dell'errore originale se necessario
         print(f"Errore API /geojson/bbox: {e}")
         raise HTTPException(status_code=500, detail=f"Errore interno del server nel recupero GeoJSON: {str(e)}")
-    finally:
-        if db_conn:
-            db_conn.close()
\ No newline at end of file
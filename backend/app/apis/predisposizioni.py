@@ -1,46 +1,111 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, Body
-from typing import List
-import psycopg2
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request
+from typing import Optional
+import asyncpg
+import datetime
 
-from app.crud import crud_predisposizione
-from app.schemas.predisposizioni import PredisposizioneInDB, PredisposizioneCreate
+from app.crud import crud_predisposizione_async as crud_predisposizione
+from app.crud import crud_data_version_async as crud_data_version
+from app.schemas.predisposizioni import (
+    PredisposizioneInDB, PredisposizioneCreate, PredisposizioneBatchCreate,
+    PredisposizioneBatchResponse, BuildingSelection, PredisposizioniPage
+)
 from app.schemas.common import BaseResponse
-from app.db.database import get_db_connection
+from app.core.config import settings
+from app.core.pagination import encode_cursor, decode_cursor
+from app.core.predisposizioni_listing import SORT_EXPRESSIONS
+from app.core.data_version import cached_conditional_response
+from app.core.metrics import serialization_timer
+from app.db.async_database import get_async_db_connection
+from app.db.database import dumps_json
 
 router = APIRouter()
 
-@router.get("", response_model=List[PredisposizioneInDB])
-def get_predisposizioni_endpoint(
-    db_conn: psycopg2.extensions.connection = Depends(get_db_connection) # type: ignore
-):
+def _check_batch_size(ids) -> None:
+    if ids is not None and len(ids) > settings.PREDISPOSIZIONI_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Troppi edifici: massimo {settings.PREDISPOSIZIONI_BATCH_MAX_ITEMS} per richiesta.")
+
+def _cursor_position(cursor: str, sort: str, order: str) -> tuple:
+    """Posizione (valore di ordinamento, id) da un cursore; 400 se non valido o di un altro ordinamento."""
+    position = decode_cursor(cursor)
+    value, after_id = position.get("v"), position.get("id")
+    if position.get("sort") != sort or position.get("order") != order or type(after_id) is not int:
+        raise HTTPException(status_code=400, detail="Cursore di paginazione non valido.")
     try:
-        return crud_predisposizione.get_all_predisposizioni(db_conn=db_conn)
-    finally:
-        if db_conn: db_conn.close()
+        if sort == "id":
+            value = after_id
+        elif sort == "data_predisposizione":
+            value = datetime.date.fromisoformat(value)
+        elif not isinstance(value, str):
+            raise ValueError(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Cursore di paginazione non valido.")
+    return value, after_id
+
+@router.get("", response_model=PredisposizioniPage)
+async def get_predisposizioni_endpoint(
+    request: Request,
+    comune: Optional[str] = Query(None, description="Comune (corrispondenza esatta)"),
+    data_da: Optional[datetime.date] = Query(None, description="Data predisposizione minima (inclusa)"),
+    data_a: Optional[datetime.date] = Query(None, description="Data predisposizione massima (inclusa)"),
+    uso_edificio: Optional[str] = Query(None, description="Uso edificio (corrispondenza esatta)"),
+    q: Optional[str] = Query(None, max_length=200, description="Testo contenuto nell'indirizzo"),
+    sort: str = Query("id", pattern="^(" + "|".join(SORT_EXPRESSIONS) + ")$", description="Campo di ordinamento"),
+    order: str = Query("asc", pattern="^(asc|desc)$", description="Direzione di ordinamento"),
+    cursor: Optional[str] = Query(None, description="Cursore 'next' restituito dalla pagina precedente"),
+    limit: int = Query(settings.PREDISPOSIZIONI_PAGE_SIZE, ge=1, le=settings.PREDISPOSIZIONI_MAX_PAGE_SIZE, description="Righe per pagina"),
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
+):
+    """
+    Lista paginata (keyset) degli edifici predisposti, con filtri e ordinamento.
+    Se 'next' non è null, la pagina successiva si ottiene ripetendo la richiesta
+    con gli stessi filtri e cursor=<next>. Il totale è calcolato solo sulla prima pagina.
+    Se i dati non sono cambiati dalla copia del client (ETag) la risposta è 304.
+    """
+    after = _cursor_position(cursor, sort, order) if cursor else None
+
+    async def build_body() -> bytes:
+        page = await crud_predisposizione.list_predisposizioni(
+            db_conn=db_conn, comune=comune, data_da=data_da, data_a=data_a, uso_edificio=uso_edificio,
+            q=q.strip() if q else None, sort=sort, order=order, after=after, limit=limit,
+            count_limit=settings.PREDISPOSIZIONI_COUNT_LIMIT if after is None else None
+        )
+        next_cursor = None
+        if page["next_position"] is not None:
+            value, last_id = page["next_position"]
+            next_cursor = encode_cursor({"sort": sort, "order": order, "v": value, "id": last_id})
+        # JSON con la forma di PredisposizioniPage, prodotto direttamente dalle righe del DB:
+        # response_model resta per la documentazione OpenAPI ma non rivalida la risposta
+        with serialization_timer("predisposizioni_list"):
+            return dumps_json({
+                "items": page["items"], "next": next_cursor, "total": page["total"], "total_capped": page["total_capped"]
+            })
+
+    return await cached_conditional_response(
+        request, ("predisposizioni", comune, data_da, data_a, uso_edificio, q, sort, order, cursor, limit),
+        lambda: crud_data_version.get_data_version(db_conn), build_body
+    )
 
 @router.post("", response_model=PredisposizioneInDB, status_code=201)
-def create_predisposizione_endpoint(
+async def create_predisposizione_endpoint(
     pred: PredisposizioneCreate,
-    db_conn: psycopg2.extensions.connection = Depends(get_db_connection) # type: ignore
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
 ):
     try:
-        return crud_predisposizione.create_or_update_predisposizione(db_conn=db_conn, pred_data=pred)
+        return await crud_predisposizione.create_or_update_predisposizione(db_conn=db_conn, pred_data=pred)
     except HTTPException as e:
         raise e # Rilancia l'eccezione dal CRUD (es. 404)
     except Exception as e:
         print(f"Errore API POST /predisposizioni: {e}")
         raise HTTPException(status_code=500, detail=f"Errore durante la creazione/aggiornamento predisposizione: {str(e)}")
-    finally:
-        if db_conn: db_conn.close()
 
 
 @router.delete("/{predisposizione_id}", response_model=BaseResponse)
-def delete_predisposizione_endpoint(
+async def delete_predisposizione_endpoint(
     predisposizione_id: int = Path(..., description="ID abitazione (predisposizione) da eliminare"),
-    db_conn: psycopg2.extensions.connection = Depends(get_db_connection) # type: ignore
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
 ):
     try:
-        deleted_tfos_count = crud_predisposizione.delete_predisposizione_by_id(
+        deleted_tfos_count = await crud_predisposizione.delete_predisposizione_by_id(
             db_conn=db_conn, predisposizione_id=predisposizione_id
         )
         return BaseResponse(message=f"Predisposizione ID {predisposizione_id} e {deleted_tfos_count} TFO associate eliminate/resettate.")
@@ -49,5 +114,41 @@ def delete_predisposizione_endpoint(
     except Exception as e:
         print(f"Errore API DELETE /predisposizioni/{predisposizione_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Errore durante l'eliminazione della predisposizione: {str(e)}")
-    finally:
-        if db_conn: db_conn.close()
\ No newline at end of file
+
+@router.post("/batch", response_model=PredisposizioneBatchResponse)
+async def batch_create_predisposizioni_endpoint(
+    batch: PredisposizioneBatchCreate,
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
+):
+    """
+    Predispone più edifici con un solo statement: items con i dati di ogni edificio,
+    oppure selection (ids, bbox o polygon) con i campi comuni in values.
+    """
+    try:
+        _check_batch_size(batch.items if batch.items is not None else batch.selection.ids)
+        result = await crud_predisposizione.batch_create_or_update_predisposizioni(db_conn=db_conn, batch=batch)
+        return PredisposizioneBatchResponse(message=f"{result['buildings']} edifici predisposti.", **result)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Errore API POST /predisposizioni/batch: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore durante la predisposizione multipla: {str(e)}")
+
+@router.post("/batch/delete", response_model=PredisposizioneBatchResponse)
+async def batch_delete_predisposizioni_endpoint(
+    selection: BuildingSelection,
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
+):
+    """Resetta le predisposizioni selezionate (ids, bbox o polygon) ed elimina le loro TFO con un solo statement."""
+    try:
+        _check_batch_size(selection.ids)
+        result = await crud_predisposizione.batch_delete_predisposizioni(db_conn=db_conn, selection=selection)
+        return PredisposizioneBatchResponse(
+            message=f"{result['buildings']} predisposizioni e {result['tfos_deleted']} TFO associate eliminate/resettate.",
+            **result
+        )
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Errore API POST /predisposizioni/batch/delete: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore durante il reset multiplo delle predisposizioni: {str(e)}")
@@ -1,68 +1,164 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, Body
-from typing import List
-import psycopg2
+from fastapi import APIRouter, Depends, HTTPException, Path, Body, Query, Request
+from pydantic import ValidationError
+from typing import List, Optional
+import asyncpg
+import csv
+import io
+import orjson
 
-from app.crud import crud_tfo
-from app.schemas.tfo import TfoInDB, TfoCreate
+from app.crud import crud_tfo_async as crud_tfo
+from app.crud import crud_data_version_async as crud_data_version
+from app.schemas.tfo import TfoInDB, TfoCreate, TfoBulkResponse, TfoBulkRowResult, TfoBatchResponse
 from app.schemas.common import BaseResponse
-from app.db.database import get_db_connection
+from app.core.config import settings
+from app.core.data_version import cached_conditional_response
+from app.db.async_database import get_async_db_connection
+
+# Le liste di TFO sono serializzate in JSON dal CRUD (righe lette per posizione, orjson):
+# gli endpoint restituiscono direttamente i byte, response_model serve solo alla documentazione OpenAPI
 
 router = APIRouter()
 
+def _parse_bulk_body(content_type: str, body: bytes) -> List[dict]:
+    """Converte il corpo di POST /tfos/bulk (array JSON o CSV con intestazione) in una lista di dict."""
+    if "csv" in content_type:
+        try:
+            text = body.decode("utf-8-sig") # Tollera il BOM dei CSV esportati da Excel
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="Il file CSV deve essere codificato in UTF-8.")
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames:
+            raise HTTPException(status_code=400, detail="Il file CSV non contiene l'intestazione delle colonne.")
+        # Le celle vuote diventano None, come i campi assenti nel JSON
+        return [{k: (v.strip() or None) if isinstance(v, str) else v for k, v in row.items() if k} for row in reader]
+    if "json" in content_type:
+        try:
+            items = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Corpo JSON non valido.")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Il corpo JSON deve essere un array di TFO.")
+        return items
+    raise HTTPException(status_code=415, detail="Formato non supportato: usare application/json o text/csv.")
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc']) or 'riga'}: {err['msg']}" for err in e.errors())
+
 @router.get("/predisposizioni/{predisposizione_id}/tfos", response_model=List[TfoInDB])
-def get_tfos_for_predisposizione_endpoint(
+async def get_tfos_for_predisposizione_endpoint(
+    request: Request,
     predisposizione_id: int = Path(..., description="ID abitazione (predisposizione)"),
-    db_conn: psycopg2.extensions.connection = Depends(get_db_connection) # type: ignore
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
 ):
-    """Restituisce tutte le TFO per un edificio predisposto."""
-    try:
-        return crud_tfo.get_tfos_by_predisposizione_id(db_conn=db_conn, predisposizione_id=predisposizione_id)
-    finally:
-        if db_conn: db_conn.close()
+    """Restituisce tutte le TFO per un edificio predisposto (304 se la copia del client è ancora valida)."""
+    return await cached_conditional_response(
+        request, ("tfos", predisposizione_id),
+        lambda: crud_data_version.get_data_version(db_conn),
+        lambda: crud_tfo.get_tfos_by_predisposizione_id(db_conn=db_conn, predisposizione_id=predisposizione_id)
+    )
+
+@router.get("/batch", response_model=TfoBatchResponse)
+async def get_tfos_batch_endpoint(
+    request: Request,
+    ids: Optional[List[int]] = Query(None, description="ID abitazione (parametro ripetuto: ids=1&ids=2)"),
+    west: Optional[float] = Query(None, description="Longitudine ovest"),
+    south: Optional[float] = Query(None, description="Latitudine sud"),
+    east: Optional[float] = Query(None, description="Longitudine est"),
+    north: Optional[float] = Query(None, description="Latitudine nord"),
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
+):
+    """
+    TFO di più edifici in una richiesta, raggruppate per edificio: per ID (ids) oppure
+    per gli edifici predisposti nel bbox (west, south, east, north). Ogni edificio trovato
+    compare anche senza TFO; gli ID inesistenti sono elencati in not_found.
+    """
+    bbox = (west, south, east, north)
+    has_bbox = any(v is not None for v in bbox)
+    if (ids is not None) == has_bbox:
+        raise HTTPException(status_code=400, detail="Indicare gli ID degli edifici oppure il bbox (west, south, east, north).")
+    if has_bbox and any(v is None for v in bbox):
+        raise HTTPException(status_code=400, detail="Il bbox richiede west, south, east e north.")
+    if ids is not None and len(ids) > settings.TFO_BATCH_MAX_BUILDINGS:
+        raise HTTPException(status_code=413, detail=f"Troppi edifici: massimo {settings.TFO_BATCH_MAX_BUILDINGS} per richiesta.")
+    return await cached_conditional_response(
+        request, ("tfos_batch", tuple(sorted(set(ids))) if ids is not None else bbox),
+        lambda: crud_data_version.get_data_version(db_conn),
+        lambda: crud_tfo.get_tfos_by_buildings(
+            db_conn=db_conn, ids=ids, bbox=bbox if has_bbox else None, max_buildings=settings.TFO_BATCH_MAX_BUILDINGS
+        )
+    )
 
 @router.post("", response_model=TfoInDB, status_code=201) # Endpoint è /tfos
-def create_tfo_endpoint(
+async def create_tfo_endpoint(
     tfo: TfoCreate,
-    db_conn: psycopg2.extensions.connection = Depends(get_db_connection) # type: ignore
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
 ):
     try:
-        return crud_tfo.create_new_tfo(db_conn=db_conn, tfo_data=tfo)
+        return await crud_tfo.create_new_tfo(db_conn=db_conn, tfo_data=tfo)
     except HTTPException as e:
         raise e
     except Exception as e:
         print(f"Errore API POST /tfos: {e}")
         raise HTTPException(status_code=500, detail=f"Errore durante la creazione TFO: {str(e)}")
-    finally:
-        if db_conn: db_conn.close()
+
+@router.post("/bulk", response_model=TfoBulkResponse)
+async def create_tfos_bulk_endpoint(
+    request: Request,
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
+):
+    """
+    Crea più TFO in una richiesta. Il corpo è un array JSON di TFO (application/json)
+    oppure un file CSV con intestazione e le stesse colonne (text/csv).
+    Le righe non valide o su edifici non predisposti sono riportate in results
+    con status "error" senza bloccare l'inserimento delle altre.
+    """
+    try:
+        items = _parse_bulk_body(request.headers.get("content-type", "").lower(), await request.body())
+        if len(items) > settings.TFO_BULK_MAX_ROWS:
+            raise HTTPException(status_code=413, detail=f"Troppe righe: massimo {settings.TFO_BULK_MAX_ROWS} TFO per richiesta.")
+
+        results = []
+        valid_rows = []
+        for position, item in enumerate(items):
+            try:
+                valid_rows.append((position, TfoCreate.model_validate(item)))
+            except ValidationError as e:
+                results.append(TfoBulkRowResult(row=position, status="error", detail=_validation_message(e)))
+        results.extend(await crud_tfo.create_tfos_bulk(db_conn=db_conn, rows=valid_rows))
+        results.sort(key=lambda result: result.row)
+
+        created = sum(1 for result in results if result.status == "created")
+        return TfoBulkResponse(created=created, failed=len(results) - created, results=results)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Errore API POST /tfos/bulk: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore durante la creazione TFO multipla: {str(e)}")
 
 @router.put("/{tfo_id}", response_model=TfoInDB)
-def update_tfo_endpoint(
+async def update_tfo_endpoint(
     tfo_id: int = Path(..., description="ID TFO da aggiornare"),
     tfo_data: TfoCreate = Body(...),
-    db_conn: psycopg2.extensions.connection = Depends(get_db_connection) # type: ignore
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
 ):
     try:
-        return crud_tfo.update_existing_tfo(db_conn=db_conn, tfo_id=tfo_id, tfo_data=tfo_data)
+        return await crud_tfo.update_existing_tfo(db_conn=db_conn, tfo_id=tfo_id, tfo_data=tfo_data)
     except HTTPException as e:
         raise e
     except Exception as e:
         print(f"Errore API PUT /tfos/{tfo_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Errore durante l'aggiornamento TFO: {str(e)}")
-    finally:
-        if db_conn: db_conn.close()
 
 @router.delete("/{tfo_id}", response_model=BaseResponse)
-def delete_tfo_endpoint(
+async def delete_tfo_endpoint(
     tfo_id: int = Path(..., description="ID TFO da eliminare"),
-    db_conn: psycopg2.extensions.connection = Depends(get_db_connection) # type: ignore
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
 ):
     try:
-        crud_tfo.delete_tfo_by_id(db_conn=db_conn, tfo_id=tfo_id)
+        await crud_tfo.delete_tfo_by_id(db_conn=db_conn, tfo_id=tfo_id)
         return BaseResponse(message=f"TFO ID {tfo_id} eliminata.")
     except HTTPException as e:
         raise e
     except Exception as e:
         print(f"Errore API DELETE /tfos/{tfo_id}: {e}")
-        raise HTTPException(status_code=500, detail=f"Errore durante l'eliminazione TFO: {str(e)}")
-    finally:
-        if db_conn: db_conn.close()
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Errore durante l'eliminazione TFO: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Depends, HTTPException, Path, Request, Response
+import asyncpg # Per il type hint della connessione
+
+from app.core.config import settings
+from app.crud import crud_tiles, crud_tiles_async
+from app.crud import crud_data_version_async as crud_data_version
+from app.core.data_version import make_validators, conditional_headers, is_not_modified, not_modified_response, same_version
+from app.core.response_cache import response_cache, tile_to_bbox
+from app.db.async_database import get_async_db_connection
+
+router = APIRouter()
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+def _tile_headers(validators) -> dict:
+    # Senza la versione dei dati (database non aggiornato) la tile non ha validatori:
+    # il browser la riusa per TILE_CACHE_MAX_AGE secondi senza rivalidarla
+    return conditional_headers(validators) or {"Cache-Control": f"public, max-age={settings.TILE_CACHE_MAX_AGE}"}
+
+@router.get("/{z}/{x}/{y}.mvt")
+async def get_tile_endpoint(
+    request: Request,
+    z: int = Path(..., ge=0, le=22, description="Livello di zoom"),
+    x: int = Path(..., ge=0, description="Colonna della tile (schema XYZ)"),
+    y: int = Path(..., ge=0, description="Riga della tile (schema XYZ)"),
+    db_conn: asyncpg.Connection = Depends(get_async_db_connection)
+):
+    """
+    Restituisce una tile vettoriale (MVT) degli edifici, con layer 'edifici' e 'centroidi'.
+    Come /geojson/bbox la risposta ha ETag/Last-Modified legati alla versione dei dati e
+    Cache-Control: no-cache: il browser conserva la tile e la rivalida, ricevendo 304 senza
+    corpo finché i dati non cambiano.
+    """
+    if x >= 2 ** z or y >= 2 ** z:
+        raise HTTPException(status_code=400, detail=f"Tile {z}/{x}/{y} fuori dalla griglia per lo zoom {z}.")
+    cache_key = ("mvt", z, x, y)
+    # Versione letta prima della tile, anche se è in cache: la cache non vede le scritture degli altri processi
+    validators = make_validators(await crud_data_version.get_data_version(db_conn), cache_key)
+    if is_not_modified(request, validators):
+        return not_modified_response(validators)
+    cached = response_cache.get_entry(cache_key)
+    if cached is not None and same_version(cached[1], validators):
+        return Response(content=cached[0], media_type=MVT_MEDIA_TYPE, headers=_tile_headers(validators))
+    generation = response_cache.generation
+    try:
+        tile = await crud_tiles_async.get_tile(db_conn=db_conn, z=z, x=x, y=y)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Errore API /tiles/{z}/{x}/{y}.mvt: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore interno del server nella generazione della tile: {str(e)}")
+    # L'estensione include il buffer della tile: anche gli edifici appena fuori ne modificano il contenuto
+    west, south, east, north = tile_to_bbox(z, x, y)
+    margin_x = (east - west) * crud_tiles.MVT_BUFFER / crud_tiles.MVT_EXTENT
+    margin_y = (north - south) * crud_tiles.MVT_BUFFER / crud_tiles.MVT_EXTENT
+    response_cache.put(cache_key, tile, (west - margin_x, south - margin_y, east + margin_x, north + margin_y),
+                       generation, meta=validators)
+    return Response(content=tile, media_type=MVT_MEDIA_TYPE, headers=_tile_headers(validators))
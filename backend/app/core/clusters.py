@@ -0,0 +1,165 @@
+"""
+Aggregati per cella della vista a cluster (GET /clusters), usata agli zoom bassi
+in cui la mappa non carica i singoli edifici.
+
+Ogni zoom della mappa ha la sua griglia: le celle sono le tile Web Mercator allo zoom
+z + CLUSTER_CELL_ZOOM_OFFSET (con offset 2, celle da 64px su tile da 256px). Ogni cella
+non vuota ha una riga in catasto_cluster_celle con gli edifici attivi, i predisposti,
+le TFO e la somma delle coordinate dei centroidi (il cluster è disegnato nel baricentro
+degli edifici, non al centro della cella).
+
+I trigger creati da scripts/load_initial_data.py non toccano le celle: accodano i delta
+delle righe scritte, per cella della griglia più fine, in catasto_cluster_delta (solo INSERT,
+quindi nessuna riga contesa tra scritture concorrenti, neanche le poche celle degli zoom bassi).
+GET /clusters somma alle celle i delta ancora in coda; consolida_cluster_delta(), chiamata
+periodicamente dal backend e a fine caricamento, li sposta nelle celle in una sola transazione,
+aggiornandole in ordine (zoom, cell_x, cell_y) e con un solo consolidamento alla volta.
+ricalcola_cluster_celle() ricostruisce le celle da zero e svuota la coda.
+"""
+
+from app.core.response_cache import MAX_MERCATOR_LAT
+
+CLUSTER_TABLE = "catasto_cluster_celle"
+CLUSTER_DELTA_TABLE = "catasto_cluster_delta"
+CLUSTER_MIN_ZOOM = 0
+CLUSTER_MAX_ZOOM = 13 # Dallo zoom 14 la mappa mostra i singoli edifici
+CLUSTER_CELL_ZOOM_OFFSET = 2
+# Advisory lock che serializza consolidamento e ricostruzione delle celle
+CLUSTER_LOCK_SQL = f"hashtext('{CLUSTER_TABLE}')"
+
+
+def cell_zoom(zoom: int) -> int:
+    """Zoom delle tile usate come celle per lo zoom della mappa indicato."""
+    return zoom + CLUSTER_CELL_ZOOM_OFFSET
+
+
+def cell_expressions(lon: str, lat: str, grid_zoom: str) -> tuple:
+    """Espressioni SQL (x, y) della tile che contiene (lon, lat): stessa formula di lonlat_to_tile."""
+    n = f"power(2::float8, {grid_zoom})"
+    clamped_lat = f"radians(LEAST(GREATEST({lat}, -{MAX_MERCATOR_LAT}), {MAX_MERCATOR_LAT}))"
+    x = f"LEAST(GREATEST(floor(({lon} + 180.0) / 360.0 * {n})::int, 0), {n}::int - 1)"
+    y = f"LEAST(GREATEST(floor((1.0 - asinh(tan({clamped_lat})) / pi()) / 2.0 * {n})::int, 0), {n}::int - 1)"
+    return x, y
+
+
+def cluster_table_sql() -> str:
+    return f"""
+    CREATE TABLE IF NOT EXISTS {CLUSTER_TABLE} (
+        zoom SMALLINT NOT NULL, -- Zoom della mappa
+        cell_x INTEGER NOT NULL, -- Tile allo zoom zoom + {CLUSTER_CELL_ZOOM_OFFSET}
+        cell_y INTEGER NOT NULL,
+        buildings INTEGER NOT NULL DEFAULT 0,
+        predisposti INTEGER NOT NULL DEFAULT 0,
+        tfos INTEGER NOT NULL DEFAULT 0,
+        sum_lon DOUBLE PRECISION NOT NULL DEFAULT 0, -- Somma delle coordinate dei centroidi
+        sum_lat DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (zoom, cell_x, cell_y)
+    );
+    -- Coda dei delta non ancora consolidati, per cella allo zoom {CLUSTER_MAX_ZOOM}: solo INSERT dai trigger
+    CREATE TABLE IF NOT EXISTS {CLUSTER_DELTA_TABLE} (
+        cell_x INTEGER NOT NULL,
+        cell_y INTEGER NOT NULL,
+        buildings INTEGER NOT NULL,
+        predisposti INTEGER NOT NULL,
+        tfos INTEGER NOT NULL,
+        sum_lon DOUBLE PRECISION NOT NULL,
+        sum_lat DOUBLE PRECISION NOT NULL
+    );
+    """
+
+
+def cluster_delta_insert_sql(delta_sql: str) -> str:
+    """
+    Accoda i delta prodotti da delta_sql, che deve restituire le colonne centroide,
+    buildings, predisposti, tfos (valori negativi per le righe rimosse), sommati per cella
+    della griglia più fine. Le celle degli zoom minori si ottengono dimezzando gli indici
+    (>> 1 per ogni zoom), come in ricalcola_cluster_celle().
+    """
+    x, y = cell_expressions("ST_X(delta.centroide)", "ST_Y(delta.centroide)", str(cell_zoom(CLUSTER_MAX_ZOOM)))
+    return f"""
+    INSERT INTO {CLUSTER_DELTA_TABLE} (cell_x, cell_y, buildings, predisposti, tfos, sum_lon, sum_lat)
+    SELECT {x}, {y}, sum(delta.buildings), sum(delta.predisposti), sum(delta.tfos),
+           sum(delta.buildings * ST_X(delta.centroide)), sum(delta.buildings * ST_Y(delta.centroide))
+    FROM ({delta_sql}) delta
+    WHERE delta.centroide IS NOT NULL
+    GROUP BY 1, 2;
+    """
+
+
+def cluster_fold_sql() -> str:
+    """
+    Funzione consolida_cluster_delta(): sposta nelle celle di tutti gli zoom i delta in coda
+    e restituisce quante righe di coda ha consolidato. DELETE e upsert sono nella stessa
+    transazione, quindi chi legge vede i delta o in coda o nelle celle, mai in entrambe o in nessuna;
+    i delta accodati da transazioni non ancora concluse restano per il consolidamento successivo.
+    Se un altro consolidamento è in corso restituisce 0 senza attendere.
+    """
+    return f"""
+    CREATE OR REPLACE FUNCTION consolida_cluster_delta()
+    RETURNS integer AS $$
+    DECLARE
+      folded integer;
+    BEGIN
+      IF NOT pg_try_advisory_xact_lock({CLUSTER_LOCK_SQL}) THEN
+        RETURN 0;
+      END IF;
+      WITH moved AS (
+        DELETE FROM {CLUSTER_DELTA_TABLE} RETURNING *
+      ), upserted AS (
+        INSERT INTO {CLUSTER_TABLE} AS t (zoom, cell_x, cell_y, buildings, predisposti, tfos, sum_lon, sum_lat)
+        SELECT z.zoom, m.cell_x >> ({CLUSTER_MAX_ZOOM} - z.zoom), m.cell_y >> ({CLUSTER_MAX_ZOOM} - z.zoom),
+               sum(m.buildings), sum(m.predisposti), sum(m.tfos), sum(m.sum_lon), sum(m.sum_lat)
+        FROM moved m
+        CROSS JOIN generate_series({CLUSTER_MIN_ZOOM}, {CLUSTER_MAX_ZOOM}) AS z(zoom)
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3 -- Righe bloccate sempre nello stesso ordine
+        ON CONFLICT (zoom, cell_x, cell_y) DO UPDATE SET
+            buildings = t.buildings + EXCLUDED.buildings,
+            predisposti = t.predisposti + EXCLUDED.predisposti,
+            tfos = t.tfos + EXCLUDED.tfos,
+            sum_lon = t.sum_lon + EXCLUDED.sum_lon,
+            sum_lat = t.sum_lat + EXCLUDED.sum_lat
+        RETURNING 1
+      )
+      SELECT count(*) INTO folded FROM moved;
+      RETURN folded;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+
+
+def cluster_rebuild_sql() -> str:
+    """Funzione ricalcola_cluster_celle(): ricostruisce la tabella dagli edifici attivi e dalle TFO."""
+    x, y = cell_expressions("ST_X(c.centroide)", "ST_Y(c.centroide)", str(cell_zoom(CLUSTER_MAX_ZOOM)))
+    return f"""
+    CREATE OR REPLACE FUNCTION ricalcola_cluster_celle()
+    RETURNS void AS $$
+    DECLARE
+      z INTEGER;
+    BEGIN
+      PERFORM pg_advisory_xact_lock({CLUSTER_LOCK_SQL});
+      -- I delta in coda sono già compresi nel ricalcolo dagli edifici
+      TRUNCATE {CLUSTER_TABLE}, {CLUSTER_DELTA_TABLE};
+      -- Griglia più fine calcolata dagli edifici...
+      INSERT INTO {CLUSTER_TABLE} (zoom, cell_x, cell_y, buildings, predisposti, tfos, sum_lon, sum_lat)
+      SELECT {CLUSTER_MAX_ZOOM}, {x}, {y},
+             count(*), sum((c.predisposto_fibra IS TRUE)::int), sum(COALESCE(t.tfos, 0)),
+             sum(ST_X(c.centroide)), sum(ST_Y(c.centroide))
+      FROM catasto_abitazioni c
+      LEFT JOIN (
+        SELECT id_abitazione, count(*)::int AS tfos FROM verifiche_edifici
+        WHERE id_tfo IS NOT NULL GROUP BY id_abitazione
+      ) t ON t.id_abitazione = c.id
+      WHERE c.centroide IS NOT NULL AND c.retired_at IS NULL
+      GROUP BY 2, 3;
+      -- ...le altre sommando le quattro celle figlie dello zoom successivo
+      FOR z IN REVERSE {CLUSTER_MAX_ZOOM - 1}..{CLUSTER_MIN_ZOOM} LOOP
+        INSERT INTO {CLUSTER_TABLE} (zoom, cell_x, cell_y, buildings, predisposti, tfos, sum_lon, sum_lat)
+        SELECT z, cell_x >> 1, cell_y >> 1, sum(buildings), sum(predisposti), sum(tfos), sum(sum_lon), sum(sum_lat)
+        FROM {CLUSTER_TABLE}
+        WHERE zoom = z + 1
+        GROUP BY 2, 3;
+      END LOOP;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
@@ -24,4 +24,58 @@ class Settings(BaseSettings):
         'port': POSTGRES_PORT
     }
 
+    # Pool asyncpg usato dagli endpoint async (app/db/async_database.py). Le connessioni non
+    # occupano thread, quindi il pool può essere più grande del threadpool degli endpoint sincroni
+    ASYNC_DB_POOL_MIN_SIZE: int = int(os.getenv("ASYNC_DB_POOL_MIN_SIZE", "5"))
+    ASYNC_DB_POOL_MAX_SIZE: int = int(os.getenv("ASYNC_DB_POOL_MAX_SIZE", "40"))
+    # Secondi di attesa massima per una connessione libera, poi 503 (DB_POOL_TIMEOUT è il vecchio nome)
+    ASYNC_DB_POOL_TIMEOUT: float = float(os.getenv("ASYNC_DB_POOL_TIMEOUT", os.getenv("DB_POOL_TIMEOUT", "10")))
+    ASYNC_DB_POOL_MAX_INACTIVE_LIFETIME: float = float(os.getenv("ASYNC_DB_POOL_MAX_INACTIVE_LIFETIME", "300")) # Secondi
+    # Secondi di inattività dopo cui una connessione è verificata con SELECT 1 prima di essere prestata (0 = sempre)
+    ASYNC_DB_POOL_HEALTH_CHECK_IDLE: float = float(os.getenv("ASYNC_DB_POOL_HEALTH_CHECK_IDLE", "30"))
+    ASYNC_DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("ASYNC_DB_STATEMENT_CACHE_SIZE", "100")) # Statement preparati per connessione
+
+    # Secondi tra due consolidamenti dei delta dei cluster in catasto_cluster_celle (0 = mai, vedi app/core/clusters.py)
+    CLUSTER_DELTA_FOLD_INTERVAL: float = float(os.getenv("CLUSTER_DELTA_FOLD_INTERVAL", "30"))
+
+    # Secondi per cui il browser può riutilizzare una tile /tiles/{z}/{x}/{y}.mvt senza richiederla,
+    # solo se il database non ha la versione dei dati (altrimenti ETag e no-cache, vedi app/apis/tiles.py)
+    TILE_CACHE_MAX_AGE: int = int(os.getenv("TILE_CACHE_MAX_AGE", "60"))
+
+    # Cache in-process delle risposte bbox/tile (app/core/response_cache.py)
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "300")) # Secondi
+
+    # Compressione delle risposte (app/core/compression.py): brotli se installato, altrimenti gzip
+    COMPRESSION_MIN_SIZE: int = int(os.getenv("COMPRESSION_MIN_SIZE", "1024")) # Byte sotto cui la risposta non è compressa
+    COMPRESSION_GZIP_LEVEL: int = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+    COMPRESSION_BROTLI_QUALITY: int = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+
+    # Metriche Prometheus su GET /metrics (app/core/metrics.py) e log delle richieste lente
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+    SLOW_REQUEST_THRESHOLD_MS: float = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "0")) # 0 = log disattivato
+    SERVER_TIMING_ENABLED: bool = os.getenv("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+
+    # Righe lette per ogni FETCH dal cursore lato server in /geojson/bbox?stream=true
+    GEOJSON_STREAM_CHUNK_SIZE: int = int(os.getenv("GEOJSON_STREAM_CHUNK_SIZE", "500"))
+
+    # Paginazione keyset di /geojson/bbox
+    GEOJSON_PAGE_SIZE: int = int(os.getenv("GEOJSON_PAGE_SIZE", "3000"))
+    GEOJSON_MAX_PAGE_SIZE: int = int(os.getenv("GEOJSON_MAX_PAGE_SIZE", "10000"))
+
+    # Righe massime accettate da un singolo POST /tfos/bulk
+    TFO_BULK_MAX_ROWS: int = int(os.getenv("TFO_BULK_MAX_ROWS", "5000"))
+
+    # Edifici massimi per richiesta di GET /tfos/batch (ID indicati o edifici predisposti nel bbox)
+    TFO_BATCH_MAX_BUILDINGS: int = int(os.getenv("TFO_BATCH_MAX_BUILDINGS", "1000"))
+
+    # Edifici massimi indicati per ID (items/ids) in una singola operazione multipla su /predisposizioni
+    PREDISPOSIZIONI_BATCH_MAX_ITEMS: int = int(os.getenv("PREDISPOSIZIONI_BATCH_MAX_ITEMS", "5000"))
+
+    # Paginazione keyset di GET /predisposizioni e limite del conteggio delle righe filtrate
+    PREDISPOSIZIONI_PAGE_SIZE: int = int(os.getenv("PREDISPOSIZIONI_PAGE_SIZE", "50"))
+    PREDISPOSIZIONI_MAX_PAGE_SIZE: int = int(os.getenv("PREDISPOSIZIONI_MAX_PAGE_SIZE", "500"))
+    PREDISPOSIZIONI_COUNT_LIMIT: int = int(os.getenv("PREDISPOSIZIONI_COUNT_LIMIT", "10000"))
+
 settings = Settings()
\ No newline at end of file
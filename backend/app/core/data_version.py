@@ -0,0 +1,167 @@
+"""
+Versione dei dati per le richieste condizionali (ETag / Last-Modified, risposta 304).
+
+Il database tiene il contatore in DATA_VERSION_SLOTS righe, incrementate dai trigger
+FOR EACH STATEMENT su catasto_abitazioni e verifiche_edifici creati da
+scripts/load_initial_data.py: ogni scrittura, dall'API, dal loader o diretta sul DB,
+incrementa la riga scelta dal pid della sessione, quindi transazioni concorrenti non
+attendono il lock della stessa riga. La versione è la somma delle righe: cresce a ogni
+scrittura e, dato che l'incremento avviene nella stessa transazione, diventa visibile
+insieme ai dati (una sequenza no: nextval è visibile subito, prima del commit, e un
+lettore potrebbe associare la nuova versione ai dati vecchi).
+Il contatore è letto prima della query dei dati: una risposta con ETag della versione V
+contiene dati almeno aggiornati a V.
+
+La versione è letta a ogni richiesta (una lettura di DATA_VERSION_SLOTS righe): la cache
+delle risposte (app/core/response_cache.py) è del singolo processo e non vede le scritture
+degli altri worker, del loader o dirette sul DB, quindi una voce in cache è usata solo se
+è stata prodotta alla versione corrente (stesso ETag), altrimenti viene ricalcolata.
+
+L'ETag combina la versione con la chiave della risposta (parametri normalizzati); il client
+lo rimanda in If-None-Match e, se la versione non è cambiata, riceve 304 senza che la
+query delle feature venga eseguita.
+"""
+
+import datetime
+import hashlib
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Hashable, Optional, Tuple
+
+from fastapi import Request, Response
+
+from app.core.response_cache import response_cache, WORLD_BBOX
+
+DATA_VERSION_TABLE = "fibragis_versione_dati_slot"
+# Tabella di una sola riga delle versioni precedenti: la sua versione viene riportata nelle nuove righe
+LEGACY_DATA_VERSION_TABLE = "fibragis_versione_dati"
+DATA_VERSION_SLOTS = 16
+
+# (ETag, Last-Modified in formato HTTP o None)
+Validators = Tuple[str, Optional[str]]
+
+
+def data_version_table_sql() -> str:
+    # La versione della tabella di una riga prosegue nella nuova: gli ETag già inviati ai client
+    # non possono coincidere con quelli di dati diversi
+    return f"""
+    CREATE TABLE IF NOT EXISTS {DATA_VERSION_TABLE} (
+        slot SMALLINT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    INSERT INTO {DATA_VERSION_TABLE} (slot)
+    SELECT generate_series(0, {DATA_VERSION_SLOTS - 1}) ON CONFLICT (slot) DO NOTHING;
+    DO $$
+    BEGIN
+      IF to_regclass('{LEGACY_DATA_VERSION_TABLE}') IS NOT NULL THEN
+        UPDATE {DATA_VERSION_TABLE} SET version = version + (SELECT max(version) FROM {LEGACY_DATA_VERSION_TABLE})
+        WHERE slot = 0;
+        DROP TABLE {LEGACY_DATA_VERSION_TABLE};
+      END IF;
+    END $$;
+    """
+
+
+def data_version_bump_sql() -> str:
+    return (f"UPDATE {DATA_VERSION_TABLE} SET version = version + 1, updated_at = clock_timestamp() "
+            f"WHERE slot = pg_backend_pid() % {DATA_VERSION_SLOTS};")
+
+
+def data_version_trigger_function_sql() -> str:
+    return f"""
+    CREATE OR REPLACE FUNCTION incrementa_versione_dati()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      {data_version_bump_sql()}
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+
+
+# recent: aggiornata meno di un secondo fa. Last-Modified ha la risoluzione del secondo:
+# un'altra scrittura nello stesso secondo non lo cambierebbe, quindi in quel caso non viene inviato
+DATA_VERSION_SQL = f"""
+    SELECT sum(version)::bigint AS version, max(updated_at) AS updated_at,
+           max(updated_at) > clock_timestamp() - interval '1 second' AS recent
+    FROM {DATA_VERSION_TABLE}
+    HAVING count(*) > 0;
+"""
+
+
+def make_validators(row, key: Hashable) -> Optional[Validators]:
+    """ETag e Last-Modified della risposta identificata da key alla versione letta (row), None se assente."""
+    if row is None:
+        return None
+    digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8).hexdigest()
+    # ETag debole: il corpo può essere ricompresso o serializzato in modo diverso a parità di dati
+    etag = f'W/"{row["version"]}-{digest}"'
+    last_modified = None
+    if not row["recent"]:
+        last_modified = format_datetime(row["updated_at"].astimezone(datetime.timezone.utc), usegmt=True)
+    return etag, last_modified
+
+
+def conditional_headers(validators: Optional[Validators]) -> dict:
+    if validators is None:
+        return {}
+    etag, last_modified = validators
+    # no-cache: il browser può conservare la risposta ma deve sempre rivalidarla
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return headers
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Confronto debole (RFC 9110): il prefisso W/ non conta
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def is_not_modified(request: Request, validators: Optional[Validators]) -> bool:
+    """True se la copia del client è ancora valida. If-Modified-Since vale solo senza If-None-Match."""
+    if validators is None:
+        return False
+    etag, last_modified = validators
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified_response(validators: Validators) -> Response:
+    return Response(status_code=304, headers=conditional_headers(validators))
+
+
+def same_version(cached: Optional[Validators], current: Optional[Validators]) -> bool:
+    """True se la voce in cache è stata prodotta alla versione corrente (Last-Modified può cambiare da solo)."""
+    return (cached[0] if cached else None) == (current[0] if current else None)
+
+
+async def cached_conditional_response(request: Request, key: Hashable, read_version, build_body,
+                                      media_type: str = "application/json") -> Response:
+    """
+    Risposta con ETag per le liste non spaziali (TFO, predisposizioni), dalla cache delle
+    risposte quando è ancora della versione corrente. read_version e build_body sono funzioni
+    asincrone senza argomenti: la versione è letta sempre, prima dei dati.
+    Le voci coprono WORLD_BBOX, quindi qualunque scrittura dall'API di questo processo le invalida.
+    """
+    validators = make_validators(await read_version(), key)
+    if is_not_modified(request, validators):
+        return not_modified_response(validators)
+    cached = response_cache.get_entry(key)
+    if cached is not None and same_version(cached[1], validators):
+        return Response(content=cached[0], media_type=media_type, headers=conditional_headers(validators))
+    generation = response_cache.generation
+    body = await build_body()
+    response_cache.put(key, body, WORLD_BBOX, generation, meta=validators)
+    return Response(content=body, media_type=media_type, headers=conditional_headers(validators))
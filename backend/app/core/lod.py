@@ -0,0 +1,73 @@
+"""
+Livelli di dettaglio (LOD) delle geometrie servite da /geojson/bbox in base allo zoom.
+
+Le tolleranze sono in gradi (SRID 4326) e pari a circa mezzo pixel di una tile
+Web Mercator da 256px al minimo zoom della fascia (≈ 360 / (256 * 2^z) / 2):
+sotto questa soglia la semplificazione non è visibile a schermo.
+La precisione delle coordinate segue lo stesso criterio (un decimo di pixel).
+"""
+
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+@dataclass(frozen=True)
+class LodLevel:
+    name: str
+    min_zoom: int
+    centroids_only: bool # True = nessun poligono, solo i centroidi
+    tolerance: float # Tolleranza ST_SimplifyPreserveTopology in gradi (0 = geometria originale)
+    precision: int # Cifre decimali passate a ST_AsGeoJSON
+    drop_z: bool # True = ST_Force2D sulla geometria
+    precomputed_column: Optional[str] = None # Colonna semplificata calcolata dal loader, se presente
+
+
+# Ordinati per min_zoom crescente
+LOD_LEVELS: List[LodLevel] = [
+    LodLevel(name="centroidi", min_zoom=0, centroids_only=True, tolerance=0.0, precision=5, drop_z=True),
+    LodLevel(name="z14", min_zoom=14, centroids_only=False, tolerance=0.00004, precision=6, drop_z=True,
+             precomputed_column="geometry_lod_14"),
+    LodLevel(name="z16", min_zoom=16, centroids_only=False, tolerance=0.00001, precision=7, drop_z=True,
+             precomputed_column="geometry_lod_16"),
+    LodLevel(name="z18", min_zoom=18, centroids_only=False, tolerance=0.0, precision=8, drop_z=True),
+]
+
+# Livelli le cui geometrie semplificate possono essere precalcolate da scripts/load_initial_data.py
+PRECOMPUTED_LOD_LEVELS: List[LodLevel] = [level for level in LOD_LEVELS if level.precomputed_column]
+
+
+def get_lod_level(zoom: int) -> LodLevel:
+    """Restituisce il livello di dettaglio da usare per lo zoom richiesto."""
+    selected = LOD_LEVELS[0]
+    for level in LOD_LEVELS:
+        if zoom >= level.min_zoom:
+            selected = level
+    return selected
+
+
+def simplified_geometry_expression(level: LodLevel, source: str = "geometry") -> str:
+    """Espressione SQL che semplifica `source` secondo il livello (usata anche dal loader)."""
+    expr = source
+    if level.drop_z:
+        expr = f"ST_Force2D({expr})"
+    if level.tolerance > 0:
+        expr = f"ST_Multi(ST_SimplifyPreserveTopology({expr}, {level.tolerance!r}))"
+    return expr
+
+
+def geometry_source_expression(level: LodLevel, available_columns: List[str], table_alias: str = "c") -> str:
+    """
+    Espressione SQL della geometria del poligono per il livello:
+    usa la colonna precalcolata se esiste, altrimenti semplifica al volo.
+    """
+    if level.precomputed_column and level.precomputed_column in available_columns:
+        return f"{table_alias}.{level.precomputed_column}"
+    return simplified_geometry_expression(level, f"{table_alias}.geometry")
+
+
+def geometry_geojson_expression(level: LodLevel, available_columns: List[str], table_alias: str = "c") -> str:
+    """Espressione SQL che produce il GeoJSON del poligono per il livello."""
+    source = geometry_source_expression(level, available_columns, table_alias)
+    # Geometrie nulle o vuote diventano NULL già nel DB: il chiamante le scarta senza parsare il JSON.
+    # ST_IsValid non è usato qui perché ricalcolarlo ad ogni richiesta costa più della serializzazione.
+    return f"CASE WHEN ST_IsEmpty({source}) THEN NULL ELSE ST_AsGeoJSON({source}, {level.precision}) END"
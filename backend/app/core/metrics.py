@@ -0,0 +1,301 @@
+"""
+Metriche delle richieste in formato Prometheus (testo, versione 0.0.4), esposte da GET /metrics.
+
+Per ogni richiesta MetricsMiddleware registra la latenza e i byte inviati (dopo la
+compressione) con il template della route come etichetta (/tfos/{tfo_id}, non l'URL),
+così il numero di serie resta fisso. Le funzioni CRUD async misurano separatamente
+le query (timed_query: tempo di attesa del database e righe restituite) e la
+costruzione dei byte della risposta (serialization_timer): confrontando i tre tempi
+si vede se una richiesta lenta paga PostGIS, Python o la rete.
+
+Con SLOW_REQUEST_THRESHOLD_MS > 0 le richieste più lente della soglia sono stampate
+con i parametri (bbox, ids, cursore) e la ripartizione dei tempi; l'intestazione
+Server-Timing riporta la stessa ripartizione agli strumenti di sviluppo del browser.
+
+Implementazione senza dipendenze: istogrammi e contatori con un lock, come la cache delle risposte.
+"""
+
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+ROWS_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+INF_BUCKET = 'le="+Inf"'
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Istogramma cumulativo con etichette, thread-safe."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {} # valori etichette -> [conteggi per bucket..., somma, conteggio]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self) -> list:
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, INF_BUCKET)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """Contatore con etichette, thread-safe."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._series: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def collect(self) -> list:
+        with self._lock:
+            snapshot = dict(self._series)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+def gauge_lines(name: str, documentation: str, values: Dict[str, float], label: str) -> list:
+    """Gauge letti al momento dello scrape (es. statistiche del pool e della cache)."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for key, value in sorted(values.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        lines.append(f"{name}{_format_labels((label,), (key,))} {_format_value(value)}")
+    return lines
+
+
+REQUEST_DURATION = Histogram(
+    "fibragis_http_request_duration_seconds", "Durata delle richieste HTTP fino all'ultimo byte inviato.",
+    ("method", "route", "status"), LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "fibragis_http_response_size_bytes", "Byte del corpo delle risposte inviati al client (dopo la compressione).",
+    ("method", "route"), SIZE_BUCKETS,
+)
+DB_QUERY_DURATION = Histogram(
+    "fibragis_db_query_duration_seconds", "Tempo di attesa delle query sul database, per query CRUD.",
+    ("query",), LATENCY_BUCKETS,
+)
+DB_ROWS = Histogram(
+    "fibragis_db_rows", "Righe restituite (o modificate) dalle query CRUD.",
+    ("query",), ROWS_BUCKETS,
+)
+DB_ERRORS = Counter(
+    "fibragis_db_query_errors_total", "Query CRUD terminate con un'eccezione.", ("query",),
+)
+SERIALIZATION_DURATION = Histogram(
+    "fibragis_serialization_duration_seconds", "Tempo di costruzione dei byte della risposta dalle righe lette.",
+    ("query",), LATENCY_BUCKETS,
+)
+SLOW_REQUESTS = Counter(
+    "fibragis_http_slow_requests_total", "Richieste oltre SLOW_REQUEST_THRESHOLD_MS.", ("method", "route"),
+)
+
+
+class RequestTimings:
+    """Tempi di database e serializzazione accumulati durante una richiesta."""
+
+    __slots__ = ("db", "serialization", "queries", "rows")
+
+    def __init__(self):
+        self.db = 0.0
+        self.serialization = 0.0
+        self.queries = 0
+        self.rows = 0
+
+
+# Oggetto mutabile: i task figli (es. il corpo di una StreamingResponse) copiano il contesto
+# ma aggiornano la stessa istanza della richiesta
+_current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings", default=None)
+
+
+def _row_count(result) -> int:
+    """Righe di un risultato asyncpg: lista di record, record singolo, valore o stato di execute ('DELETE 3')."""
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, str):
+        tail = result.rsplit(" ", 1)[-1]
+        return int(tail) if tail.isdigit() else 0
+    return 1
+
+
+async def timed_query(name: str, awaitable):
+    """
+    Attende una chiamata asyncpg (fetch, fetchrow, fetchval, execute) registrandone la durata
+    e le righe restituite (o modificate, dallo stato di execute) con l'etichetta name.
+    """
+    start = time.perf_counter()
+    try:
+        result = await awaitable
+    except Exception:
+        DB_ERRORS.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        DB_QUERY_DURATION.observe(elapsed, name)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.db += elapsed
+            timings.queries += 1
+    count = _row_count(result)
+    DB_ROWS.observe(count, name)
+    if timings is not None:
+        timings.rows += count
+    return result
+
+
+class serialization_timer:
+    """Context manager che misura la costruzione della risposta: with serialization_timer("tfos_by_building"): ..."""
+
+    __slots__ = ("name", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        SERIALIZATION_DURATION.observe(elapsed, self.name)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.serialization += elapsed
+        return False
+
+
+def _route_template(scope) -> str:
+    # Le route dei router inclusi restano senza prefisso (/{tfo_id}): il template completo
+    # (/tfos/{tfo_id}) è nel contesto della route effettiva che FastAPI aggiunge allo scope
+    context = (scope.get("fastapi") or {}).get("effective_route_context")
+    route = scope.get("route")
+    path = getattr(context, "path", None) or getattr(route, "path_format", None)
+    # Richieste senza route (404, file statici): un'unica etichetta per non moltiplicare le serie
+    return path or "<non trovata>"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI più esterno: misura la richiesta fino all'ultimo byte inviato,
+    conta i byte del corpo già compressi e scrive il log delle richieste lente.
+    """
+
+    def __init__(self, app, slow_threshold_ms: float = 0, server_timing: bool = True):
+        self.app = app
+        self.slow_threshold = slow_threshold_ms / 1000.0
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+        body_bytes = 0
+
+        async def send_wrapper(message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    # Tempi fino all'invio delle intestazioni: con lo streaming la query continua dopo
+                    app_time = time.perf_counter() - start - timings.db - timings.serialization
+                    server_timing = (f"db;dur={timings.db * 1000:.1f}, ser;dur={timings.serialization * 1000:.1f}, "
+                                     f"app;dur={max(app_time, 0) * 1000:.1f}")
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", server_timing.encode())]}
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_timings.reset(token)
+            method, route = scope["method"], _route_template(scope)
+            REQUEST_DURATION.observe(elapsed, method, route, str(status))
+            RESPONSE_SIZE.observe(body_bytes, method, route)
+            if self.slow_threshold and elapsed >= self.slow_threshold:
+                SLOW_REQUESTS.inc(method, route)
+                self._log_slow(scope, status, elapsed, body_bytes, timings)
+
+    @staticmethod
+    def _log_slow(scope, status: int, elapsed: float, body_bytes: int, timings: RequestTimings) -> None:
+        query_string = scope.get("query_string", b"").decode("latin-1")
+        target = scope["path"] + (f"?{query_string}" if query_string else "")
+        other = elapsed - timings.db - timings.serialization
+        print(
+            f"Richiesta lenta: {scope['method']} {target} -> {status} in {elapsed * 1000:.0f} ms "
+            f"(database {timings.db * 1000:.0f} ms in {timings.queries} query, {timings.rows} righe; "
+            f"serializzazione {timings.serialization * 1000:.0f} ms; altro/rete {other * 1000:.0f} ms; "
+            f"{body_bytes} byte inviati)"
+        )
+
+
+def render_metrics(extra_lines=()) -> bytes:
+    """Tutte le metriche nel formato testuale di Prometheus."""
+    lines = []
+    for metric in (REQUEST_DURATION, RESPONSE_SIZE, SLOW_REQUESTS, DB_QUERY_DURATION, DB_ROWS, DB_ERRORS,
+                   SERIALIZATION_DURATION):
+        lines.extend(metric.collect())
+    lines.extend(extra_lines)
+    return ("\n".join(lines) + "\n").encode()
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
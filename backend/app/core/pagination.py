@@ -0,0 +1,29 @@
+"""
+Cursori opachi per la paginazione keyset.
+
+Il cursore è la posizione dell'ultimo elemento restituito (es. {"id": 1234})
+codificata in base64 URL-safe: il client lo rimanda così com'è per ottenere
+la pagina successiva, senza OFFSET.
+"""
+
+import base64
+import binascii
+
+import orjson
+from fastapi import HTTPException
+
+
+def encode_cursor(position: dict) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(position)).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Decodifica un cursore ricevuto dal client; HTTP 400 se non valido."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = orjson.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, ValueError, UnicodeEncodeError):
+        raise HTTPException(status_code=400, detail="Cursore di paginazione non valido.")
+    if not isinstance(position, dict):
+        raise HTTPException(status_code=400, detail="Cursore di paginazione non valido.")
+    return position
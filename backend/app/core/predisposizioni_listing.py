@@ -0,0 +1,59 @@
+"""
+Ordinamenti e indici della lista paginata GET /predisposizioni.
+
+Le espressioni di ordinamento sono condivise fra la query del backend e gli indici creati
+da scripts/load_initial_data.py: PostgreSQL usa un indice su espressione solo se
+l'espressione della query è identica. I valori NULL (edifici marcati dal trigger sulle TFO
+senza indirizzo/comune/data) sono sostituiti da un valore fisso, così la paginazione keyset
+può confrontare (chiave, id) con una sola condizione di riga.
+
+Tutti gli indici sono parziali su predisposto_fibra = true: contengono solo gli edifici
+predisposti, una piccola parte del catasto, e restano piccoli anche sulle tabelle grandi.
+"""
+
+PREDISPOSTI_CONDITION = "predisposto_fibra = true"
+
+# Valore usato al posto di una data mancante, minore di qualsiasi data reale
+MISSING_DATE = "0001-01-01"
+
+# Nome accettato dal parametro sort -> espressione ({t} è il prefisso della tabella, es. "c.")
+SORT_EXPRESSIONS = {
+    "id": "{t}id",
+    "data_predisposizione": f"COALESCE({{t}}data_predisposizione, DATE '{MISSING_DATE}')",
+    "comune": "COALESCE({t}comune, '')",
+    "indirizzo": "COALESCE({t}indirizzo, '')",
+}
+
+# Colonne restituite dalla lista, incluse nell'indice su id per le scansioni index-only
+LISTING_COLUMNS = (
+    "indirizzo", "comune", "codice_catastale", "data_predisposizione",
+    "lat", "lon", "uso_edificio", "codice_belfiore",
+)
+
+def sort_expression(sort: str, table_prefix: str = "c.") -> str:
+    return SORT_EXPRESSIONS[sort].format(t=table_prefix)
+
+def predisposizioni_index_statements(trigram: bool = True) -> list:
+    """
+    CREATE INDEX per la lista delle predisposizioni. Con trigram=True include l'indice GIN
+    pg_trgm per la ricerca testuale su indirizzo (richiede l'estensione pg_trgm).
+    """
+    where = f"WHERE {PREDISPOSTI_CONDITION}"
+    statements = [
+        # Ordinamento predefinito e conteggio: scansione index-only sugli edifici predisposti
+        f"CREATE INDEX IF NOT EXISTS idx_predisposti_id ON catasto_abitazioni (id) "
+        f"INCLUDE ({', '.join(LISTING_COLUMNS)}) {where};",
+        # Filtro per comune (uguaglianza sul primo campo, poi ordine per id) e ordinamento per comune
+        f"CREATE INDEX IF NOT EXISTS idx_predisposti_comune ON catasto_abitazioni (({sort_expression('comune', '')}), id) {where};",
+        # Intervallo di date e ordinamento per data
+        f"CREATE INDEX IF NOT EXISTS idx_predisposti_data ON catasto_abitazioni (({sort_expression('data_predisposizione', '')}), id) {where};",
+        f"CREATE INDEX IF NOT EXISTS idx_predisposti_indirizzo ON catasto_abitazioni (({sort_expression('indirizzo', '')}), id) {where};",
+        f"CREATE INDEX IF NOT EXISTS idx_predisposti_uso ON catasto_abitazioni (uso_edificio, id) {where};",
+    ]
+    if trigram:
+        # Ricerca testuale ILIKE '%testo%' su indirizzo
+        statements.append(
+            f"CREATE INDEX IF NOT EXISTS idx_predisposti_indirizzo_trgm ON catasto_abitazioni "
+            f"USING GIN (indirizzo gin_trgm_ops) {where};"
+        )
+    return statements
@@ -0,0 +1,217 @@
+"""
+Cache in-process (LRU con TTL e limite di memoria) delle risposte di /geojson/bbox e /tiles
+e delle liste con ETag di TFO e predisposizioni (estensione WORLD_BBOX).
+
+Le chiavi sono quantizzate sulla griglia delle tile Web Mercator: bbox leggermente
+diversi che coprono le stesse tile condividono la stessa voce. Ogni voce ricorda
+l'estensione geografica coperta, così una scrittura su un edificio invalida solo
+le voci che ne intersecano la geometria.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from app.core.config import settings
+
+BBox = Tuple[float, float, float, float] # (west, south, east, north) in gradi
+
+MAX_MERCATOR_LAT = 85.0511287798
+
+# Estensione delle risposte non legate a un'area (liste): ogni invalidazione la interseca
+WORLD_BBOX: BBox = (-180.0, -90.0, 180.0, 90.0)
+
+
+def lonlat_to_tile(lon: float, lat: float, zoom: int) -> Tuple[int, int]:
+    """Tile XYZ che contiene il punto (lon, lat) allo zoom indicato."""
+    n = 2 ** zoom
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_to_bbox(zoom: int, x: int, y: int) -> BBox:
+    """Estensione (west, south, east, north) della tile XYZ."""
+    n = 2 ** zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+
+def snap_bbox_to_tiles(west: float, south: float, east: float, north: float, zoom: int):
+    """
+    Allarga il bbox ai bordi delle tile che lo coprono allo zoom indicato.
+    Restituisce (range di tile (x_min, y_min, x_max, y_max), bbox allineato).
+    """
+    x_min, y_min = lonlat_to_tile(west, north, zoom)
+    x_max, y_max = lonlat_to_tile(east, south, zoom)
+    snapped_west, _, _, snapped_north = tile_to_bbox(zoom, x_min, y_min)
+    _, snapped_south, snapped_east, _ = tile_to_bbox(zoom, x_max, y_max)
+    return (x_min, y_min, x_max, y_max), (snapped_west, snapped_south, snapped_east, snapped_north)
+
+
+def _intersects(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class ResponseCache:
+    """LRU thread-safe di risposte già serializzate (bytes), limitata per byte totali e TTL."""
+
+    def __init__(self, max_bytes: int, ttl: float, enabled: bool = True):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict() # chiave -> (body, bbox, scadenza, meta)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        # Incrementata ad ogni invalidazione: una risposta calcolata prima di una scrittura
+        # concorrente non deve entrare in cache dopo l'invalidazione
+        self.generation = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key: Hashable) -> Optional[tuple]:
+        """(body, meta) della voce, con meta passato a put (es. ETag e Last-Modified della risposta)."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            body, _, expires_at, meta = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return body, meta
+
+    def put(self, key: Hashable, body: bytes, bbox: BBox, generation: Optional[int] = None, meta=None):
+        """generation: valore di self.generation letto prima di interrogare il DB."""
+        if not self.enabled or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, bbox, time.monotonic() + self.ttl, meta)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._stats["evictions"] += 1
+
+    def _remove(self, key: Hashable):
+        body = self._entries.pop(key)[0]
+        self._bytes -= len(body)
+
+    def invalidate_bbox(self, west: float, south: float, east: float, north: float) -> int:
+        """Elimina le voci la cui estensione interseca il bbox. Restituisce quante ne ha eliminate."""
+        return self.invalidate_bboxes([(west, south, east, north)])
+
+    def invalidate_bboxes(self, targets) -> int:
+        """Come invalidate_bbox per più rettangoli, con una sola scansione e un solo incremento di generation."""
+        with self._lock:
+            self.generation += 1
+            stale = [key for key, entry in self._entries.items()
+                     if any(_intersects(entry[1], target) for target in targets)]
+            for key in stale:
+                self._remove(key)
+            self._stats["invalidations"] += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_ratio": self._stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "enabled": self.enabled,
+            }
+
+
+response_cache = ResponseCache(
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    ttl=settings.RESPONSE_CACHE_TTL,
+    enabled=settings.RESPONSE_CACHE_ENABLED,
+)
+
+
+# Colonne con l'estensione della geometria di un edificio, da aggiungere a SELECT/RETURNING
+# delle query di scrittura per sapere quali risposte in cache invalidare
+EXTENT_COLUMNS = ("extent_xmin", "extent_ymin", "extent_xmax", "extent_ymax")
+
+def extent_select_sql(geometry: str = "geometry", prefix: str = "") -> str:
+    return (f"ST_XMin({geometry}) AS {prefix}extent_xmin, ST_YMin({geometry}) AS {prefix}extent_ymin, "
+            f"ST_XMax({geometry}) AS {prefix}extent_xmax, ST_YMax({geometry}) AS {prefix}extent_ymax")
+
+def pop_extent(record, prefix: str = "") -> tuple:
+    """Rimuove le colonne di estensione (con il prefisso usato in extent_select_sql) da un record dict e le restituisce come tupla."""
+    return tuple(record.pop(prefix + col, None) for col in EXTENT_COLUMNS)
+
+def invalidate_building_extent(extent) -> int:
+    """
+    Invalida le risposte in cache che intersecano l'estensione di un edificio
+    (xmin, ymin, xmax, ymax) restituita dalle query di scrittura. None = niente da fare.
+    """
+    if not extent or any(v is None for v in extent):
+        return 0
+    xmin, ymin, xmax, ymax = (float(v) for v in extent)
+    return response_cache.invalidate_bbox(xmin, ymin, xmax, ymax)
+
+# Le scritture su molti edifici invalidano al massimo MERGE_GRID x MERGE_GRID rettangoli
+MERGE_GRID = 4
+
+def merge_extents(extents) -> list:
+    """
+    Riduce le estensioni di molti edifici a pochi rettangoli: quelle con il centro nella stessa
+    cella di una griglia MERGE_GRID x MERGE_GRID, tracciata sull'estensione complessiva, sono
+    unite. Gli edifici vicini finiscono nello stesso rettangolo, mentre due gruppi lontani
+    non fanno invalidare tutta l'area che li separa. None e valori mancanti sono ignorati.
+    """
+    boxes = [tuple(float(v) for v in extent) for extent in extents
+             if extent and all(v is not None for v in extent)]
+    if len(boxes) <= 1:
+        return boxes
+    west, south = min(b[0] for b in boxes), min(b[1] for b in boxes)
+    cell_width = (max(b[2] for b in boxes) - west) / MERGE_GRID or 1.0
+    cell_height = (max(b[3] for b in boxes) - south) / MERGE_GRID or 1.0
+    merged = {}
+    for box in boxes:
+        cell = (min(int(((box[0] + box[2]) / 2 - west) / cell_width), MERGE_GRID - 1),
+                min(int(((box[1] + box[3]) / 2 - south) / cell_height), MERGE_GRID - 1))
+        current = merged.get(cell)
+        merged[cell] = box if current is None else (
+            min(current[0], box[0]), min(current[1], box[1]), max(current[2], box[2]), max(current[3], box[3])
+        )
+    return list(merged.values())
+
+def invalidate_building_extents(extents) -> int:
+    """Invalidazione per più edifici (scritture multiple): rettangoli uniti e una sola scansione della cache."""
+    merged = merge_extents(extents)
+    if not merged:
+        return 0
+    return response_cache.invalidate_bboxes(merged)
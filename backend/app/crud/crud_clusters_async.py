@@ -0,0 +1,65 @@
+from fastapi import HTTPException
+from app.core.clusters import CLUSTER_TABLE, CLUSTER_DELTA_TABLE, CLUSTER_MAX_ZOOM, cell_zoom
+from app.core.metrics import timed_query, serialization_timer
+import asyncpg
+import orjson
+
+# Celle non vuote nel range di tile della griglia: la chiave primaria (zoom, cell_x, cell_y)
+# limita la lettura alle celle visibili, senza toccare catasto_abitazioni. Ai conteggi
+# si sommano i delta non ancora consolidati, riportati alla griglia dello zoom
+CLUSTERS_SQL = f"""
+    SELECT cell_x, cell_y, sum(buildings)::int AS buildings, sum(predisposti)::int AS predisposti,
+           sum(tfos)::int AS tfos, sum(sum_lon) / sum(buildings) AS lon, sum(sum_lat) / sum(buildings) AS lat
+    FROM (
+        SELECT cell_x, cell_y, buildings, predisposti, tfos, sum_lon, sum_lat
+        FROM {CLUSTER_TABLE}
+        WHERE zoom = $1 AND cell_x BETWEEN $2 AND $3 AND cell_y BETWEEN $4 AND $5
+        UNION ALL
+        SELECT cell_x >> ({CLUSTER_MAX_ZOOM} - $1::int), cell_y >> ({CLUSTER_MAX_ZOOM} - $1::int),
+               buildings, predisposti, tfos, sum_lon, sum_lat
+        FROM {CLUSTER_DELTA_TABLE}
+        WHERE cell_x >> ({CLUSTER_MAX_ZOOM} - $1::int) BETWEEN $2 AND $3
+          AND cell_y >> ({CLUSTER_MAX_ZOOM} - $1::int) BETWEEN $4 AND $5
+    ) c
+    GROUP BY cell_x, cell_y
+    HAVING sum(buildings) > 0;
+"""
+
+# Sposta i delta in coda nelle celle (vedi app/core/clusters.py)
+FOLD_CLUSTER_DELTAS_SQL = "SELECT consolida_cluster_delta();"
+
+async def get_clusters_by_tile_range(db_conn, zoom: int, x_min: int, y_min: int, x_max: int, y_max: int) -> bytes:
+    """
+    Restituisce come FeatureCollection GeoJSON (bytes) un punto per ogni cella della griglia
+    dello zoom con edifici, posizionato nel baricentro dei centroidi, con i conteggi
+    di edifici, edifici predisposti e TFO. Il range è in tile allo zoom cell_zoom(zoom).
+    """
+    try:
+        rows = await timed_query("clusters", db_conn.fetch(CLUSTERS_SQL, zoom, x_min, x_max, y_min, y_max))
+    except asyncpg.exceptions.UndefinedTableError as e:
+        print(f"Errore CRUD cluster (tabella aggregati mancante): {e}")
+        raise HTTPException(status_code=503, detail="Aggregati a cluster non disponibili: eseguire scripts/load_initial_data.py.")
+    except Exception as e:
+        print(f"Errore CRUD cluster: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nel recupero dei cluster dal DB: {str(e)}")
+    grid_zoom = cell_zoom(zoom)
+    with serialization_timer("clusters"):
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [round(row["lon"], 6), round(row["lat"], 6)]},
+                "properties": {
+                    "cell": f"{grid_zoom}/{row['cell_x']}/{row['cell_y']}",
+                    "buildings": row["buildings"],
+                    "predisposti": row["predisposti"],
+                    "tfos": row["tfos"],
+                },
+            }
+            for row in rows
+        ]
+        return orjson.dumps({"type": "FeatureCollection", "features": features})
+
+
+async def fold_cluster_deltas(db_conn) -> int:
+    """Consolida nelle celle i delta accodati dai trigger; restituisce le righe di coda consolidate."""
+    return await timed_query("clusters_fold", db_conn.fetchval(FOLD_CLUSTER_DELTAS_SQL))
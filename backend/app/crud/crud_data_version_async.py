@@ -0,0 +1,14 @@
+from app.core.data_version import DATA_VERSION_SQL
+from app.core.metrics import timed_query
+import asyncpg
+
+async def get_data_version(db_conn):
+    """
+    Versione corrente dei dati (record con version, updated_at, recent).
+    None se la tabella non esiste ancora (database caricato con una versione precedente
+    dello script): le risposte vengono inviate senza ETag, come prima.
+    """
+    try:
+        return await timed_query("data_version", db_conn.fetchrow(DATA_VERSION_SQL))
+    except asyncpg.exceptions.UndefinedTableError:
+        return None
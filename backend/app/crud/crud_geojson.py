@@ -1,84 +1,99 @@
-from sqlalchemy import text
-from fastapi import HTTPException
-from app.db.database import get_table_columns, json_serializable, validate_geometry # engine non è più qui
-from app.db.database import engine # Importa engine specificamente se necessario per get_table_columns
-                                   # o passa una connessione/sessione.
-                                   # Per ora, get_table_columns usa engine.connect() internamente.
-import psycopg2.extras 
+from app.db.database import orjson_default
+from app.core.lod import LodLevel, geometry_geojson_expression
+from app.core.pagination import encode_cursor
+import orjson
 
-def get_features_by_bbox(
-    db_conn, # Connessione Psycopg2
-    west: float,
-    south: float,
-    east: float,
-    north: float,
-    # zoom: int # zoom non è usato nella query SQL corrente
-):
-    available_columns = get_table_columns("catasto_abitazioni")
-    select_cols_list = [col for col in available_columns if col not in ["geometry", "centroide"]]
-    # Aggiungi alias alla tabella per evitare ambiguità se si fa join
-    select_cols_str = ", ".join([f"c.{col}" for col in select_cols_list])
+# Query bbox, colonne e serializzazione delle feature condivise da crud_geojson_async
 
+# Segnaposto (bbox, id dopo cui riprendere, righe da leggere), posizionali come li vuole asyncpg
+PREPARED_PLACEHOLDERS = ("$1", "$2", "$3", "$4", "$5", "$6")
 
-    query_sql = f"""
-        SELECT
-            {select_cols_str},
-            COALESCE(c.predisposto_fibra, false) AS predisposto_fibra,
-            ST_AsGeoJSON(c.geometry, 20) AS geometry_geojson,
-            ST_AsGeoJSON(c.centroide, 20) AS centroide_geojson
-        FROM catasto_abitazioni c
-        WHERE ST_Intersects(
-            c.geometry,
-            ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 4326)
-        )
-        LIMIT 3000;
+# SQL della query bbox per (versione dello schema, livello di dettaglio, segnaposto):
+# ricostruito solo dopo un'invalidazione dello schema
+_bbox_sql_cache = {}
+
+# Colonne restituite come proprietà nella modalità solo centroidi (zoom bassi)
+CENTROID_ONLY_COLUMNS = ["id", "objectid"]
+
+# Colonne di servizio del caricamento incrementale (scripts/load_initial_data.py --sync), non restituite
+LOADER_COLUMNS = ["content_hash", "retired_at"]
+
+def active_buildings_filter(available_columns, table_alias: str = "c") -> str:
+    """Condizione SQL che esclude gli edifici ritirati dal catasto (vuota se la colonna non esiste)."""
+    return f" AND {table_alias}.retired_at IS NULL" if "retired_at" in available_columns else ""
+
+def build_bbox_sql(available_columns, version: int, level: LodLevel, placeholders=PREPARED_PLACEHOLDERS) -> str:
+    """SQL della query bbox per le colonne disponibili, ricostruito solo quando cambia la versione dello schema."""
+    cache_key = (version, level.name, placeholders)
+    statement_sql = _bbox_sql_cache.get(cache_key)
+    if statement_sql is None:
+        envelope_sql = "ST_MakeEnvelope({}, {}, {}, {}, 4326)".format(*placeholders[:4])
+        after_id_sql, limit_sql = placeholders[4:]
+        if level.centroids_only:
+            select_cols_list = [col for col in CENTROID_ONLY_COLUMNS if col in available_columns]
+            geometry_sql = "NULL"
+            # A zoom bassi il filtro usa l'indice GIST sui centroidi, più leggero dei poligoni
+            where_sql = f"c.centroide && {envelope_sql}"
+        else:
+            # Escluse le geometrie (comprese quelle semplificate precalcolate) e predisposto_fibra (ricalcolato sotto)
+            select_cols_list = [col for col in available_columns
+                                if not col.startswith("geometry") and col not in ["centroide", "predisposto_fibra"] + LOADER_COLUMNS]
+            geometry_sql = geometry_geojson_expression(level, available_columns)
+            where_sql = f"ST_Intersects(c.geometry, {envelope_sql})"
+        # Aggiungi alias alla tabella per evitare ambiguità se si fa join
+        select_cols_str = ", ".join([f"c.{col}" for col in select_cols_list])
+        # Paginazione keyset: ordinamento stabile per id, la pagina successiva riparte dall'ultimo id
+        statement_sql = f"""
+            SELECT
+                {select_cols_str},
+                COALESCE(c.predisposto_fibra, false) AS predisposto_fibra,
+                {geometry_sql} AS geometry_geojson,
+                ST_AsGeoJSON(c.centroide, {level.precision}) AS centroide_geojson
+            FROM catasto_abitazioni c
+            WHERE {where_sql} AND c.id > {after_id_sql}{active_buildings_filter(available_columns)}
+            ORDER BY c.id
+            LIMIT {limit_sql}
+        """
+        if any(key[0] != version for key in _bbox_sql_cache):
+            _bbox_sql_cache.clear()
+        _bbox_sql_cache[cache_key] = statement_sql
+    return statement_sql
+
+GEOMETRY_COLUMNS = ("geometry_geojson", "centroide_geojson")
+FEATURE_COLLECTION_START = b'{"type": "FeatureCollection", "features": ['
+
+def _feature_collection_end(last_id, has_more: bool) -> bytes:
+    """Chiude il FeatureCollection con il cursore 'next' (null se non ci sono altre pagine)."""
+    next_cursor = encode_cursor({"id": last_id}) if has_more else None
+    return b'], "next": ' + orjson.dumps(next_cursor) + b"}"
+
+def _row_to_feature_bytes(row) -> list:
+    """
+    Converte una riga della query bbox nelle feature GeoJSON (già serializzate) del
+    poligono e del centroide. Il GeoJSON delle geometrie prodotto da PostGIS viene
+    inserito così com'è, senza json.loads/json.dumps; le righe senza geometria
+    arrivano già come NULL dalla query.
     """
-    params = {"west": west, "south": south, "east": east, "north": north}
     features = []
-    cursor = None
-    try:
-        cursor = db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) # type: ignore
-        cursor.execute(query_sql, params)
-        rows = cursor.fetchall()
+    props = {k: v for k, v in row.items() if k not in GEOMETRY_COLUMNS}
 
-        for row in rows:
-            # props = {k: json_serializable(v) for k, v in row.items() if k not in ["geometry_geojson", "centroide_geojson"]}
-            # Crea props escludendo le geometrie e assicurando serializzazione
-            props = {}
-            for k, v in row.items():
-                if k not in ["geometry_geojson", "centroide_geojson"]:
-                    props[k] = json_serializable(v)
+    geom_str = row.get("geometry_geojson")
+    centroide_str = row.get("centroide_geojson")
 
-            geom_str = row.get("geometry_geojson")
-            centroide_str = row.get("centroide_geojson")
-
-            if geom_str:
-                is_valid, geom_obj = validate_geometry(geom_str)
-                if is_valid:
-                    feature_props = props.copy() # Props specifiche per questa feature
-                    features.append({
-                        "type": "Feature",
-                        "geometry": geom_obj,
-                        "properties": feature_props
-                    })
+    if geom_str:
+        features.append(
+            b'{"type": "Feature", "geometry": ' + geom_str.encode("utf-8")
+            + b', "properties": ' + orjson.dumps(props, default=orjson_default) + b"}"
+        )
 
-            if centroide_str:
-                is_valid_c, geom_c_obj = validate_geometry(centroide_str)
-                if is_valid_c:
-                    centroid_props = { # Props specifiche per il centroide
-                        "is_centroid": True,
-                        "parent_id": props.get("id") or props.get("objectid"), # Usa l'ID dalla feature poligono
-                        "predisposto_fibra": props.get("predisposto_fibra", False) # Anche dal poligono
-                    }
-                    features.append({
-                        "type": "Feature",
-                        "geometry": geom_c_obj,
-                        "properties": centroid_props
-                    })
-        return features
-    except Exception as e:
-        print(f"Errore CRUD GeoJSON BBOX: {e}")
-        raise HTTPException(status_code=500, detail=f"Errore nel recupero GeoJSON dal DB: {str(e)}")
-    finally:
-        if cursor:
-            cursor.close()
\ No newline at end of file
+    if centroide_str:
+        centroid_props = { # Props specifiche per il centroide
+            "is_centroid": True,
+            "parent_id": props.get("id") or props.get("objectid"), # Usa l'ID dalla feature poligono
+            "predisposto_fibra": props.get("predisposto_fibra", False) # Anche dal poligono
+        }
+        features.append(
+            b'{"type": "Feature", "geometry": ' + centroide_str.encode("utf-8")
+            + b', "properties": ' + orjson.dumps(centroid_props) + b"}"
+        )
+    return features
@@ -0,0 +1,209 @@
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from app.db.schema import schema_registry
+from app.core.lod import LodLevel, get_lod_level, geometry_source_expression
+from app.core.pagination import encode_cursor
+from app.core.metrics import timed_query, serialization_timer
+from app.crud.crud_geojson import (
+    build_bbox_sql, FEATURE_COLLECTION_START, _feature_collection_end, _row_to_feature_bytes,
+    CENTROID_ONLY_COLUMNS, LOADER_COLUMNS, active_buildings_filter
+)
+import asyncpg
+
+async def _get_bbox_sql(db_conn, level):
+    available_columns = await schema_registry.get_columns_async(db_conn, "catasto_abitazioni")
+    # Segnaposto $1..$6: asyncpg prepara lo statement e lo riusa finché il testo SQL non cambia
+    return build_bbox_sql(available_columns, schema_registry.version, level)
+
+def _handle_bbox_error(e: Exception):
+    if isinstance(e, HTTPException):
+        raise e
+    if isinstance(e, (asyncpg.exceptions.UndefinedColumnError, asyncpg.exceptions.FeatureNotSupportedError)):
+        # Tabella modificata senza notifica: la prossima richiesta rilegge lo schema
+        schema_registry.invalidate("catasto_abitazioni")
+        print(f"Errore CRUD GeoJSON BBOX (schema cambiato): {e}")
+        raise HTTPException(status_code=503, detail="Schema della tabella modificato, riprovare.")
+    print(f"Errore CRUD GeoJSON BBOX: {e}")
+    raise HTTPException(status_code=500, detail=f"Errore nel recupero GeoJSON dal DB: {str(e)}")
+
+async def get_feature_collection_by_bbox(
+    db_conn, # Connessione asyncpg
+    west: float,
+    south: float,
+    east: float,
+    north: float,
+    zoom: int,
+    after_id: int,
+    limit: int
+) -> bytes:
+    """
+    Restituisce una pagina (al massimo `limit` edifici con id > after_id) del
+    FeatureCollection del bbox, già serializzata in JSON e con il cursore 'next'.
+    """
+    level = get_lod_level(zoom)
+    try:
+        statement_sql = await _get_bbox_sql(db_conn, level)
+        # Una riga in più per sapere se esiste una pagina successiva
+        rows = await timed_query("geojson_bbox", db_conn.fetch(statement_sql, west, south, east, north, after_id, limit + 1))
+    except Exception as e:
+        _handle_bbox_error(e)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    with serialization_timer("geojson_bbox"):
+        parts = []
+        for row in rows:
+            parts.extend(_row_to_feature_bytes(row))
+        last_id = rows[-1]["id"] if rows else after_id
+        return FEATURE_COLLECTION_START + b", ".join(parts) + _feature_collection_end(last_id, has_more)
+
+async def stream_features_by_bbox(
+    db_conn, # Connessione asyncpg (deve restare aperta finché il generatore non è esaurito)
+    west: float,
+    south: float,
+    east: float,
+    north: float,
+    zoom: int,
+    after_id: int,
+    limit: int,
+    chunk_size: int
+):
+    """
+    Variante in streaming di get_feature_collection_by_bbox: le righe arrivano a blocchi
+    da un cursore asyncpg (che richiede una transazione, chiusa a fine stream) e il
+    FeatureCollection viene composto man mano, senza tenere in memoria tutte le feature.
+    La query viene avviata subito, così gli errori iniziali diventano HTTPException.
+    """
+    level = get_lod_level(zoom)
+    transaction = db_conn.transaction(readonly=True)
+    try:
+        statement_sql = await _get_bbox_sql(db_conn, level)
+        await transaction.start()
+        cursor = await db_conn.cursor(statement_sql, west, south, east, north, after_id, limit + 1)
+    except Exception as e:
+        if db_conn.is_in_transaction():
+            await transaction.rollback()
+        _handle_bbox_error(e)
+
+    async def generate():
+        try:
+            yield FEATURE_COLLECTION_START
+            first = True
+            sent = 0
+            last_id = after_id
+            has_more = False
+            while True:
+                rows = await timed_query("geojson_bbox_stream", cursor.fetch(chunk_size))
+                if not rows:
+                    break
+                if sent + len(rows) > limit:
+                    # La riga in più serve solo a sapere che esiste una pagina successiva
+                    rows = rows[:limit - sent]
+                    has_more = True
+                with serialization_timer("geojson_bbox_stream"):
+                    parts = []
+                    for row in rows:
+                        parts.extend(_row_to_feature_bytes(row))
+                if rows:
+                    sent += len(rows)
+                    last_id = rows[-1]["id"]
+                if parts:
+                    yield (b"" if first else b", ") + b", ".join(parts)
+                    first = False
+                if has_more:
+                    break
+            yield _feature_collection_end(last_id, has_more)
+        except Exception as e:
+            # Gli header sono già stati inviati: il JSON resta troncato e il client lo rileva
+            print(f"Errore CRUD GeoJSON BBOX (streaming interrotto): {e}")
+        finally:
+            await transaction.rollback()
+
+    return generate()
+
+# Tipi delle colonne di catasto_abitazioni non gestiti (o gestiti male) da ST_AsFlatGeobuf:
+# NUMERIC diventa double, date e timestamp testo ISO
+FLATGEOBUF_COLUMN_CASTS = {
+    "edifc_at": "float8", "shape_length": "float8", "shape_area": "float8",
+    "lat": "float8", "lon": "float8",
+    "data_predisposizione": "text", "created_at": "text",
+}
+
+_flatgeobuf_sql_cache = {}
+
+def build_bbox_flatgeobuf_sql(available_columns, version: int, level: LodLevel) -> str:
+    """
+    SQL della pagina bbox codificata in FlatGeobuf da PostGIS (ST_AsFlatGeobuf), come ST_AsMVT per le tile.
+    Stesso filtro e paginazione di build_bbox_sql ($1..$4 bbox, $5 id dopo cui riprendere,
+    $6 righe da leggere compresa quella in più, $7 righe della pagina). Una feature per edificio:
+    il centroide è nelle proprietà centroide_lon/centroide_lat invece che in una seconda feature,
+    così il file ha un solo tipo di geometria. Le coordinate sono quantizzate alla precisione
+    del livello (ST_QuantizeCoordinates), che azzera i bit meno significativi e le rende più comprimibili.
+    """
+    cache_key = (version, level.name)
+    statement_sql = _flatgeobuf_sql_cache.get(cache_key)
+    if statement_sql is None:
+        envelope_sql = "ST_MakeEnvelope($1, $2, $3, $4, 4326)"
+        if level.centroids_only:
+            columns = [col for col in CENTROID_ONLY_COLUMNS if col in available_columns]
+            geometry_sql = "c.centroide"
+            where_sql = f"c.centroide && {envelope_sql}"
+        else:
+            columns = [col for col in available_columns
+                       if not col.startswith("geometry") and col not in ["centroide", "predisposto_fibra"] + LOADER_COLUMNS]
+            geometry_sql = geometry_source_expression(level, available_columns)
+            where_sql = f"ST_Intersects(c.geometry, {envelope_sql})"
+        select_cols = [
+            f"c.{col}::{FLATGEOBUF_COLUMN_CASTS[col]} AS {col}" if col in FLATGEOBUF_COLUMN_CASTS else f"c.{col}"
+            for col in columns
+        ]
+        centroid_cols = "" if level.centroids_only else (
+            f"round(ST_X(c.centroide)::numeric, {level.precision})::float8 AS centroide_lon, "
+            f"round(ST_Y(c.centroide)::numeric, {level.precision})::float8 AS centroide_lat, "
+        )
+        statement_sql = f"""
+            WITH page AS (
+                SELECT
+                    {", ".join(select_cols)},
+                    COALESCE(c.predisposto_fibra, false) AS predisposto_fibra,
+                    {centroid_cols}ST_QuantizeCoordinates({geometry_sql}, {level.precision}) AS geom
+                FROM catasto_abitazioni c
+                WHERE {where_sql} AND c.id > $5{active_buildings_filter(available_columns)}
+                ORDER BY c.id
+                LIMIT $6
+            ), features AS (
+                SELECT * FROM page ORDER BY id LIMIT $7
+            )
+            SELECT
+                (SELECT ST_AsFlatGeobuf(f, false, 'geom' ORDER BY f.id) FROM features f
+                 WHERE f.geom IS NOT NULL AND NOT ST_IsEmpty(f.geom)) AS fgb,
+                (SELECT max(id) FROM features) AS last_id,
+                (SELECT count(*) FROM page) > $7 AS has_more
+        """
+        if any(key[0] != version for key in _flatgeobuf_sql_cache):
+            _flatgeobuf_sql_cache.clear()
+        _flatgeobuf_sql_cache[cache_key] = statement_sql
+    return statement_sql
+
+async def get_flatgeobuf_by_bbox(
+    db_conn, # Connessione asyncpg
+    west: float,
+    south: float,
+    east: float,
+    north: float,
+    zoom: int,
+    after_id: int,
+    limit: int
+) -> Tuple[bytes, Optional[str]]:
+    """
+    Pagina del bbox in formato FlatGeobuf: restituisce (bytes, cursore 'next' o None).
+    Il file è prodotto interamente da PostGIS; una pagina senza edifici restituisce b"".
+    """
+    level = get_lod_level(zoom)
+    try:
+        available_columns = await schema_registry.get_columns_async(db_conn, "catasto_abitazioni")
+        statement_sql = build_bbox_flatgeobuf_sql(available_columns, schema_registry.version, level)
+        row = await timed_query("geojson_bbox_fgb", db_conn.fetchrow(statement_sql, west, south, east, north, after_id, limit + 1, limit))
+    except Exception as e:
+        _handle_bbox_error(e)
+    next_cursor = encode_cursor({"id": row["last_id"]}) if row["has_more"] else None
+    return bytes(row["fgb"] or b""), next_cursor
@@ -0,0 +1,371 @@
+from typing import List, Optional, Tuple
+import datetime
+from app.schemas.predisposizioni import (
+    PredisposizioneInDB, PredisposizioneCreate, PredisposizioneBatchCreate, BuildingSelection
+)
+from app.db.database import json_serializable, select_list, row_keys, rows_to_dicts
+from app.db.schema import schema_registry
+from app.crud.crud_geojson import active_buildings_filter
+from app.core.response_cache import extent_select_sql, pop_extent, invalidate_building_extent, invalidate_building_extents
+from app.core.predisposizioni_listing import PREDISPOSTI_CONDITION, sort_expression
+from app.core.metrics import timed_query, serialization_timer
+from fastapi import HTTPException
+import orjson
+
+# Accesso asincrono (asyncpg) alle predisposizioni: query con segnaposto $n,
+# ogni scrittura è un solo statement (CTE per le modifiche su più tabelle), quindi atomica
+# senza BEGIN/COMMIT espliciti (vedi scripts/check_write_statements.py).
+
+def _escape_like(text: str) -> str:
+    """Rende letterali i caratteri speciali di LIKE (il carattere di escape predefinito è \\)."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# Colonne della lista, nell'ordine dei campi di PredisposizioneInDB: le righe sono lette per
+# posizione e serializzate in JSON dall'endpoint, senza un modello per riga. predisposto_fibra
+# è vero per costruzione: non leggerlo dalla tabella permette la scansione index-only.
+PREDISPOSIZIONE_JSON_COLUMNS = (
+    ("id", "c.id"),
+    ("indirizzo", "c.indirizzo"),
+    ("comune", "c.comune"),
+    ("codice_catastale", "c.codice_catastale"),
+    ("data_predisposizione", "c.data_predisposizione"),
+    ("lat", "c.lat::float8"),
+    ("lon", "c.lon::float8"),
+    ("uso_edificio", "c.uso_edificio"),
+    ("codice_belfiore", "c.codice_belfiore"),
+    ("predisposto_fibra", "true"),
+)
+PREDISPOSIZIONE_JSON_KEYS = row_keys(PREDISPOSIZIONE_JSON_COLUMNS)
+
+async def list_predisposizioni(
+    db_conn,
+    comune: Optional[str] = None,
+    data_da: Optional[datetime.date] = None,
+    data_a: Optional[datetime.date] = None,
+    uso_edificio: Optional[str] = None,
+    q: Optional[str] = None,
+    sort: str = "id",
+    order: str = "asc",
+    after: Optional[Tuple] = None,
+    limit: int = 50,
+    count_limit: Optional[int] = None
+) -> dict:
+    """
+    Pagina di edifici predisposti ordinata per (sort, id), con paginazione keyset:
+    after è la coppia (valore di ordinamento, id) dell'ultima riga della pagina precedente.
+    items sono dict pronti per la serializzazione JSON (campi di PredisposizioneInDB).
+    Con count_limit conta anche le righe filtrate, fermandosi a count_limit
+    (total_capped=True indica che il totale reale è maggiore).
+    Filtri e ordinamenti usano le stesse espressioni degli indici parziali
+    creati da scripts/load_initial_data.py (app/core/predisposizioni_listing.py).
+    """
+    sort_sql = sort_expression(sort)
+    conditions = [f"c.{PREDISPOSTI_CONDITION}"]
+    args = []
+
+    def param(value, cast: str = "") -> str:
+        args.append(value)
+        return f"${len(args)}{cast}"
+
+    if comune:
+        conditions.append(f"{sort_expression('comune')} = {param(comune)}")
+    if data_da or data_a:
+        conditions.append("c.data_predisposizione IS NOT NULL")
+        date_sql = sort_expression("data_predisposizione")
+        if data_da:
+            conditions.append(f"{date_sql} >= {param(data_da, '::date')}")
+        if data_a:
+            conditions.append(f"{date_sql} <= {param(data_a, '::date')}")
+    if uso_edificio:
+        conditions.append(f"c.uso_edificio = {param(uso_edificio)}")
+    if q:
+        conditions.append(f"c.indirizzo ILIKE {param('%' + _escape_like(q) + '%')}")
+
+    try:
+        total = None
+        if count_limit is not None:
+            # Conteggio limitato: legge al massimo count_limit + 1 voci dell'indice parziale
+            count_query = "SELECT count(*) FROM (SELECT 1 FROM catasto_abitazioni c WHERE {where} LIMIT ${n}) s;".format(
+                where=" AND ".join(conditions), n=len(args) + 1
+            )
+            total = await timed_query("predisposizioni_count", db_conn.fetchval(count_query, *args, count_limit + 1))
+
+        direction = "ASC" if order == "asc" else "DESC"
+        if after is not None:
+            comparison = ">" if order == "asc" else "<"
+            after_value, after_id = after
+            if sort == "id":
+                conditions.append(f"c.id {comparison} {param(after_id)}")
+            else:
+                value_cast = "::date" if sort == "data_predisposizione" else ""
+                conditions.append(f"({sort_sql}, c.id) {comparison} ({param(after_value, value_cast)}, {param(after_id)})")
+        # sort_key è l'ultima colonna, fuori dalle chiavi JSON
+        query = """
+            SELECT {columns}, {sort_sql} AS sort_key
+            FROM catasto_abitazioni c
+            WHERE {where}
+            ORDER BY {sort_sql} {direction}, c.id {direction}
+            LIMIT {limit_param};
+        """.format(
+            columns=select_list(PREDISPOSIZIONE_JSON_COLUMNS), sort_sql=sort_sql, where=" AND ".join(conditions),
+            direction=direction, limit_param=param(limit + 1)
+        )
+        # Una riga in più per sapere se esiste una pagina successiva
+        rows = await timed_query("predisposizioni_list", db_conn.fetch(query, *args))
+    except Exception as e:
+        print(f"Errore CRUD list_predisposizioni: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore DB durante il recupero delle predisposizioni: {str(e)}")
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_position = None
+    if has_more:
+        last = rows[-1]
+        next_position = (json_serializable(last["sort_key"]), last["id"])
+    with serialization_timer("predisposizioni_list"):
+        items = rows_to_dicts(PREDISPOSIZIONE_JSON_KEYS, rows)
+    return {
+        "items": items,
+        "next_position": next_position,
+        "total": min(total, count_limit) if total is not None else None,
+        "total_capped": total is not None and total > count_limit,
+    }
+
+# L'UPDATE ... RETURNING verifica l'esistenza dell'edificio e restituisce la riga aggiornata
+# in un solo round trip: nessuna riga = edificio inesistente (404).
+# lat/lon sono NUMERIC: il cast esplicito fa arrivare i float del modello come float8
+UPSERT_PREDISPOSIZIONE_SQL = """
+    UPDATE catasto_abitazioni SET
+        predisposto_fibra = true,
+        indirizzo = $1,
+        lat = $2::float8,
+        lon = $3::float8,
+        uso_edificio = $4,
+        comune = $5,
+        codice_belfiore = $6,
+        codice_catastale = $7,
+        data_predisposizione = $8
+    WHERE id = $9
+    RETURNING id, indirizzo, lat, lon, uso_edificio, comune,
+             codice_belfiore, codice_catastale, data_predisposizione, predisposto_fibra,
+             {extent_columns};
+""".format(extent_columns=extent_select_sql())
+
+async def create_or_update_predisposizione(db_conn, pred_data: PredisposizioneCreate) -> PredisposizioneInDB:
+    try:
+        # Statement singolo: atomico anche senza transazione esplicita (niente BEGIN/COMMIT)
+        updated_record = await timed_query("predisposizione_upsert", db_conn.fetchrow(
+            UPSERT_PREDISPOSIZIONE_SQL,
+            pred_data.indirizzo, pred_data.lat, pred_data.lon, pred_data.uso_edificio,
+            pred_data.comune, pred_data.codice_belfiore, pred_data.codice_catastale,
+            pred_data.data_predisposizione, pred_data.id
+        ))
+        if updated_record is None:
+            raise HTTPException(status_code=404, detail=f"Edificio con ID {pred_data.id} non trovato.")
+        updated_record = dict(updated_record)
+        extent = pop_extent(updated_record)
+        invalidate_building_extent(extent) # Le risposte bbox/tile in cache su questo edificio sono superate
+        return PredisposizioneInDB(**{k: json_serializable(v) for k, v in updated_record.items()})
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Errore CRUD create_or_update_predisposizione: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore DB durante creazione/aggiornamento predisposizione: {str(e)}")
+
+# Eliminazione delle TFO e reset dell'edificio con un solo statement (atomico senza BEGIN/COMMIT):
+# nessuna riga restituita se l'edificio non esiste, e allora non ha neanche TFO da eliminare
+DELETE_PREDISPOSIZIONE_SQL = """
+    WITH tfo_eliminate AS (
+        DELETE FROM verifiche_edifici WHERE id_abitazione = $1
+        RETURNING id
+    ),
+    edificio_resettato AS (
+        UPDATE catasto_abitazioni SET
+            predisposto_fibra = NULL,
+            indirizzo = NULL,
+            comune = NULL,
+            codice_catastale = NULL,
+            data_predisposizione = NULL,
+            lat = NULL,
+            lon = NULL,
+            uso_edificio = NULL,
+            codice_belfiore = NULL
+        WHERE id = $1
+        RETURNING id, {extent_columns}
+    )
+    SELECT r.*, (SELECT count(*) FROM tfo_eliminate) AS tfos_deleted
+    FROM edificio_resettato r;
+""".format(extent_columns=extent_select_sql())
+
+async def delete_predisposizione_by_id(db_conn, predisposizione_id: int) -> int:
+    try:
+        reset_record = await timed_query("predisposizione_delete", db_conn.fetchrow(
+            DELETE_PREDISPOSIZIONE_SQL, predisposizione_id
+        ))
+        if reset_record is None:
+            raise HTTPException(status_code=404, detail=f"Nessuna predisposizione trovata per ID edificio {predisposizione_id} da resettare.")
+        invalidate_building_extent(pop_extent(dict(reset_record)))
+        return reset_record["tfos_deleted"]
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Errore CRUD delete_predisposizione_by_id: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore DB durante l'eliminazione della predisposizione: {str(e)}")
+
+# --- Operazioni multiple: un solo statement set-based per tutti gli edifici ---
+# Le selezioni per area leggono le colonne della tabella dallo schema_registry (in cache dopo la prima volta)
+
+# Aggiornamento con dati specifici per edificio: un array per colonna, uniti con unnest
+BATCH_UPDATE_ITEMS_SQL = """
+    UPDATE catasto_abitazioni c SET
+        predisposto_fibra = true,
+        indirizzo = t.indirizzo,
+        lat = t.lat,
+        lon = t.lon,
+        uso_edificio = t.uso_edificio,
+        comune = t.comune,
+        codice_belfiore = t.codice_belfiore,
+        codice_catastale = t.codice_catastale,
+        data_predisposizione = t.data_predisposizione
+    FROM unnest($1::int4[], $2::text[], $3::float8[], $4::float8[], $5::text[],
+                $6::text[], $7::text[], $8::text[], $9::date[])
+         AS t(id, indirizzo, lat, lon, uso_edificio, comune, codice_belfiore, codice_catastale, data_predisposizione)
+    WHERE c.id = t.id
+    RETURNING c.id, {extent_columns};
+"""
+
+BATCH_ITEM_COLUMNS = (
+    "id", "indirizzo", "lat", "lon", "uso_edificio",
+    "comune", "codice_belfiore", "codice_catastale", "data_predisposizione"
+)
+
+def _selection_where(selection: BuildingSelection, available_columns, first_param: int) -> Tuple[str, list]:
+    """Condizione SQL (alias c) e parametri per una selezione di edifici, con segnaposto da $first_param."""
+    if selection.ids is not None:
+        return f"c.id = ANY(${first_param}::int4[])", [selection.ids]
+    # Le selezioni per area escludono gli edifici ritirati dal catasto
+    active_filter = active_buildings_filter(available_columns)
+    if selection.bbox is not None:
+        p = [f"${first_param + i}::float8" for i in range(4)]
+        # Centroide nel rettangolo: && su un punto equivale al contenimento e usa l'indice GIST
+        return f"c.centroide && ST_MakeEnvelope({p[0]}, {p[1]}, {p[2]}, {p[3]}, 4326){active_filter}", list(selection.bbox)
+    return (
+        f"ST_Intersects(c.centroide, ST_SetSRID(ST_GeomFromGeoJSON(${first_param}), 4326)){active_filter}",
+        [orjson.dumps(selection.polygon).decode()]
+    )
+
+async def _selection_columns(db_conn, selection: BuildingSelection):
+    """Colonne di catasto_abitazioni per il filtro sugli edifici attivi: servono solo alle selezioni per area."""
+    if selection.ids is not None:
+        return None
+    return await schema_registry.get_columns_async(db_conn, "catasto_abitazioni")
+
+def _invalidate_extents(records) -> None:
+    invalidate_building_extents([pop_extent(dict(record)) for record in records])
+
+def _not_found(requested_ids, records) -> List[int]:
+    found = {record["id"] for record in records}
+    return sorted(set(requested_ids) - found)
+
+async def batch_create_or_update_predisposizioni(db_conn, batch: PredisposizioneBatchCreate) -> dict:
+    """
+    Predispone più edifici con un solo UPDATE. Con items ogni edificio riceve i propri dati
+    (come POST /predisposizioni), con selection + values tutti ricevono gli stessi campi.
+    Restituisce il numero di edifici aggiornati e gli ID richiesti ma non trovati.
+    """
+    try:
+        if batch.items is not None:
+            # Un ID ripetuto vale una volta sola: prevale l'ultima occorrenza
+            items = list({item.id: item for item in batch.items}.values())
+            columns = [[getattr(item, col) for item in items] for col in BATCH_ITEM_COLUMNS]
+            records = await timed_query("predisposizioni_batch_items", db_conn.fetch(
+                BATCH_UPDATE_ITEMS_SQL.format(extent_columns=extent_select_sql("c.geometry")), *columns
+            ))
+            requested_ids = [item.id for item in items]
+        else:
+            available_columns = await _selection_columns(db_conn, batch.selection)
+            where_sql, where_args = _selection_where(batch.selection, available_columns, first_param=7)
+            values = batch.values
+            # lat/lon sono NUMERIC: se mancano si usano le coordinate del centroide
+            update_query = """
+                UPDATE catasto_abitazioni c SET
+                    predisposto_fibra = true,
+                    comune = $1,
+                    data_predisposizione = $2,
+                    indirizzo = COALESCE($3, c.indirizzo),
+                    uso_edificio = COALESCE($4, c.uso_edificio),
+                    codice_belfiore = COALESCE($5, c.codice_belfiore),
+                    codice_catastale = COALESCE($6, c.codice_catastale),
+                    lat = COALESCE(c.lat, ST_Y(c.centroide)::numeric),
+                    lon = COALESCE(c.lon, ST_X(c.centroide)::numeric)
+                WHERE {where}
+                RETURNING c.id, {extent_columns};
+            """.format(where=where_sql, extent_columns=extent_select_sql("c.geometry"))
+            records = await timed_query("predisposizioni_batch_selection", db_conn.fetch(
+                update_query,
+                values.comune, values.data_predisposizione, values.indirizzo,
+                values.uso_edificio, values.codice_belfiore, values.codice_catastale,
+                *where_args
+            ))
+            requested_ids = batch.selection.ids or []
+        _invalidate_extents(records)
+        return {"buildings": len(records), "not_found": _not_found(requested_ids, records)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Errore CRUD batch_create_or_update_predisposizioni: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore DB durante la predisposizione multipla: {str(e)}")
+
+async def batch_delete_predisposizioni(db_conn, selection: BuildingSelection) -> dict:
+    """
+    Elimina le TFO e resetta la predisposizione di più edifici con un unico statement.
+    Con ids sono resettati tutti gli edifici indicati (come DELETE /predisposizioni/{id}),
+    con bbox/polygon solo quelli predisposti nell'area.
+    Restituisce edifici resettati, TFO eliminate e ID richiesti ma non trovati.
+    """
+    try:
+        available_columns = await _selection_columns(db_conn, selection)
+        where_sql, where_args = _selection_where(selection, available_columns, first_param=1)
+        if selection.ids is None:
+            where_sql += " AND c.predisposto_fibra = true"
+        # Le CTE vedono la stessa istantanea: la selezione è valutata una volta
+        # e usata sia per eliminare le TFO sia per resettare gli edifici
+        reset_query = """
+            WITH target AS (
+                SELECT c.id FROM catasto_abitazioni c WHERE {where}
+            ),
+            tfo_eliminate AS (
+                DELETE FROM verifiche_edifici v USING target t
+                WHERE v.id_abitazione = t.id
+                RETURNING v.id
+            ),
+            edifici_resettati AS (
+                UPDATE catasto_abitazioni c SET
+                    predisposto_fibra = NULL,
+                    indirizzo = NULL,
+                    comune = NULL,
+                    codice_catastale = NULL,
+                    data_predisposizione = NULL,
+                    lat = NULL,
+                    lon = NULL,
+                    uso_edificio = NULL,
+                    codice_belfiore = NULL
+                FROM target t
+                WHERE c.id = t.id
+                RETURNING c.id, {extent_columns}
+            )
+            SELECT r.*, (SELECT count(*) FROM tfo_eliminate) AS tfos_deleted
+            FROM edifici_resettati r;
+        """.format(where=where_sql, extent_columns=extent_select_sql("c.geometry"))
+        records = await timed_query("predisposizioni_batch_delete", db_conn.fetch(reset_query, *where_args))
+        _invalidate_extents(records)
+        return {
+            "buildings": len(records),
+            "tfos_deleted": records[0]["tfos_deleted"] if records else 0,
+            "not_found": _not_found(selection.ids or [], records),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Errore CRUD batch_delete_predisposizioni: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore DB durante il reset multiplo delle predisposizioni: {str(e)}")
@@ -0,0 +1,307 @@
+from typing import List, Optional, Tuple
+from app.schemas.tfo import TfoInDB, TfoCreate, TfoBulkRowResult
+from app.db.database import json_serializable, select_list, row_keys, rows_to_dicts, dumps_json
+from app.core.response_cache import EXTENT_COLUMNS, extent_select_sql, pop_extent, invalidate_building_extent, invalidate_building_extents
+from app.core.metrics import timed_query, serialization_timer
+from fastapi import HTTPException
+
+# Accesso asincrono (asyncpg) alle TFO: query con segnaposto $n,
+# le scritture girano in una transazione annullata automaticamente in caso di eccezione.
+
+# Colonne delle TFO nelle risposte di lettura, nell'ordine dei campi di TfoInDB: le righe sono
+# lette per posizione e serializzate direttamente in JSON, senza costruire un modello per riga.
+# Come nella risposta di TfoInDB la data della TFO è in data_predisposizione e
+# data_predisposizione_tfo resta null; lat/lon (NUMERIC) arrivano già come float8.
+TFO_JSON_COLUMNS = (
+    ("id_abitazione", "v.id_abitazione"),
+    ("data_predisposizione_tfo", "NULL::date"),
+    ("scala", "v.scala"),
+    ("piano", "v.piano"),
+    ("interno", "v.interno"),
+    ("id_operatore", "v.id_operatore"),
+    ("id_tfo", "v.id_tfo"),
+    ("id_roe", "v.id_roe"),
+    ("id", "v.id"),
+    ("indirizzo", "c.indirizzo"),
+    ("lat", "c.lat::float8"),
+    ("lon", "c.lon::float8"),
+    ("codice_catastale", "c.codice_catastale"),
+    ("data_predisposizione", "v.data_predisposizione_tfo"),
+)
+TFO_JSON_KEYS = row_keys(TFO_JSON_COLUMNS)
+
+TFOS_BY_BUILDING_SQL = f"""
+    SELECT {select_list(TFO_JSON_COLUMNS)}
+    FROM verifiche_edifici v
+    JOIN catasto_abitazioni c ON v.id_abitazione = c.id
+    WHERE v.id_abitazione = $1 AND v.id_tfo IS NOT NULL;
+"""
+
+async def get_tfos_by_predisposizione_id(db_conn, predisposizione_id: int) -> bytes:
+    """Lista JSON delle TFO di un edificio, con la stessa forma di List[TfoInDB]."""
+    rows = await timed_query("tfos_by_building", db_conn.fetch(TFOS_BY_BUILDING_SQL, predisposizione_id))
+    with serialization_timer("tfos_by_building"):
+        return dumps_json(rows_to_dicts(TFO_JSON_KEYS, rows))
+
+# TFO di più edifici con un solo statement: gli edifici selezionati (per ID con = ANY oppure
+# predisposti nel bbox) in LEFT JOIN con le TFO, così compaiono anche quelli senza TFO.
+# La join usa l'indice idx_verifiche_edifici_id_abitazione. building_id è l'ultima colonna,
+# fuori dalle chiavi della TFO.
+_BATCH_TFO_SELECT = f"""
+    SELECT {select_list(TFO_JSON_COLUMNS)}, c.id AS building_id
+    FROM edifici c
+    LEFT JOIN verifiche_edifici v ON v.id_abitazione = c.id AND v.id_tfo IS NOT NULL
+    ORDER BY c.id, v.id;
+"""
+BATCH_TFO_BY_IDS_SQL = """
+    WITH edifici AS (
+        SELECT id, indirizzo, lat, lon, codice_catastale
+        FROM catasto_abitazioni WHERE id = ANY($1::int4[])
+    )
+""" + _BATCH_TFO_SELECT
+BATCH_TFO_BY_BBOX_SQL = """
+    WITH edifici AS (
+        SELECT id, indirizzo, lat, lon, codice_catastale
+        FROM catasto_abitazioni
+        WHERE centroide && ST_MakeEnvelope($1, $2, $3, $4, 4326) AND predisposto_fibra = true
+        ORDER BY id
+        LIMIT $5
+    )
+""" + _BATCH_TFO_SELECT
+
+async def get_tfos_by_buildings(
+    db_conn, ids: Optional[List[int]] = None, bbox: Optional[Tuple[float, float, float, float]] = None,
+    max_buildings: int = 1000
+) -> bytes:
+    """
+    TFO raggruppate per edificio, per una lista di ID o per gli edifici predisposti il cui
+    centroide cade nel bbox (al massimo max_buildings, truncated=True se ce ne sono di più).
+    Restituisce il JSON di TfoBatchResponse.
+    """
+    try:
+        if ids is not None:
+            rows = await timed_query("tfos_batch_ids", db_conn.fetch(BATCH_TFO_BY_IDS_SQL, sorted(set(ids))))
+        else:
+            # Un edificio in più per sapere se il bbox ne contiene altri
+            rows = await timed_query("tfos_batch_bbox", db_conn.fetch(BATCH_TFO_BY_BBOX_SQL, *bbox, max_buildings + 1))
+    except Exception as e:
+        print(f"Errore CRUD get_tfos_by_buildings: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore DB durante la lettura delle TFO: {str(e)}")
+
+    with serialization_timer("tfos_batch"):
+        groups = {}
+        for row in rows:
+            tfos = groups.setdefault(row["building_id"], [])
+            if row["id"] is not None: # id NULL: edificio senza TFO (riga della LEFT JOIN)
+                tfos.append(dict(zip(TFO_JSON_KEYS, row)))
+        truncated = ids is None and len(groups) > max_buildings
+        building_ids = list(groups)[:max_buildings] if truncated else list(groups)
+        return dumps_json({
+            "buildings": [{"id_abitazione": building_id, "tfos": groups[building_id]} for building_id in building_ids],
+            "not_found": sorted(set(ids) - set(groups)) if ids is not None else [],
+            "truncated": truncated,
+        })
+
+# Creazione con un solo statement (un solo round trip): la CTE edificio verifica che
+# l'edificio esista e sia predisposto, l'INSERT ... SELECT non inserisce nulla se non lo è
+# e la SELECT finale unisce la TFO creata ai dati dell'edificio. Nessuna riga = 404.
+CREATE_TFO_SQL = f"""
+    WITH edificio AS (
+        SELECT id, indirizzo, lat, lon, codice_catastale, {extent_select_sql()}
+        FROM catasto_abitazioni WHERE id = $1 AND predisposto_fibra = true
+    ), nuova AS (
+        INSERT INTO verifiche_edifici (
+            id_abitazione, scala, piano, interno,
+            id_operatore, id_tfo, id_roe, data_predisposizione_tfo
+        )
+        SELECT e.id, $2::text, $3::text, $4::text, $5::text, $6::text, $7::text, $8::date
+        FROM edificio e
+        RETURNING id, id_abitazione, scala, piano, interno,
+                  id_operatore, id_tfo, id_roe, data_predisposizione_tfo
+    )
+    SELECT n.id, n.id_abitazione, n.scala, n.piano, n.interno,
+           n.id_operatore, n.id_tfo, n.id_roe, n.data_predisposizione_tfo,
+           e.indirizzo, e.lat, e.lon, e.codice_catastale,
+           e.extent_xmin, e.extent_ymin, e.extent_xmax, e.extent_ymax
+    FROM nuova n JOIN edificio e ON e.id = n.id_abitazione;
+"""
+
+async def create_new_tfo(db_conn, tfo_data: TfoCreate) -> TfoInDB:
+    try:
+        # Statement singolo: atomico anche senza transazione esplicita (niente BEGIN/COMMIT)
+        new_tfo_raw = await timed_query("tfo_create", db_conn.fetchrow(
+            CREATE_TFO_SQL,
+            tfo_data.id_abitazione, tfo_data.scala, tfo_data.piano, tfo_data.interno,
+            tfo_data.id_operatore, tfo_data.id_tfo, tfo_data.id_roe, tfo_data.data_predisposizione_tfo
+        ))
+        if not new_tfo_raw:
+            raise HTTPException(status_code=404, detail=f"Edificio predisposto con ID {tfo_data.id_abitazione} non trovato o non predisposto.")
+
+        # Combina i dati per la risposta (TFO e info edificio sono già nella stessa riga)
+        result_data = {k: json_serializable(v) for k, v in new_tfo_raw.items()}
+        extent = pop_extent(result_data)
+        result_data['data_predisposizione'] = result_data.pop('data_predisposizione_tfo', None)
+
+        # Il trigger trg_aggiorna_predisposto_fibra_on_tfo_insert può cambiare predisposto_fibra
+        # dell'edificio: invalida le risposte bbox/tile in cache che lo contengono.
+        invalidate_building_extent(extent)
+        return TfoInDB(**result_data)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Errore CRUD create_new_tfo: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore DB durante creazione TFO: {str(e)}")
+
+# Inserimento multiriga: un solo statement per tutte le righe di POST /tfos/bulk, che verifica
+# gli edifici e inserisce le TFO valide. Il trigger trg_aggiorna_predisposto_fibra_on_tfo_insert
+# è FOR EACH STATEMENT, quindi scatta una volta sola per l'intero inserimento. Gli ID sono presi
+# dalla sequenza nella CTE righe, insieme alla posizione (ord) della riga negli array: ogni ID
+# restituito è associato esplicitamente alla sua riga, senza contare sull'ordine di inserimento.
+# FOR SHARE: gli edifici non possono essere eliminati prima dell'INSERT delle TFO (la chiave
+# esterna fallirebbe con un 500 invece di riportare l'edificio come non trovato).
+BULK_INSERT_COLUMNS = (
+    "id_abitazione", "scala", "piano", "interno",
+    "id_operatore", "id_tfo", "id_roe", "data_predisposizione_tfo"
+)
+BULK_INSERT_SQL = f"""
+    WITH righe AS (
+        SELECT nextval(pg_get_serial_sequence('verifiche_edifici', 'id')) AS id, t.*
+        FROM unnest($1::int4[], $2::text[], $3::text[], $4::text[],
+                    $5::text[], $6::text[], $7::text[], $8::date[])
+             WITH ORDINALITY AS t(id_abitazione, scala, piano, interno,
+                                  id_operatore, id_tfo, id_roe, data_predisposizione_tfo, ord)
+    ), edifici AS (
+        SELECT c.id, {extent_select_sql()}
+        FROM catasto_abitazioni c
+        WHERE c.id IN (SELECT id_abitazione FROM righe) AND c.predisposto_fibra = true
+        FOR SHARE
+    ), inserite AS (
+        INSERT INTO verifiche_edifici (
+            id, id_abitazione, scala, piano, interno,
+            id_operatore, id_tfo, id_roe, data_predisposizione_tfo
+        )
+        SELECT r.id, r.id_abitazione, r.scala, r.piano, r.interno,
+               r.id_operatore, r.id_tfo, r.id_roe, r.data_predisposizione_tfo
+        FROM righe r JOIN edifici e ON e.id = r.id_abitazione
+        RETURNING id
+    )
+    -- Una riga per riga della richiesta: id e id_edificio NULL se l'edificio non è valido
+    SELECT r.ord, i.id, e.id AS id_edificio, {", ".join(f"e.{col}" for col in EXTENT_COLUMNS)}
+    FROM righe r
+    LEFT JOIN inserite i ON i.id = r.id
+    LEFT JOIN edifici e ON e.id = r.id_abitazione;
+"""
+
+async def create_tfos_bulk(db_conn, rows: List[Tuple[int, TfoCreate]]) -> List[TfoBulkRowResult]:
+    """
+    Crea più TFO con un solo statement. rows contiene coppie (posizione nella richiesta, TFO).
+    Le righe su edifici inesistenti o non predisposti vengono scartate e riportate come errore,
+    le altre inserite con un unico INSERT multiriga. Un errore del DB annulla l'intero inserimento.
+    """
+    if not rows:
+        return []
+    try:
+        # Un array per colonna: il numero di parametri non dipende dalle righe
+        columns = [[getattr(tfo, col) for _, tfo in rows] for col in BULK_INSERT_COLUMNS]
+        records = await timed_query("tfo_bulk_insert", db_conn.fetch(BULK_INSERT_SQL, *columns))
+        extents = {}
+        results = []
+        for record in records:
+            record = dict(record)
+            # ord è la posizione (da 1) della riga in rows
+            position, tfo = rows[record["ord"] - 1]
+            if record["id"] is not None:
+                extents[record["id_edificio"]] = pop_extent(record)
+                results.append(TfoBulkRowResult(row=position, status="created", id=record["id"], id_abitazione=tfo.id_abitazione))
+            else:
+                results.append(TfoBulkRowResult(
+                    row=position, status="error", id_abitazione=tfo.id_abitazione,
+                    detail=f"Edificio predisposto con ID {tfo.id_abitazione} non trovato o non predisposto."
+                ))
+
+        # Invalida le risposte bbox/tile in cache con una sola scansione per tutti gli edifici
+        invalidate_building_extents(list(extents.values()))
+        results.sort(key=lambda result: result.row)
+        return results
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Errore CRUD create_tfos_bulk: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore DB durante creazione TFO multipla: {str(e)}")
+
+# Aggiornamento con un solo statement: l'UPDATE ... FROM edificio modifica la TFO solo se
+# l'edificio di destinazione esiste e restituisce subito i suoi dati. La SELECT finale
+# restituisce sempre una riga: tfo_trovata distingue la TFO inesistente dall'edificio
+# inesistente (colonne della TFO a NULL), come i due 404 della versione a più query.
+# La CTE precedente legge l'edificio di partenza prima dell'UPDATE: le estensioni dei due
+# edifici servono a invalidare le risposte in cache (anche /clusters, che conta le TFO).
+UPDATE_TFO_SQL = f"""
+    WITH edificio AS (
+        SELECT id, indirizzo, lat, lon, codice_catastale, {extent_select_sql()}
+        FROM catasto_abitazioni WHERE id = $8
+    ), precedente AS (
+        SELECT {extent_select_sql("c.geometry", prefix="old_")}
+        FROM verifiche_edifici v JOIN catasto_abitazioni c ON c.id = v.id_abitazione
+        WHERE v.id = $9
+    ), aggiornata AS (
+        UPDATE verifiche_edifici v SET
+            data_predisposizione_tfo = $1, scala = $2, piano = $3, interno = $4,
+            id_operatore = $5, id_tfo = $6, id_roe = $7, id_abitazione = e.id
+        FROM edificio e
+        WHERE v.id = $9
+        RETURNING v.id, v.id_abitazione, v.scala, v.piano, v.interno,
+                  v.id_operatore, v.id_tfo, v.id_roe, v.data_predisposizione_tfo,
+                  e.indirizzo, e.lat, e.lon, e.codice_catastale,
+                  e.extent_xmin, e.extent_ymin, e.extent_xmax, e.extent_ymax
+    )
+    SELECT EXISTS (SELECT 1 FROM verifiche_edifici WHERE id = $9) AS tfo_trovata, a.*, p.*
+    FROM (SELECT 1) s LEFT JOIN aggiornata a ON true LEFT JOIN precedente p ON true;
+"""
+
+async def update_existing_tfo(db_conn, tfo_id: int, tfo_data: TfoCreate) -> TfoInDB:
+    try:
+        row = await timed_query("tfo_update", db_conn.fetchrow(
+            UPDATE_TFO_SQL,
+            tfo_data.data_predisposizione_tfo, tfo_data.scala, tfo_data.piano,
+            tfo_data.interno, tfo_data.id_operatore, tfo_data.id_tfo,
+            tfo_data.id_roe, tfo_data.id_abitazione, tfo_id
+        ))
+        if not row["tfo_trovata"]:
+            raise HTTPException(status_code=404, detail=f"TFO ID {tfo_id} non trovata per l'aggiornamento.")
+        if row["id"] is None: # TFO esistente ma edificio di destinazione assente: nulla è stato modificato
+            raise HTTPException(status_code=404, detail=f"Edificio associato ID {tfo_data.id_abitazione} non trovato.")
+
+        result_data = {k: json_serializable(v) for k, v in row.items() if k != "tfo_trovata"}
+        extent, old_extent = pop_extent(result_data), pop_extent(result_data, prefix="old_")
+        result_data['data_predisposizione'] = result_data.pop('data_predisposizione_tfo', None)
+        # Il conteggio delle TFO cambia su entrambi gli edifici se id_abitazione è cambiato
+        invalidate_building_extents([extent] if old_extent == extent else [extent, old_extent])
+        return TfoInDB(**result_data)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Errore CRUD update_existing_tfo: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore DB durante aggiornamento TFO: {str(e)}")
+
+# Eliminazione con l'estensione dell'edificio della TFO (nessuna riga = 404), per invalidare
+# le risposte in cache che contano le sue TFO
+DELETE_TFO_SQL = f"""
+    WITH eliminata AS (
+        DELETE FROM verifiche_edifici WHERE id = $1 RETURNING id_abitazione
+    )
+    SELECT {extent_select_sql("c.geometry")}
+    FROM eliminata e LEFT JOIN catasto_abitazioni c ON c.id = e.id_abitazione;
+"""
+
+async def delete_tfo_by_id(db_conn, tfo_id: int) -> bool:
+    try:
+        deleted = await timed_query("tfo_delete", db_conn.fetchrow(DELETE_TFO_SQL, tfo_id))
+        if deleted is None:
+            raise HTTPException(status_code=404, detail=f"TFO ID {tfo_id} non trovata per l'eliminazione.")
+        invalidate_building_extent(pop_extent(dict(deleted)))
+        return True
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Errore CRUD delete_tfo_by_id: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore DB durante eliminazione TFO: {str(e)}")
@@ -0,0 +1,58 @@
+from app.core.lod import LodLevel
+from app.crud.crud_geojson import active_buildings_filter
+
+# SQL delle tile MVT condiviso da crud_tiles_async e da app/apis/tiles.py (MVT_BUFFER, MVT_EXTENT)
+MVT_EXTENT = 4096 # Risoluzione interna della tile (coordinate quantizzate su questa griglia)
+MVT_BUFFER = 64 # Margine in unità tile per evitare artefatti ai bordi dei poligoni
+
+# Proprietà degli edifici incluse nel layer 'edifici' (quelle usate dal popup e dal form della mappa)
+TILE_BUILDING_PROPERTIES = """
+    c.id, c.objectid, c.edifc_uso, c.edifc_nome,
+    COALESCE(c.predisposto_fibra, false) AS predisposto_fibra,
+    c.indirizzo, c.comune, c.codice_belfiore, c.codice_catastale,
+    c.data_predisposizione::text AS data_predisposizione,
+    c.lat::float8 AS lat, c.lon::float8 AS lon
+"""
+
+_tile_sql_cache = {}
+
+def build_tile_sql(available_columns, version: int, level: LodLevel) -> str:
+    """SQL della tile MVT per le colonne disponibili, con segnaposto $1..$3 per z, x, y."""
+    cache_key = (version, level.name)
+    statement_sql = _tile_sql_cache.get(cache_key)
+    if statement_sql is None:
+        if level.precomputed_column and level.precomputed_column in available_columns:
+            source = f"c.{level.precomputed_column}"
+        else:
+            source = "ST_Force2D(c.geometry)"
+        active_filter = active_buildings_filter(available_columns)
+        if level.centroids_only:
+            edifici_sql = "''::bytea"
+        else:
+            edifici_sql = f"""COALESCE((
+                SELECT ST_AsMVT(e, 'edifici', {MVT_EXTENT}, 'geom') FROM (
+                    SELECT {TILE_BUILDING_PROPERTIES},
+                        ST_AsMVTGeom(ST_Transform({source}, 3857), b.geom_3857, {MVT_EXTENT}, {MVT_BUFFER}, true) AS geom
+                    FROM catasto_abitazioni c, bounds b
+                    WHERE c.geometry && b.geom_4326{active_filter}
+                ) e WHERE e.geom IS NOT NULL
+            ), ''::bytea)"""
+        statement_sql = f"""
+            WITH bounds AS (
+                SELECT t.env AS geom_3857,
+                       ST_Transform(ST_Expand(t.env, (ST_XMax(t.env) - ST_XMin(t.env)) * {MVT_BUFFER} / {MVT_EXTENT}.0), 4326) AS geom_4326
+                FROM ST_TileEnvelope($1, $2, $3) AS t(env)
+            )
+            SELECT {edifici_sql} || COALESCE((
+                SELECT ST_AsMVT(p, 'centroidi', {MVT_EXTENT}, 'geom') FROM (
+                    SELECT c.id, true AS is_centroid, COALESCE(c.predisposto_fibra, false) AS predisposto_fibra,
+                        ST_AsMVTGeom(ST_Transform(c.centroide, 3857), b.geom_3857, {MVT_EXTENT}, 0, true) AS geom
+                    FROM catasto_abitazioni c, bounds b
+                    WHERE c.centroide && b.geom_4326{active_filter}
+                ) p WHERE p.geom IS NOT NULL
+            ), ''::bytea) AS tile
+        """
+        if any(key[0] != version for key in _tile_sql_cache):
+            _tile_sql_cache.clear()
+        _tile_sql_cache[cache_key] = statement_sql
+    return statement_sql
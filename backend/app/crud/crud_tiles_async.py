@@ -0,0 +1,26 @@
+from fastapi import HTTPException
+from app.db.schema import schema_registry
+from app.core.lod import get_lod_level
+from app.crud.crud_tiles import build_tile_sql
+from app.core.metrics import timed_query
+import asyncpg
+
+async def get_tile(db_conn, z: int, x: int, y: int) -> bytes:
+    """
+    Restituisce la tile Mapbox Vector Tile (z/x/y, schema XYZ) di catasto_abitazioni.
+    Layer 'edifici' (poligoni, solo dagli zoom con poligoni, vedi app/core/lod.py)
+    e 'centroidi', entrambi con la proprietà predisposto_fibra.
+    """
+    level = get_lod_level(z)
+    try:
+        available_columns = await schema_registry.get_columns_async(db_conn, "catasto_abitazioni")
+        statement_sql = build_tile_sql(available_columns, schema_registry.version, level)
+        tile = await timed_query("tile_mvt", db_conn.fetchval(statement_sql, z, x, y))
+        return bytes(tile) if tile is not None else b""
+    except (asyncpg.exceptions.UndefinedColumnError, asyncpg.exceptions.FeatureNotSupportedError) as e:
+        schema_registry.invalidate("catasto_abitazioni")
+        print(f"Errore CRUD tile MVT (schema cambiato): {e}")
+        raise HTTPException(status_code=503, detail="Schema della tabella modificato, riprovare.")
+    except Exception as e:
+        print(f"Errore CRUD tile MVT {z}/{x}/{y}: {e}")
+        raise HTTPException(status_code=500, detail=f"Errore nella generazione della tile: {str(e)}")
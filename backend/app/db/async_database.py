@@ -0,0 +1,191 @@
+"""
+Accesso asincrono al database con un pool asyncpg, usato dagli endpoint async def.
+
+Mentre una query è in corso l'event loop serve le altre richieste: un solo worker
+uvicorn può tenere aperte centinaia di richieste della mappa, limitate solo dalle
+connessioni del pool (le richieste in eccesso attendono in acquire, senza occupare thread).
+asyncpg prepara e mette in cache gli statement per connessione in automatico.
+
+Una connessione rimasta inattiva oltre ASYNC_DB_POOL_HEALTH_CHECK_IDLE secondi è verificata
+con SELECT 1 prima di essere prestata: se il server l'ha chiusa (riavvio, timeout, rete)
+viene scartata e la richiesta ne riceve un'altra invece di fallire alla prima query.
+"""
+
+import asyncio
+import time
+
+import asyncpg
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.response_cache import response_cache
+from app.db.schema import SCHEMA_CHANGED_CHANNEL, schema_registry
+
+_pool = None
+_pool_lock = None
+_listener_conn = None
+_stats = {
+    "checkouts": 0,
+    "wait_time_total": 0.0,
+    "wait_time_max": 0.0,
+    "timeouts": 0,
+    "waiting": 0, # Richieste in attesa di una connessione in questo momento
+    "waiting_max": 0,
+    "saturated_checkouts": 0, # Richieste arrivate con tutte le max_size connessioni in uso
+    "health_checks": 0,
+    "health_check_failures": 0,
+}
+# Ultimo rilascio di ogni connessione del pool, per PID del backend
+_last_released = {}
+
+
+class StaleConnectionError(Exception):
+    """Connessione del pool non più valida, rilevata dal controllo all'acquisizione."""
+
+
+def _connect_kwargs() -> dict:
+    config = settings.DB_CONFIG_PSYCOPG2
+    return {
+        "host": config["host"],
+        "port": int(config["port"]),
+        "database": config["database"],
+        "user": config["user"],
+        "password": config["password"],
+    }
+
+
+def _on_schema_changed(connection, pid, channel, payload):
+    # Stesso canale usato da scripts/load_initial_data.py: la notifica arriva
+    # sulla connessione dedicata all'ascolto, senza polling per richiesta.
+    # Il loader la invia anche dopo un caricamento incrementale, che cambia i dati
+    # senza cambiare lo schema: le risposte bbox/tile in cache non sono più valide.
+    schema_registry.invalidate(payload or None)
+    response_cache.clear()
+
+
+async def _check_idle_connection(conn):
+    """
+    setup del pool, eseguito a ogni acquire: verifica con SELECT 1 la connessione se è rimasta
+    inattiva oltre ASYNC_DB_POOL_HEALTH_CHECK_IDLE secondi. Se fallisce asyncpg chiude la connessione.
+    """
+    last_released = _last_released.get(conn.get_server_pid())
+    if last_released is None or time.monotonic() - last_released < settings.ASYNC_DB_POOL_HEALTH_CHECK_IDLE:
+        return
+    _stats["health_checks"] += 1
+    try:
+        await conn.fetchval("SELECT 1")
+    except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+        _stats["health_check_failures"] += 1
+        raise StaleConnectionError(str(e)) from e
+
+
+def _record_release(conn):
+    _last_released[conn.get_server_pid()] = time.monotonic()
+    # I PID delle connessioni chiuse dal pool non tornano: si tengono al massimo due per connessione
+    if len(_last_released) > 2 * settings.ASYNC_DB_POOL_MAX_SIZE:
+        cutoff = time.monotonic() - settings.ASYNC_DB_POOL_MAX_INACTIVE_LIFETIME
+        for pid in [pid for pid, released in _last_released.items() if released < cutoff]:
+            del _last_released[pid]
+
+
+async def init_async_pool() -> asyncpg.Pool:
+    """Crea il pool asyncpg globale e la connessione in ascolto delle modifiche schema (idempotente)."""
+    global _pool, _pool_lock, _listener_conn
+    if _pool is not None:
+        return _pool
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            pool = await asyncpg.create_pool(
+                min_size=settings.ASYNC_DB_POOL_MIN_SIZE,
+                max_size=settings.ASYNC_DB_POOL_MAX_SIZE,
+                max_inactive_connection_lifetime=settings.ASYNC_DB_POOL_MAX_INACTIVE_LIFETIME,
+                statement_cache_size=settings.ASYNC_DB_STATEMENT_CACHE_SIZE,
+                setup=_check_idle_connection,
+                **_connect_kwargs()
+            )
+            try:
+                _listener_conn = await asyncpg.connect(**_connect_kwargs())
+                await _listener_conn.add_listener(SCHEMA_CHANGED_CHANNEL, _on_schema_changed)
+            except Exception:
+                await pool.close()
+                raise
+            _pool = pool
+    return _pool
+
+
+async def close_async_pool():
+    global _pool, _listener_conn
+    if _listener_conn is not None:
+        await _listener_conn.close()
+        _listener_conn = None
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_async_pool_stats() -> dict:
+    if _pool is None:
+        return {"initialized": False}
+    checkouts = _stats["checkouts"]
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    max_size = _pool.get_max_size()
+    return {
+        "initialized": True,
+        **_stats,
+        "wait_time_avg": _stats["wait_time_total"] / checkouts if checkouts else 0.0,
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "min_size": _pool.get_min_size(),
+        "max_size": max_size,
+        # Quota delle connessioni massime in uso: a 1 le nuove richieste attendono (vedi waiting)
+        "utilization": (size - idle) / max_size if max_size else 0.0,
+        "saturated": size - idle >= max_size,
+    }
+
+
+def _pool_saturated(pool) -> bool:
+    return pool.get_size() >= pool.get_max_size() and pool.get_idle_size() == 0
+
+
+async def _acquire(pool):
+    """Acquire con timeout; una connessione scartata dal controllo di inattività è sostituita una volta."""
+    try:
+        return await pool.acquire(timeout=settings.ASYNC_DB_POOL_TIMEOUT)
+    except StaleConnectionError as e:
+        print(f"Connessione asyncpg non più valida scartata dal pool: {e}")
+        return await pool.acquire(timeout=settings.ASYNC_DB_POOL_TIMEOUT)
+
+
+async def get_async_db_connection():
+    """Dependency FastAPI: presta una connessione asyncpg dal pool e la restituisce a fine richiesta."""
+    start = time.monotonic()
+    try:
+        pool = await init_async_pool()
+        if _pool_saturated(pool):
+            _stats["saturated_checkouts"] += 1
+        _stats["waiting"] += 1
+        _stats["waiting_max"] = max(_stats["waiting_max"], _stats["waiting"])
+        try:
+            conn = await _acquire(pool)
+        finally:
+            _stats["waiting"] -= 1
+    except asyncio.TimeoutError:
+        _stats["timeouts"] += 1
+        print(f"Pool connessioni asyncpg esaurito: nessuna connessione entro {settings.ASYNC_DB_POOL_TIMEOUT}s")
+        raise HTTPException(status_code=503, detail="Database occupato, riprovare più tardi")
+    except (OSError, asyncpg.PostgresError, StaleConnectionError) as e:
+        print(f"Errore di connessione al database: {e}")
+        raise HTTPException(status_code=500, detail="Errore di connessione al database")
+    wait = time.monotonic() - start
+    _stats["checkouts"] += 1
+    _stats["wait_time_total"] += wait
+    _stats["wait_time_max"] = max(_stats["wait_time_max"], wait)
+    try:
+        yield conn
+    finally:
+        _record_release(conn)
+        await pool.release(conn)
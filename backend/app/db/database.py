@@ -1,23 +1,7 @@
-from sqlalchemy import create_engine
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from fastapi import HTTPException
-from app.core.config import settings
 import decimal
 import datetime
 import json
-from sqlalchemy import text
-
-engine = create_engine(settings.DATABASE_URL)
-
-def get_db_connection():
-    """Restituisce una connessione psycopg2."""
-    try:
-        conn = psycopg2.connect(**settings.DB_CONFIG_PSYCOPG2)
-        return conn
-    except psycopg2.Error as e:
-        print(f"Errore di connessione al database: {e}")
-        raise HTTPException(status_code=500, detail="Errore di connessione al database")
+import orjson
 
 def json_serializable(value):
     """Converte tipi non serializzabili."""
@@ -27,6 +11,32 @@ def json_serializable(value):
         return value.isoformat() if value is not None else None
     return value
 
+def orjson_default(value):
+    """Tipi che orjson non serializza nativamente (date e datetime lo sono già)."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Tipo non serializzabile: {type(value).__name__}")
+
+def select_list(columns) -> str:
+    """Lista SELECT da coppie (chiave JSON, espressione SQL)."""
+    return ", ".join(f"{expression} AS {key}" for key, expression in columns)
+
+def row_keys(columns) -> tuple:
+    """Chiavi JSON, nell'ordine delle colonne restituite da select_list."""
+    return tuple(key for key, _ in columns)
+
+def rows_to_dicts(keys: tuple, rows) -> list:
+    """
+    Oggetti JSON da righe lette per posizione (record asyncpg o tuple), con le chiavi
+    calcolate una volta per query. Le colonne oltre len(keys) sono ignorate.
+    I valori vanno serializzati con orjson (date native, Decimal con orjson_default):
+    niente json_serializable per valore né modelli Pydantic per riga.
+    """
+    return [dict(zip(keys, row)) for row in rows]
+
+def dumps_json(content) -> bytes:
+    return orjson.dumps(content, default=orjson_default)
+
 def validate_geometry(geom_json):
     """Valida la geometria GeoJSON."""
     try:
@@ -39,12 +49,3 @@ def validate_geometry(geom_json):
         return True, geom
     except Exception as e:
         return False, str(e)
-
-def get_table_columns(table_name: str):
-    """Ottiene le colonne effettive della tabella."""
-    query = f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table_name}'"
-    # Utilizzo di una connessione diretta engine.connect() per questa utility
-    # In un'applicazione reale, potresti voler passare una sessione/connessione
-    with engine.connect() as conn: # type: ignore
-        result = conn.execute(text(query)) # type: ignore # sqlalchemy.text
-        return [row[0] for row in result]
\ No newline at end of file
@@ -0,0 +1,57 @@
+import threading
+from typing import Dict, List, Optional
+
+# Canale LISTEN/NOTIFY su cui lo script di caricamento segnala le modifiche allo schema.
+# Deve coincidere con il valore usato in scripts/load_initial_data.py.
+SCHEMA_CHANGED_CHANNEL = "fibragis_schema_changed"
+
+
+class SchemaRegistry:
+    """
+    Cache delle colonne delle tabelle, letta da information_schema una sola volta.
+
+    La cache viene invalidata esplicitamente con invalidate() oppure quando una
+    connessione in ascolto su SCHEMA_CHANGED_CHANNEL riceve una notifica.
+    Ogni invalidazione incrementa `version`, usata per dare nomi nuovi agli
+    statement preparati che dipendono dall'elenco delle colonne.
+    """
+
+    def __init__(self):
+        self._columns: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self.version = 0
+
+    async def get_columns_async(self, conn, table_name: str) -> List[str]:
+        """Colonne della tabella (connessione asyncpg); le notifiche arrivano al listener del pool."""
+        columns = self._columns.get(table_name)
+        if columns is not None:
+            return columns
+        rows = await conn.fetch(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = $1
+            ORDER BY ordinal_position
+            """,
+            table_name
+        )
+        columns = [row["column_name"] for row in rows]
+        with self._lock:
+            self._columns[table_name] = columns
+        return columns
+
+    def invalidate(self, table_name: Optional[str] = None):
+        """Svuota la cache (di una tabella o di tutte) e invalida gli statement derivati."""
+        with self._lock:
+            if table_name is None:
+                self._columns.clear()
+            else:
+                self._columns.pop(table_name, None)
+            self.version += 1
+        print(f"Cache schema invalidata ({table_name or 'tutte le tabelle'}), versione {self.version}")
+
+    async def warm_async(self, conn, table_names: List[str]):
+        for table_name in table_names:
+            await self.get_columns_async(conn, table_name)
+
+
+schema_registry = SchemaRegistry()
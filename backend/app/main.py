@@ -1,11 +1,52 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
-from app.apis import geojson, predisposizioni, tfo # Assicurati che questi moduli esistano
+from app.db.async_database import init_async_pool, close_async_pool, get_async_pool_stats
+from app.crud.crud_clusters_async import fold_cluster_deltas
+from app.db.schema import schema_registry
+from app.core.response_cache import response_cache
+from app.core.compression import CompressionMiddleware
+from app.core.metrics import MetricsMiddleware, render_metrics, gauge_lines, PROMETHEUS_CONTENT_TYPE
+from app.apis import geojson, predisposizioni, tfo, tiles, clusters # Assicurati che questi moduli esistano
 # Se hai un router per la root, importalo anche: from app.apis import root_router
 
-app = FastAPI(title=settings.PROJECT_NAME)
+async def fold_cluster_deltas_periodically(interval: float):
+    """
+    Consolida a intervalli i delta dei cluster accodati dai trigger, così GET /clusters ne somma
+    pochi. Con più worker ne lavora uno alla volta (advisory lock in consolida_cluster_delta()).
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            pool = await init_async_pool()
+            async with pool.acquire() as conn:
+                await fold_cluster_deltas(conn)
+        except Exception as e:
+            print(f"Consolidamento dei delta dei cluster non riuscito (ritentato tra {interval}s): {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Apre il pool all'avvio così la prima richiesta non paga l'handshake,
+    # e legge una volta sola lo schema delle tabelle usate dalle query dinamiche
+    try:
+        pool = await init_async_pool()
+        async with pool.acquire() as conn:
+            await schema_registry.warm_async(conn, ["catasto_abitazioni"])
+    except Exception as e:
+        print(f"Pool connessioni non inizializzato all'avvio (verrà ritentato alla prima richiesta): {e}")
+    fold_task = None
+    if settings.CLUSTER_DELTA_FOLD_INTERVAL > 0:
+        fold_task = asyncio.create_task(fold_cluster_deltas_periodically(settings.CLUSTER_DELTA_FOLD_INTERVAL))
+    yield
+    if fold_task is not None:
+        fold_task.cancel()
+    await close_async_pool()
+
+app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
 
 # Configurazione CORS
 origins = [
@@ -22,14 +63,65 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # ETag, Last-Modified e X-Next-Cursor sono letti da apiService.js e mapHandler.js;
+    # Server-Timing rende visibili i tempi nel pannello Network del browser
+    expose_headers=["ETag", "Last-Modified", "X-Next-Cursor", "Server-Timing"],
+)
+
+# Compressione gzip/brotli delle risposte oltre COMPRESSION_MIN_SIZE byte
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MIN_SIZE,
+    gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+    brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
 )
 
+# Aggiunto per ultimo, quindi più esterno: misura anche la compressione e conta i byte inviati
+if settings.METRICS_ENABLED:
+    app.add_middleware(
+        MetricsMiddleware,
+        slow_threshold_ms=settings.SLOW_REQUEST_THRESHOLD_MS,
+        server_timing=settings.SERVER_TIMING_ENABLED,
+    )
+
 # Includi i router delle API
 # app.include_router(root_router.router) # Se hai un router per la root
 app.include_router(geojson.router, prefix="/geojson", tags=["geojson"])
 app.include_router(predisposizioni.router, prefix="/predisposizioni", tags=["predisposizioni"])
 app.include_router(tfo.router, prefix="/tfos", tags=["tfos"])
+app.include_router(tiles.router, prefix="/tiles", tags=["tiles"])
+app.include_router(clusters.router, prefix="/clusters", tags=["clusters"])
 
 @app.get("/")
 def root():
-    return {"message": f"Server FastAPI per {settings.PROJECT_NAME} attivo!"}
\ No newline at end of file
+    return {"message": f"Server FastAPI per {settings.PROJECT_NAME} attivo!"}
+
+@app.get("/db/pool", tags=["diagnostica"])
+def db_pool_stats():
+    """
+    Statistiche del pool di connessioni asyncpg per il dimensionamento: checkout, attese e timeout,
+    richieste in attesa, saturazione (in_use rispetto a max_size) e controlli delle connessioni inattive.
+    """
+    return get_async_pool_stats()
+
+@app.get("/cache/stats", tags=["diagnostica"])
+def response_cache_stats():
+    """Contatori della cache delle risposte bbox/tile (hit, miss, evizioni, invalidazioni)."""
+    return response_cache.stats()
+
+@app.post("/db/schema/invalidate", tags=["diagnostica"])
+def invalidate_schema_cache():
+    """Forza la rilettura delle colonne delle tabelle (es. dopo una modifica manuale dello schema)."""
+    schema_registry.invalidate()
+    return {"status": "success", "schema_version": schema_registry.version}
+
+@app.get("/metrics", tags=["diagnostica"])
+def metrics():
+    """
+    Metriche in formato Prometheus: latenza e dimensione delle risposte per route, tempo e righe
+    delle query CRUD, tempo di serializzazione, stato del pool e della cache delle risposte.
+    """
+    extra = gauge_lines("fibragis_db_pool", "Statistiche del pool asyncpg (GET /db/pool).", get_async_pool_stats(), "stat")
+    extra += gauge_lines("fibragis_response_cache", "Contatori della cache delle risposte (GET /cache/stats).",
+                         response_cache.stats(), "stat")
+    return Response(content=render_metrics(extra), media_type=PROMETHEUS_CONTENT_TYPE)
\ No newline at end of file
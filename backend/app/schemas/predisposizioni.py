@@ -1,7 +1,10 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional
 import datetime
 
+from app.schemas.common import BaseResponse
+from app.db.database import validate_geometry
+
 class PredisposizioneBase(BaseModel):
     id: int  # ID della tabella catasto_abitazioni
     indirizzo: Optional[str] = None
@@ -17,6 +20,13 @@ class PredisposizioneBase(BaseModel):
 class PredisposizioneInDB(PredisposizioneBase):
     pass
 
+# Risposta di GET /predisposizioni: una pagina della lista e il cursore della successiva
+class PredisposizioniPage(BaseModel):
+    items: List[PredisposizioneInDB]
+    next: Optional[str] = None # Cursore da passare come cursor per la pagina successiva (null = ultima)
+    total: Optional[int] = None # Righe che soddisfano i filtri, solo sulla prima pagina
+    total_capped: bool = False # True se le righe sono più di total (conteggio interrotto)
+
 class PredisposizioneCreate(BaseModel):
     id: int  # Questo è l'id della tabella catasto_abitazioni
     indirizzo: str
@@ -26,4 +36,55 @@ class PredisposizioneCreate(BaseModel):
     comune: str
     codice_belfiore: Optional[str] = None
     codice_catastale: Optional[str] = None
-    data_predisposizione: datetime.date
\ No newline at end of file
+    data_predisposizione: datetime.date
+
+# Selezione di edifici per le operazioni multiple: esattamente uno fra ids, bbox e polygon.
+# Con bbox/polygon sono selezionati gli edifici il cui centroide cade nell'area.
+class BuildingSelection(BaseModel):
+    ids: Optional[List[int]] = None # ID della tabella catasto_abitazioni
+    bbox: Optional[List[float]] = Field(None, min_length=4, max_length=4) # [west, south, east, north] in EPSG:4326
+    polygon: Optional[dict] = None # Geometria GeoJSON Polygon/MultiPolygon in EPSG:4326
+
+    @model_validator(mode="after")
+    def check_single_criterion(self):
+        criteria = [c for c in (self.ids, self.bbox, self.polygon) if c is not None]
+        if len(criteria) != 1:
+            raise ValueError("Specificare esattamente uno fra ids, bbox e polygon.")
+        if self.polygon is not None:
+            is_valid, result = validate_geometry(self.polygon)
+            if not is_valid:
+                raise ValueError(f"Poligono non valido: {result}")
+            if result["type"] not in ("Polygon", "MultiPolygon"):
+                raise ValueError("Il poligono deve essere di tipo Polygon o MultiPolygon.")
+        return self
+
+# Campi comuni applicati a tutti gli edifici di una selezione: indirizzo, uso_edificio,
+# codice_belfiore e codice_catastale non indicati restano quelli già presenti,
+# lat/lon mancanti vengono presi dal centroide dell'edificio
+class PredisposizioneBatchValues(BaseModel):
+    comune: str
+    data_predisposizione: datetime.date
+    indirizzo: Optional[str] = None
+    uso_edificio: Optional[str] = None
+    codice_belfiore: Optional[str] = None
+    codice_catastale: Optional[str] = None
+
+# Corpo di POST /predisposizioni/batch: dati specifici per edificio (items)
+# oppure una selezione con i campi comuni (selection + values)
+class PredisposizioneBatchCreate(BaseModel):
+    items: Optional[List[PredisposizioneCreate]] = None
+    selection: Optional[BuildingSelection] = None
+    values: Optional[PredisposizioneBatchValues] = None
+
+    @model_validator(mode="after")
+    def check_shape(self):
+        if (self.items is None) == (self.selection is None):
+            raise ValueError("Specificare items oppure selection.")
+        if self.selection is not None and self.values is None:
+            raise ValueError("Con selection è obbligatorio values.")
+        return self
+
+class PredisposizioneBatchResponse(BaseResponse):
+    buildings: int = 0 # Edifici predisposti o resettati
+    tfos_deleted: int = 0 # TFO eliminate insieme alle predisposizioni
+    not_found: List[int] = [] # ID richiesti esplicitamente ma non presenti
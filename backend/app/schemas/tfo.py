@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 import datetime
 
 class TfoBase(BaseModel):
@@ -34,6 +34,31 @@ class TfoInDB(TfoBase):
         # ma può essere utile se si ha un mix. Per psycopg2 diretto, non è usato.
 
 
+# Esito di una riga di POST /tfos/bulk: row è la posizione nell'array JSON
+# (o la riga dati del CSV, intestazione esclusa), contando da 0
+class TfoBulkRowResult(BaseModel):
+    row: int
+    status: str # "created" oppure "error"
+    id: Optional[int] = None # ID della TFO creata
+    id_abitazione: Optional[int] = None
+    detail: Optional[str] = None # Motivo dello scarto
+
+class TfoBulkResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[TfoBulkRowResult]
+
+# TFO di un edificio nella risposta di GET /tfos/batch (lista vuota se non ne ha)
+class TfoBuildingGroup(BaseModel):
+    id_abitazione: int
+    tfos: List[TfoInDB]
+
+class TfoBatchResponse(BaseModel):
+    buildings: List[TfoBuildingGroup]
+    not_found: List[int] = [] # ID richiesti ma non presenti in catasto_abitazioni
+    truncated: bool = False # Con bbox: più edifici di TFO_BATCH_MAX_BUILDINGS nell'area
+
+
 # Per la risposta GET /predisposizioni/{predisposizione_id}/tfos
 # il campo data_predisposizione_tfo viene mappato a data_predisposizione
 # Questo può essere gestito nel CRUD o qui se si fa una trasformazione esplicita
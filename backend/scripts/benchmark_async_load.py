@@ -0,0 +1,180 @@
+"""
+Confronto di carico tra il percorso sincrono (psycopg2) e quello asincrono (asyncpg) di /geojson/bbox.
+
+Esegue la stessa sequenza di richieste bbox casuali (entro l'estensione dei dati)
+con N richieste contemporanee:
+- sincrono: la stessa query bbox (build_bbox_sql) eseguita con psycopg2 su connessioni
+  prestate da una coda, in un pool di 40 thread come il threadpool di Starlette che
+  eseguiva gli endpoint def;
+- asincrono: crud_geojson_async sul pool asyncpg, tutte le richieste sull'event loop.
+Per ogni livello di concorrenza stampa richieste/s e latenze p50/p95/p99.
+Entrambi i percorsi usano al massimo ASYNC_DB_POOL_MAX_SIZE connessioni.
+
+Richiede il database configurato in .env. Esecuzione dalla cartella backend/:
+    python scripts/benchmark_async_load.py --requests 2000 --concurrency 10 50 200
+"""
+
+import argparse
+import asyncio
+import os
+import queue
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import psycopg2.extras
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.core.config import settings
+from app.core.lod import get_lod_level
+from app.crud import crud_geojson_async
+from app.crud.crud_geojson import build_bbox_sql, FEATURE_COLLECTION_START, _feature_collection_end, _row_to_feature_bytes
+from app.db.async_database import init_async_pool, close_async_pool
+
+STARLETTE_THREADPOOL_SIZE = 40 # Limite predefinito di anyio per gli endpoint sincroni
+PSYCOPG2_PLACEHOLDERS = ("%s",) * 6
+
+
+class SyncConnectionQueue:
+    """Connessioni psycopg2 aperte in anticipo: i thread in eccesso attendono in get() come su un pool."""
+
+    def __init__(self, size: int):
+        self._connections = queue.Queue()
+        for _ in range(size):
+            self._connections.put(psycopg2.connect(**settings.DB_CONFIG_PSYCOPG2))
+
+    def getconn(self):
+        return self._connections.get()
+
+    def putconn(self, conn):
+        conn.rollback()
+        self._connections.put(conn)
+
+    def closeall(self):
+        while not self._connections.empty():
+            self._connections.get().close()
+
+
+def table_columns(conn) -> list:
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'catasto_abitazioni'
+            ORDER BY ordinal_position
+        """)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def sync_feature_collection(conn, columns, west, south, east, north, zoom: int, limit: int) -> bytes:
+    """Prima pagina del FeatureCollection bbox con psycopg2, come faceva l'endpoint sincrono."""
+    statement_sql = build_bbox_sql(columns, 0, get_lod_level(zoom), PSYCOPG2_PLACEHOLDERS)
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute(statement_sql, (west, south, east, north, 0, limit + 1))
+        rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    parts = []
+    for row in rows:
+        parts.extend(_row_to_feature_bytes(row))
+    last_id = rows[-1]["id"] if rows else 0
+    return FEATURE_COLLECTION_START + b", ".join(parts) + _feature_collection_end(last_id, has_more)
+
+
+def data_extent():
+    conn = psycopg2.connect(**settings.DB_CONFIG_PSYCOPG2)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e) FROM (SELECT ST_Extent(centroide) AS e FROM catasto_abitazioni) s")
+            return cursor.fetchone()
+    finally:
+        conn.close()
+
+
+def random_bboxes(extent, count: int, span: float):
+    xmin, ymin, xmax, ymax = extent
+    bboxes = []
+    for _ in range(count):
+        west = random.uniform(xmin, max(xmin, xmax - span))
+        south = random.uniform(ymin, max(ymin, ymax - span))
+        bboxes.append((west, south, west + span, south + span))
+    return bboxes
+
+
+def percentile(values, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def report(label: str, concurrency: int, elapsed: float, latencies):
+    print(f"{label:10} conc={concurrency:4}  {len(latencies) / elapsed:8.1f} req/s  "
+          f"p50={statistics.median(latencies) * 1000:7.1f} ms  "
+          f"p95={percentile(latencies, 0.95) * 1000:7.1f} ms  "
+          f"p99={percentile(latencies, 0.99) * 1000:7.1f} ms")
+
+
+def run_sync(pool, columns, bboxes, zoom: int, concurrency: int):
+    def one_request(bbox):
+        start = time.perf_counter()
+        conn = pool.getconn()
+        try:
+            sync_feature_collection(conn, columns, *bbox, zoom=zoom, limit=settings.GEOJSON_PAGE_SIZE)
+        finally:
+            pool.putconn(conn)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    # Le richieste oltre il threadpool restano in coda come in Starlette
+    with ThreadPoolExecutor(max_workers=min(concurrency, STARLETTE_THREADPOOL_SIZE)) as executor:
+        latencies = list(executor.map(one_request, bboxes))
+    return time.perf_counter() - start, latencies
+
+
+async def run_async(pool, bboxes, zoom: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request(bbox):
+        async with semaphore:
+            start = time.perf_counter()
+            async with pool.acquire() as conn:
+                await crud_geojson_async.get_feature_collection_by_bbox(conn, *bbox, zoom=zoom, after_id=0, limit=settings.GEOJSON_PAGE_SIZE)
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one_request(bbox) for bbox in bboxes))
+    return time.perf_counter() - start, latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="Richieste per livello di concorrenza")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200], help="Richieste contemporanee")
+    parser.add_argument("--zoom", type=int, default=16, help="Zoom delle richieste bbox")
+    parser.add_argument("--span", type=float, default=0.005, help="Lato del bbox in gradi")
+    args = parser.parse_args()
+
+    random.seed(42)
+    bboxes = random_bboxes(data_extent(), args.requests, args.span)
+
+    sync_pool = SyncConnectionQueue(settings.ASYNC_DB_POOL_MAX_SIZE)
+    conn = sync_pool.getconn()
+    try:
+        columns = table_columns(conn)
+    finally:
+        sync_pool.putconn(conn)
+    async_pool = await init_async_pool()
+    try:
+        for concurrency in args.concurrency:
+            elapsed, latencies = run_sync(sync_pool, columns, bboxes, args.zoom, concurrency)
+            report("sincrono", concurrency, elapsed, latencies)
+            elapsed, latencies = await run_async(async_pool, bboxes, args.zoom, concurrency)
+            report("asincrono", concurrency, elapsed, latencies)
+    finally:
+        sync_pool.closeall()
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,151 @@
+"""
+Confronto dei formati di /geojson/bbox su un bbox denso: GeoJSON e FlatGeobuf,
+non compressi, con gzip e con brotli (se il pacchetto è installato).
+
+Il bbox predefinito è la cella più densa della griglia dei cluster (tabella
+catasto_cluster_celle, zoom 13 = tile allo zoom 15, circa 1,2 km di lato); in mancanza
+della tabella si usa un quadrato al centro dei dati. Per ogni zoom e formato stampa:
+- tempo della query con la serializzazione (mediana di --repeat esecuzioni);
+- dimensione del corpo e dimensione compressa con gzip/brotli ai livelli configurati;
+- tempo di decodifica lato client: json.loads/orjson.loads per il GeoJSON,
+  Fiona (GDAL) per il FlatGeobuf, oltre al tempo di decompressione.
+Nel browser la decodifica del FlatGeobuf è fatta dalla libreria flatgeobuf
+(vedi mapHandler.js): i tempi di Fiona sono un'indicazione dell'ordine di grandezza.
+
+Richiede il database configurato in .env. Esecuzione dalla cartella backend/:
+    python scripts/benchmark_bbox_formats.py --zoom 14 16 18
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.core.config import settings
+from app.core.clusters import CLUSTER_TABLE, cell_zoom
+from app.core.response_cache import tile_to_bbox
+from app.crud import crud_geojson_async
+from app.db.async_database import init_async_pool, close_async_pool
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import fiona
+    from fiona.io import MemoryFile
+except ImportError:
+    fiona = None
+
+
+async def dense_bbox(conn, span: float):
+    """Bbox della cella di cluster con più edifici, o un quadrato di lato span al centro dei dati."""
+    try:
+        row = await conn.fetchrow(
+            f"SELECT cell_x, cell_y FROM {CLUSTER_TABLE} WHERE zoom = 13 ORDER BY buildings DESC LIMIT 1"
+        )
+        if row:
+            return tile_to_bbox(cell_zoom(13), row["cell_x"], row["cell_y"]), "cella di cluster più densa"
+    except Exception as e:
+        print(f"Tabella dei cluster non disponibile ({e}): uso il centro dei dati.")
+    row = await conn.fetchrow("SELECT ST_X(c) AS x, ST_Y(c) AS y FROM (SELECT ST_Centroid(ST_Extent(centroide)) AS c FROM catasto_abitazioni) s")
+    half = span / 2
+    return (row["x"] - half, row["y"] - half, row["x"] + half, row["y"] + half), "centro dei dati"
+
+
+def median_time(func, repeat: int):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+async def median_time_async(coro_factory, repeat: int):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await coro_factory()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def decode_flatgeobuf(body: bytes) -> int:
+    with MemoryFile(body, ext=".fgb") as memfile:
+        with memfile.open() as collection:
+            return sum(1 for _ in collection)
+
+
+def report_format(label: str, body: bytes, query_time: float, decoders, repeat: int):
+    print(f"  {label:10} query+serializzazione {query_time * 1000:8.1f} ms   {len(body) / 1024:9.1f} KiB")
+    gzipped = gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL)
+    gunzip_time, _ = median_time(lambda: gzip.decompress(gzipped), repeat)
+    print(f"  {'':10} gzip {settings.COMPRESSION_GZIP_LEVEL:2}  {len(gzipped) / 1024:9.1f} KiB ({len(gzipped) / len(body):5.1%})"
+          f"  decompressione {gunzip_time * 1000:7.1f} ms")
+    if brotli is not None:
+        compressed = brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY)
+        unbrotli_time, _ = median_time(lambda: brotli.decompress(compressed), repeat)
+        print(f"  {'':10} br {settings.COMPRESSION_BROTLI_QUALITY:4}  {len(compressed) / 1024:9.1f} KiB ({len(compressed) / len(body):5.1%})"
+              f"  decompressione {unbrotli_time * 1000:7.1f} ms")
+    for decoder_label, decoder in decoders:
+        decode_time, _ = median_time(lambda: decoder(body), repeat)
+        print(f"  {'':10} decodifica {decoder_label:14} {decode_time * 1000:8.1f} ms")
+
+
+async def run(args):
+    pool = await init_async_pool()
+    try:
+        async with pool.acquire() as conn:
+            if args.bbox:
+                bbox, origin = tuple(args.bbox), "--bbox"
+            else:
+                bbox, origin = await dense_bbox(conn, args.span)
+            print(f"Bbox ({origin}): {', '.join(f'{v:.5f}' for v in bbox)}")
+            if brotli is None:
+                print("Pacchetto brotli non installato: confronto solo con gzip.")
+            if fiona is None:
+                print("Fiona non installato: decodifica FlatGeobuf non misurata.")
+            for zoom in args.zoom:
+                page = dict(zip(("west", "south", "east", "north"), bbox), zoom=zoom, after_id=0, limit=args.limit)
+                geojson_time, geojson_body = await median_time_async(
+                    lambda: crud_geojson_async.get_feature_collection_by_bbox(db_conn=conn, **page), args.repeat
+                )
+                fgb_time, (fgb_body, _) = await median_time_async(
+                    lambda: crud_geojson_async.get_flatgeobuf_by_bbox(db_conn=conn, **page), args.repeat
+                )
+                features = len(orjson.loads(geojson_body)["features"])
+                print(f"\nZoom {zoom}: {features} feature GeoJSON (poligoni + centroidi), pagina di {args.limit} edifici")
+                report_format("GeoJSON", geojson_body, geojson_time,
+                              [("json.loads", json.loads), ("orjson.loads", orjson.loads)], args.repeat)
+                if not fgb_body:
+                    print("  FlatGeobuf pagina vuota")
+                    continue
+                decoders = [("Fiona", decode_flatgeobuf)] if fiona is not None else []
+                report_format("FlatGeobuf", fgb_body, fgb_time, decoders, args.repeat)
+    finally:
+        await close_async_pool()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dimensioni e tempi di decodifica dei formati di /geojson/bbox.")
+    parser.add_argument("--zoom", type=int, nargs="+", default=[14, 16, 18], help="Zoom da confrontare (livelli di dettaglio)")
+    parser.add_argument("--bbox", type=float, nargs=4, metavar=("WEST", "SOUTH", "EAST", "NORTH"), help="Bbox da usare al posto della cella più densa")
+    parser.add_argument("--span", type=float, default=0.01, help="Lato in gradi del bbox al centro dei dati, se manca la tabella dei cluster")
+    parser.add_argument("--limit", type=int, default=settings.GEOJSON_MAX_PAGE_SIZE, help="Edifici per pagina")
+    parser.add_argument("--repeat", type=int, default=5, help="Ripetizioni di ogni misura (si riporta la mediana)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
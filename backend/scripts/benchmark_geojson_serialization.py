@@ -0,0 +1,103 @@
+"""
+Micro-benchmark della serializzazione delle feature di /geojson/bbox.
+
+Confronta, su righe sintetiche simili a quelle restituite dalla query bbox
+(MULTIPOLYGON con coordinate a 20 cifre, proprietà del catasto):
+- percorso precedente: json.loads della geometria (validate_geometry),
+  json_serializable su ogni proprietà e json.dumps del FeatureCollection;
+- percorso attuale: GeoJSON di PostGIS inserito così com'è e proprietà con orjson.
+
+Non richiede il database. Esecuzione dalla cartella backend/:
+    python scripts/benchmark_geojson_serialization.py --rows 3000
+"""
+
+import argparse
+import datetime
+import decimal
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.db.database import json_serializable, validate_geometry
+from app.crud.crud_geojson import _row_to_feature_bytes, FEATURE_COLLECTION_START, _feature_collection_end
+
+
+def make_row(i: int, vertices: int) -> dict:
+    lon0, lat0 = 13.39 + random.random() * 0.02, 42.34 + random.random() * 0.02
+    ring = [[lon0 + 0.0001 * random.random(), lat0 + 0.0001 * random.random(), 700.0] for _ in range(vertices)]
+    ring.append(ring[0])
+    geometry = {"type": "MultiPolygon", "coordinates": [[ring]]}
+    centroid = {"type": "Point", "coordinates": [lon0, lat0]}
+    return {
+        "id": i, "objectid": 100000 + i, "edifc_uso": "01", "edifc_ty": "01", "edifc_sot": "01",
+        "classid": None, "edifc_nome": f"Edificio {i}", "edifc_stat": "01",
+        "edifc_at": decimal.Decimal("9.5"), "scril": "DBT", "meta_ist": "01", "edifc_mon": "02",
+        "shape_length": decimal.Decimal("48.123456"), "shape_area": decimal.Decimal("120.5"),
+        "created_at": datetime.datetime(2024, 5, 1, 10, 30), "indirizzo": None, "uso_edificio": None,
+        "comune": None, "codice_belfiore": None, "codice_catastale": None,
+        "data_predisposizione": datetime.date(2024, 6, 1) if i % 5 == 0 else None,
+        "lat": None, "lon": None, "predisposto_fibra": i % 5 == 0,
+        # json.dumps con 20 cifre significative simula ST_AsGeoJSON(geometry, 20)
+        "geometry_geojson": json.dumps(geometry), "centroide_geojson": json.dumps(centroid),
+    }
+
+
+def serialize_previous(rows) -> bytes:
+    features = []
+    for row in rows:
+        props = {}
+        for k, v in row.items():
+            if k not in ["geometry_geojson", "centroide_geojson"]:
+                props[k] = json_serializable(v)
+        is_valid, geom_obj = validate_geometry(row.get("geometry_geojson"))
+        if is_valid:
+            features.append({"type": "Feature", "geometry": geom_obj, "properties": props.copy()})
+        is_valid_c, geom_c_obj = validate_geometry(row.get("centroide_geojson"))
+        if is_valid_c:
+            features.append({"type": "Feature", "geometry": geom_c_obj, "properties": {
+                "is_centroid": True, "parent_id": props.get("id") or props.get("objectid"),
+                "predisposto_fibra": props.get("predisposto_fibra", False)
+            }})
+    return json.dumps({"type": "FeatureCollection", "features": features}).encode("utf-8")
+
+
+def serialize_current(rows) -> bytes:
+    parts = []
+    for row in rows:
+        parts.extend(_row_to_feature_bytes(row))
+    return FEATURE_COLLECTION_START + b", ".join(parts) + _feature_collection_end(None, False)
+
+
+def measure(fn, rows, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=3000, help="Righe (edifici) per iterazione")
+    parser.add_argument("--vertices", type=int, default=12, help="Vertici per poligono")
+    parser.add_argument("--repeat", type=int, default=5, help="Ripetizioni (si tiene la migliore)")
+    args = parser.parse_args()
+
+    random.seed(42)
+    rows = [make_row(i, args.vertices) for i in range(args.rows)]
+    # Verifica che i due percorsi producano le stesse feature (il percorso attuale aggiunge solo 'next')
+    assert json.loads(serialize_previous(rows))["features"] == json.loads(serialize_current(rows))["features"]
+
+    previous = measure(serialize_previous, rows, args.repeat)
+    current = measure(serialize_current, rows, args.repeat)
+    for label, elapsed in (("precedente (loads/dumps)", previous), ("attuale (raw + orjson)", current)):
+        print(f"{label:28} {elapsed * 1000:8.1f} ms totali  {elapsed / args.rows * 1e6:7.2f} µs/edificio")
+    print(f"Speedup: {previous / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Micro-benchmark della costruzione delle risposte delle liste (TFO di un edificio e
+pagina di GET /predisposizioni) su righe sintetiche.
+
+Confronta tre percorsi:
+- precedente: riga come dict (RealDictRow / record per nome), json_serializable su ogni
+  valore, rinomina con pop, un modello Pydantic per riga, poi la validazione e la
+  serializzazione di response_model fatte da FastAPI (validate + dump_json della lista);
+- TypeAdapter: righe per posizione in dict, una sola validazione e dump_json della lista
+  con un TypeAdapter (nessun modello costruito a mano);
+- attuale: righe per posizione con le chiavi precalcolate e orjson direttamente in byte,
+  senza validazione dei dati letti dal DB (app/db/database.py, rows_to_dicts e dumps_json).
+Verifica anche che i tre percorsi producano lo stesso JSON.
+
+Non richiede il database. Esecuzione dalla cartella backend/:
+    python scripts/benchmark_list_serialization.py --rows 10000 100000
+"""
+
+import argparse
+import datetime
+import decimal
+import os
+import random
+import sys
+import time
+from typing import List
+
+import orjson
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.db.database import json_serializable, rows_to_dicts, dumps_json
+from app.crud.crud_tfo_async import TFO_JSON_KEYS
+from app.crud.crud_predisposizione_async import PREDISPOSIZIONE_JSON_KEYS
+from app.schemas.tfo import TfoInDB
+from app.schemas.predisposizioni import PredisposizioneInDB, PredisposizioniPage
+
+
+def make_tfo(i: int):
+    """(riga per nome come la leggeva la query precedente, riga per posizione come TFO_JSON_COLUMNS)"""
+    lat = decimal.Decimal(f"{42.34 + random.random() * 0.02:.6f}")
+    lon = decimal.Decimal(f"{13.39 + random.random() * 0.02:.6f}")
+    date = datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 365) if i % 7 else None
+    named = {
+        "id": i, "id_abitazione": 1000 + i // 4, "data_predisposizione_tfo": date,
+        "scala": "A", "piano": str(i % 6), "interno": str(i % 20), "id_operatore": "OP01",
+        "id_tfo": f"TFO-{i:07d}", "id_roe": f"ROE-{i // 8:06d}",
+        "indirizzo": f"Via Roma {i // 4}", "lat": lat, "lon": lon, "codice_catastale": "A345",
+    }
+    positional = (
+        named["id_abitazione"], None, named["scala"], named["piano"], named["interno"], named["id_operatore"],
+        named["id_tfo"], named["id_roe"], named["id"], named["indirizzo"], float(lat), float(lon),
+        named["codice_catastale"], date,
+    )
+    return named, positional
+
+
+def make_predisposizione(i: int):
+    lat = decimal.Decimal(f"{42.34 + random.random() * 0.02:.6f}")
+    lon = decimal.Decimal(f"{13.39 + random.random() * 0.02:.6f}")
+    date = datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 365)
+    named = {
+        "id": i, "indirizzo": f"Via Roma {i}", "comune": "L'Aquila", "codice_catastale": "A345",
+        "data_predisposizione": date, "lat": lat, "lon": lon, "uso_edificio": "Residenziale",
+        "codice_belfiore": "A345", "predisposto_fibra": True, "sort_key": i,
+    }
+    positional = (i, named["indirizzo"], named["comune"], named["codice_catastale"], date,
+                  float(lat), float(lon), named["uso_edificio"], named["codice_belfiore"], True, i)
+    return named, positional
+
+
+TFO_LIST = TypeAdapter(List[TfoInDB])
+PAGE = TypeAdapter(PredisposizioniPage)
+
+
+def tfo_previous(named_rows) -> bytes:
+    results = []
+    for row in named_rows:
+        row_data = {k: json_serializable(v) for k, v in row.items()}
+        row_data['data_predisposizione'] = row_data.pop('data_predisposizione_tfo', None)
+        results.append(TfoInDB(**row_data))
+    # response_model=List[TfoInDB]: FastAPI valida il valore restituito e lo serializza
+    return TFO_LIST.dump_json(TFO_LIST.validate_python(results))
+
+
+def tfo_type_adapter(positional_rows) -> bytes:
+    return TFO_LIST.dump_json(TFO_LIST.validate_python(rows_to_dicts(TFO_JSON_KEYS, positional_rows)))
+
+
+def tfo_current(positional_rows) -> bytes:
+    return dumps_json(rows_to_dicts(TFO_JSON_KEYS, positional_rows))
+
+
+def page_previous(named_rows) -> bytes:
+    items = []
+    for row in named_rows:
+        row_data = {k: json_serializable(v) for k, v in row.items()}
+        row_data.pop("sort_key")
+        items.append(PredisposizioneInDB(**row_data))
+    page = PredisposizioniPage(items=items, next="cursore", total=len(items), total_capped=False)
+    return PAGE.dump_json(PAGE.validate_python(page))
+
+
+def page_type_adapter(positional_rows) -> bytes:
+    page = {"items": rows_to_dicts(PREDISPOSIZIONE_JSON_KEYS, positional_rows), "next": "cursore",
+            "total": len(positional_rows), "total_capped": False}
+    return PAGE.dump_json(PAGE.validate_python(page))
+
+
+def page_current(positional_rows) -> bytes:
+    return dumps_json({"items": rows_to_dicts(PREDISPOSIZIONE_JSON_KEYS, positional_rows), "next": "cursore",
+                       "total": len(positional_rows), "total_capped": False})
+
+
+def measure(fn, rows, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def compare(label: str, make_row, paths, count: int, repeat: int):
+    pairs = [make_row(i) for i in range(count)]
+    named_rows = [named for named, _ in pairs]
+    positional_rows = [positional for _, positional in pairs]
+    (previous_label, previous), *others = paths
+    reference = orjson.loads(previous(named_rows[:200]))
+    for other_label, other in others:
+        if orjson.loads(other(positional_rows[:200])) != reference:
+            raise SystemExit(f"{label}: il percorso '{other_label}' produce un JSON diverso dal precedente")
+    previous_time = measure(previous, named_rows, repeat)
+    print(f"\n{label}, {count} righe")
+    print(f"  {previous_label:12} {previous_time * 1000:9.1f} ms  {previous_time / count * 1e6:6.2f} µs/riga")
+    for other_label, other in others:
+        other_time = measure(other, positional_rows, repeat)
+        print(f"  {other_label:12} {other_time * 1000:9.1f} ms  {other_time / count * 1e6:6.2f} µs/riga"
+              f"  ({previous_time / other_time:4.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Costo della costruzione delle risposte delle liste.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="Righe per misura")
+    parser.add_argument("--repeat", type=int, default=3, help="Ripetizioni (si riporta il tempo migliore)")
+    args = parser.parse_args()
+    random.seed(42)
+    for count in args.rows:
+        compare("TFO di un edificio (List[TfoInDB])", make_tfo,
+                [("precedente", tfo_previous), ("TypeAdapter", tfo_type_adapter), ("orjson", tfo_current)],
+                count, args.repeat)
+        compare("Pagina predisposizioni (PredisposizioniPage)", make_predisposizione,
+                [("precedente", page_previous), ("TypeAdapter", page_type_adapter), ("orjson", page_current)],
+                count, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
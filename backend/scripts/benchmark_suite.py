@@ -0,0 +1,434 @@
+"""
+Suite di benchmark end-to-end su un PostGIS locale, con risultati in JSON confrontabili fra esecuzioni.
+
+Scenari (selezionabili con --scenarios):
+- loader: caricamento con load_initial_data.py dei file indicati con --load (righe/s, MB/s).
+  ATTENZIONE: il loader ricrea le tabelle, usare un database dedicato ai benchmark;
+- bbox: GET /geojson/bbox per ogni zoom (--zoom) e lato del bbox in gradi (--spans), con bbox
+  centrati su edifici scelti a caso, quindi dove ci sono dati (cache delle risposte disattivata,
+  salvo --response-cache);
+- writes: POST /predisposizioni, POST /tfos e PUT /tfos/{id} su edifici scelti a caso
+  (modificano il database);
+- lists: GET /predisposizioni (prima pagina con conteggio, ordinamento per comune, ricerca),
+  GET /tfos/predisposizioni/{id}/tfos e GET /tfos/batch su pagine di 50 edifici.
+Ogni scenario HTTP è ripetuto ai livelli di concorrenza di --concurrency e riporta
+richieste/s, errori, latenze media/p50/p95/p99/max e dimensione media delle risposte.
+
+Le richieste sono eseguite in-process sull'app ASGI (middleware, routing, serializzazione,
+pool asyncpg reale: esclusi rete e uvicorn), oppure con --base-url su un server avviato a parte.
+Il database (per scegliere gli edifici e per il loader) è quello configurato in .env; un
+dataset riproducibile si genera con scripts/generate_synthetic_catasto.py.
+
+Esecuzione dalla cartella backend/:
+    python scripts/generate_synthetic_catasto.py --buildings 1000000 --files 4 --output data/sintetico_1m/
+    python scripts/benchmark_suite.py --load data/sintetico_1m/ --workers 4 --concurrency 1 10 50
+    python scripts/benchmark_suite.py --scenarios bbox lists --compare benchmark_results/suite_20240601_101500.json
+    python scripts/benchmark_suite.py --results nuovo.json --compare vecchio.json   # solo confronto
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import asyncpg
+import orjson
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, BACKEND_DIR)
+from app.core.config import settings
+from app.db.async_database import _connect_kwargs, close_async_pool
+
+SCENARIOS = ("loader", "bbox", "writes", "lists")
+DEFAULT_RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmark_results")
+
+
+# --- Esecuzione delle richieste -------------------------------------------------------------
+
+class AsgiClient:
+    """Richieste direttamente all'app ASGI, nello stesso event loop del pool asyncpg."""
+
+    def __init__(self, app, accept_encoding: str):
+        self.app = app
+        self.accept_encoding = accept_encoding
+
+    async def request(self, method: str, path: str, params=None, json=None):
+        body = orjson.dumps(json) if json is not None else b""
+        headers = [(b"host", b"benchmark"), (b"accept-encoding", self.accept_encoding.encode())]
+        if json is not None:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": urlencode(params or {}, doseq=True).encode(), "headers": headers,
+            "client": ("127.0.0.1", 50000), "server": ("benchmark", 80),
+        }
+        received = False
+        status = None
+        chunks = []
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.Event().wait() # Il client resta connesso fino alla fine della risposta
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+
+class HttpClient:
+    """Richieste HTTP a un server avviato a parte (urllib in un pool di thread, una connessione per richiesta)."""
+
+    def __init__(self, base_url: str, accept_encoding: str, threads: int):
+        self.base_url = base_url.rstrip("/")
+        self.accept_encoding = accept_encoding
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def _request(self, method, path, params, json):
+        url = self.base_url + path + (f"?{urlencode(params, doseq=True)}" if params else "")
+        data = orjson.dumps(json) if json is not None else None
+        headers = {"Accept-Encoding": self.accept_encoding}
+        if data is not None:
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(url, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    async def request(self, method: str, path: str, params=None, json=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._request, method, path, params, json)
+
+
+def percentile(values, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def run_requests(client, requests, concurrency: int, expected=(200, 201)):
+    """Esegue le richieste (method, path, params, json) con `concurrency` richieste in corso alla volta."""
+    pending = iter(requests)
+    latencies, sizes, bodies = [], [], []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for method, path, params, json in pending:
+            start = time.perf_counter()
+            try:
+                status, body = await client.request(method, path, params, json)
+            except Exception as e:
+                print(f"   errore {method} {path}: {e}")
+                status, body = None, b""
+            latencies.append(time.perf_counter() - start)
+            sizes.append(len(body))
+            if status in expected:
+                bodies.append(body)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, sizes, errors, bodies
+
+
+def summarize(scenario: str, name: str, concurrency: int, elapsed: float, latencies, sizes, errors) -> dict:
+    ms = [latency * 1000 for latency in latencies]
+    result = {
+        "scenario": scenario, "name": name, "concurrency": concurrency, "requests": len(ms), "errors": errors,
+        "elapsed_s": round(elapsed, 3), "throughput_rps": round(len(ms) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(ms), 2), "p50": round(percentile(ms, 0.50), 2),
+            "p95": round(percentile(ms, 0.95), 2), "p99": round(percentile(ms, 0.99), 2), "max": round(max(ms), 2),
+        },
+        "bytes_mean": round(statistics.fmean(sizes)),
+    }
+    latency = result["latency_ms"]
+    print(f"   {name:42} c={concurrency:<4} {result['throughput_rps']:8.1f} req/s  p50 {latency['p50']:8.1f}  "
+          f"p95 {latency['p95']:8.1f}  p99 {latency['p99']:8.1f} ms  {result['bytes_mean'] / 1024:8.1f} KiB  errori {errors}")
+    return result
+
+
+async def measure(client, results, scenario, name, make_requests, levels, expected=(200, 201)):
+    """Ripete lo scenario a ogni livello di concorrenza; restituisce i corpi delle risposte riuscite."""
+    bodies = []
+    for concurrency in levels:
+        elapsed, latencies, sizes, errors, ok_bodies = await run_requests(client, make_requests(), concurrency, expected)
+        if latencies:
+            results.append(summarize(scenario, name, concurrency, elapsed, latencies, sizes, errors))
+        bodies.extend(ok_bodies)
+    return bodies
+
+
+# --- Dati di partenza -----------------------------------------------------------------------
+
+async def database_info(conn) -> dict:
+    return {
+        "postgres": await conn.fetchval("SELECT version();"),
+        "postgis": await conn.fetchval("SELECT postgis_full_version();"),
+        "buildings": await conn.fetchval("SELECT count(*) FROM catasto_abitazioni;"),
+        "predisposti": await conn.fetchval("SELECT count(*) FROM catasto_abitazioni WHERE predisposto_fibra = true;"),
+        "tfos": await conn.fetchval("SELECT count(*) FROM verifiche_edifici;"),
+    }
+
+
+async def random_buildings(conn, count: int, predisposti: bool = False):
+    """Edifici scelti a caso per ID (veloce anche su milioni di righe): (id, lon, lat)."""
+    max_id = await conn.fetchval("SELECT max(id) FROM catasto_abitazioni;") or 0
+    if max_id == 0:
+        return []
+    if predisposti:
+        # Gli edifici predisposti sono pochi e coperti dagli indici parziali
+        rows = await conn.fetch("""
+            SELECT id, ST_X(centroide) AS lon, ST_Y(centroide) AS lat FROM catasto_abitazioni
+            WHERE centroide IS NOT NULL AND predisposto_fibra = true ORDER BY random() LIMIT $1;
+        """, count)
+    else:
+        candidates = [random.randint(1, max_id) for _ in range(count * 2)]
+        rows = await conn.fetch("""
+            SELECT id, ST_X(centroide) AS lon, ST_Y(centroide) AS lat FROM catasto_abitazioni
+            WHERE id = ANY($1::int4[]) AND centroide IS NOT NULL LIMIT $2;
+        """, candidates, count)
+    return [(row["id"], row["lon"], row["lat"]) for row in rows]
+
+
+# --- Scenari --------------------------------------------------------------------------------
+
+def run_loader(args):
+    command = [sys.executable, os.path.join(os.path.dirname(__file__), "load_initial_data.py"),
+               *args.load, "--workers", str(args.workers)]
+    files = []
+    for path in args.load:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in os.listdir(path) if name.endswith((".geojson", ".json")))
+        else:
+            files.append(path)
+    size_mb = sum(os.path.getsize(path) for path in files) / 1024 ** 2
+    print(f"\n▶ loader: {' '.join(command[1:])} ({size_mb:.1f} MB)")
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=BACKEND_DIR)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise SystemExit(f"Il loader è terminato con codice {completed.returncode}")
+    return elapsed, size_mb
+
+
+async def scenario_bbox(client, conn, args, results):
+    print("\n▶ bbox: GET /geojson/bbox")
+    centres = await random_buildings(conn, args.requests)
+    if not centres:
+        print("   nessun edificio nel database")
+        return
+    for zoom in args.zoom:
+        for span in args.spans:
+            def make_requests(zoom=zoom, span=span):
+                for _, lon, lat in random.choices(centres, k=args.requests):
+                    half = span / 2
+                    params = {"west": lon - half, "south": lat - half, "east": lon + half, "north": lat + half, "zoom": zoom}
+                    yield "GET", "/geojson/bbox", params, None
+            await measure(client, results, "bbox", f"zoom={zoom} span={span}", make_requests, args.concurrency)
+
+
+async def scenario_writes(client, conn, args, results):
+    print("\n▶ writes: POST /predisposizioni, POST /tfos, PUT /tfos/{id}")
+    buildings = await random_buildings(conn, args.write_requests)
+    if not buildings:
+        print("   nessun edificio nel database")
+        return
+    today = datetime.date.today().isoformat()
+
+    def predisposizioni():
+        for building_id, lon, lat in random.choices(buildings, k=args.write_requests):
+            yield "POST", "/predisposizioni", None, {
+                "id": building_id, "indirizzo": f"Via Benchmark {building_id}", "comune": random.choice(("L'Aquila", "Scoppito", "Pizzoli")),
+                "lat": lat, "lon": lon, "uso_edificio": "Residenziale", "data_predisposizione": today,
+            }
+    bodies = await measure(client, results, "writes", "POST /predisposizioni", predisposizioni, args.concurrency)
+    predisposti = sorted({orjson.loads(body)["id"] for body in bodies})
+
+    def new_tfos():
+        for building_id in random.choices(predisposti, k=args.write_requests):
+            yield "POST", "/tfos", None, {
+                "id_abitazione": building_id, "scala": "A", "piano": str(random.randint(0, 5)),
+                "interno": str(random.randint(1, 20)), "id_operatore": "OP01",
+                "id_tfo": f"BENCH-{random.getrandbits(40):010x}", "id_roe": "ROE-BENCH", "data_predisposizione_tfo": today,
+            }
+    bodies = await measure(client, results, "writes", "POST /tfos", new_tfos, args.concurrency)
+    tfos = [orjson.loads(body) for body in bodies]
+
+    def tfo_updates():
+        for tfo in random.choices(tfos, k=args.write_requests):
+            yield "PUT", f"/tfos/{tfo['id']}", None, {**{k: tfo[k] for k in (
+                "id_abitazione", "scala", "piano", "interno", "id_operatore", "id_tfo", "id_roe")},
+                "data_predisposizione_tfo": today, "interno": str(random.randint(1, 20))}
+    if tfos:
+        await measure(client, results, "writes", "PUT /tfos/{id}", tfo_updates, args.concurrency)
+
+
+async def scenario_lists(client, conn, args, results):
+    print("\n▶ lists: GET /predisposizioni, /tfos/predisposizioni/{id}/tfos, /tfos/batch")
+    predisposti = [building_id for building_id, _, _ in await random_buildings(conn, 1000, predisposti=True)]
+    if not predisposti:
+        print("   nessun edificio predisposto: eseguire prima lo scenario writes")
+        return
+    pages = [
+        ("GET /predisposizioni", {"limit": 50}),
+        ("GET /predisposizioni sort=comune", {"limit": 50, "sort": "comune", "order": "desc"}),
+        ("GET /predisposizioni q=Benchmark", {"limit": 50, "q": "Benchmark"}),
+    ]
+    for name, params in pages:
+        await measure(client, results, "lists", name,
+                      lambda params=params: (("GET", "/predisposizioni", params, None) for _ in range(args.requests)),
+                      args.concurrency)
+    await measure(client, results, "lists", "GET /tfos/predisposizioni/{id}/tfos",
+                  lambda: (("GET", f"/tfos/predisposizioni/{building_id}/tfos", None, None)
+                           for building_id in random.choices(predisposti, k=args.requests)), args.concurrency)
+    await measure(client, results, "lists", "GET /tfos/batch (50 edifici)",
+                  lambda: (("GET", "/tfos/batch", {"ids": random.sample(predisposti, min(50, len(predisposti)))}, None)
+                           for _ in range(args.requests)), args.concurrency)
+
+
+# --- Risultati ------------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result: dict) -> tuple:
+    return result["scenario"], result["name"], result.get("concurrency")
+
+
+def compare(current: dict, previous: dict, previous_label: str):
+    """Differenze percentuali fra due esecuzioni, per scenario, nome e concorrenza."""
+    old = {result_key(result): result for result in previous["results"]}
+    print(f"\nConfronto con {previous_label} (commit {previous['meta'].get('git_commit')}):")
+    for result in current["results"]:
+        before = old.get(result_key(result))
+        if before is None:
+            continue
+        if result["scenario"] == "loader":
+            delta = (result["rows_per_s"] / before["rows_per_s"] - 1) * 100
+            print(f"   {result['name']:42}            righe/s {delta:+6.1f}%")
+            continue
+        p50 = (result["latency_ms"]["p50"] / before["latency_ms"]["p50"] - 1) * 100
+        p95 = (result["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1) * 100
+        rps = (result["throughput_rps"] / before["throughput_rps"] - 1) * 100
+        print(f"   {result['name']:42} c={result['concurrency']:<4} req/s {rps:+6.1f}%  p50 {p50:+6.1f}%  p95 {p95:+6.1f}%")
+
+
+async def run_suite(args) -> dict:
+    results = []
+    meta = {
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"), "git_commit": git_commit(),
+        "python": platform.python_version(), "machine": platform.platform(),
+        "mode": "http" if args.base_url else "asgi", "base_url": args.base_url,
+        "concurrency": args.concurrency, "requests": args.requests, "write_requests": args.write_requests,
+        "response_cache": args.response_cache, "accept_encoding": args.accept_encoding,
+        "settings": {name: getattr(settings, name) for name in (
+            "ASYNC_DB_POOL_MIN_SIZE", "ASYNC_DB_POOL_MAX_SIZE", "GEOJSON_PAGE_SIZE", "COMPRESSION_MIN_SIZE",
+            "COMPRESSION_GZIP_LEVEL", "COMPRESSION_BROTLI_QUALITY")},
+    }
+    if "loader" in args.scenarios:
+        if not args.load:
+            print("Scenario loader saltato: indicare i file con --load.")
+        else:
+            elapsed, size_mb = run_loader(args)
+            loader_result = {"scenario": "loader", "name": f"load_initial_data --workers {args.workers}",
+                             "elapsed_s": round(elapsed, 1), "size_mb": round(size_mb, 1),
+                             "mb_per_s": round(size_mb / elapsed, 2)}
+
+    conn = await asyncpg.connect(**_connect_kwargs())
+    try:
+        meta["database"] = await database_info(conn)
+        if "loader" in args.scenarios and args.load:
+            loader_result["rows"] = meta["database"]["buildings"]
+            loader_result["rows_per_s"] = round(loader_result["rows"] / loader_result["elapsed_s"])
+            results.append(loader_result)
+            print(f"   {loader_result['rows']} righe in {loader_result['elapsed_s']}s: "
+                  f"{loader_result['rows_per_s']} righe/s, {loader_result['mb_per_s']} MB/s")
+        if args.base_url:
+            client = HttpClient(args.base_url, args.accept_encoding, threads=max(args.concurrency))
+        else:
+            from app.main import app
+            from app.core.response_cache import response_cache
+            response_cache.enabled = args.response_cache
+            client = AsgiClient(app, args.accept_encoding)
+        scenarios = {"bbox": scenario_bbox, "writes": scenario_writes, "lists": scenario_lists}
+        for name in ("bbox", "writes", "lists"):
+            if name in args.scenarios:
+                await scenarios[name](client, conn, args, results)
+    finally:
+        await conn.close()
+        await close_async_pool()
+    meta["finished_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+    return {"meta": meta, "results": results}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end di loader ed endpoint su PostGIS locale.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS), help="Scenari da eseguire")
+    parser.add_argument("--load", nargs="+", help="File o cartelle GeoJSON per lo scenario loader (ricrea le tabelle)")
+    parser.add_argument("--workers", type=int, default=4, help="Processi del loader")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50], help="Richieste contemporanee")
+    parser.add_argument("--requests", type=int, default=300, help="Richieste per misura negli scenari di lettura")
+    parser.add_argument("--write-requests", type=int, default=200, help="Richieste per misura nello scenario writes")
+    parser.add_argument("--zoom", type=int, nargs="+", default=[14, 16, 18], help="Zoom di /geojson/bbox")
+    parser.add_argument("--spans", type=float, nargs="+", default=[0.005, 0.01, 0.02], help="Lati dei bbox in gradi")
+    parser.add_argument("--accept-encoding", default="br, gzip", help="Accept-Encoding delle richieste (come un browser)")
+    parser.add_argument("--response-cache", action="store_true", help="Lascia attiva la cache delle risposte (solo in-process)")
+    parser.add_argument("--base-url", help="Server già avviato (es. http://localhost:8000) invece dell'app in-process")
+    parser.add_argument("--output", help=f"File JSON dei risultati (default: {DEFAULT_RESULTS_DIR}/suite_<data>.json)")
+    parser.add_argument("--compare", help="Risultati di un'esecuzione precedente da confrontare")
+    parser.add_argument("--results", help="Non esegue la suite: confronta questo file con --compare")
+    parser.add_argument("--seed", type=int, default=42, help="Seme per la scelta di edifici e bbox")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.results:
+        if not args.compare:
+            raise SystemExit("--results richiede --compare")
+        with open(args.results, "rb") as f:
+            current = orjson.loads(f.read())
+    else:
+        random.seed(args.seed)
+        current = asyncio.run(run_suite(args))
+        output = args.output or os.path.join(
+            DEFAULT_RESULTS_DIR, f"suite_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "wb") as f:
+            f.write(orjson.dumps(current, option=orjson.OPT_INDENT_2))
+        print(f"\n✓ Risultati salvati in {output}")
+    if args.compare:
+        with open(args.compare, "rb") as f:
+            compare(current, orjson.loads(f.read()), args.compare)
+
+
+if __name__ == "__main__":
+    main()
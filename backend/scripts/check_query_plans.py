@@ -0,0 +1,380 @@
+"""
+Controllo dei piani di esecuzione delle query dei moduli CRUD async (quelli usati dagli endpoint),
+perché una modifica allo schema, agli indici o al testo di una query non faccia perdere
+silenziosamente un indice.
+
+Ogni caso chiama la vera funzione CRUD con una connessione che, prima di ogni statement,
+ne registra il piano con EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) in un savepoint annullato,
+poi lo esegue normalmente: sono coperte anche le query composte a runtime (filtri della
+lista, colonne disponibili, livello di dettaglio). Ogni caso gira in una transazione
+annullata alla fine, quindi anche i casi di scrittura non lasciano modifiche.
+Le query bbox e tile sono composte da build_bbox_sql e build_tile_sql (crud_geojson.py,
+crud_tiles.py), le stesse usate dagli endpoint.
+
+Segnala come regressione:
+- Seq Scan su una tabella con almeno --large-rows righe stimate (reltuples);
+- un indice previsto dal caso non usato da nessuno statement, o assente dal database
+  (il controllo è saltato se la tabella dell'indice è sotto --large-rows righe);
+- rispetto a --compare (un'esecuzione precedente sullo stesso database): costo stimato
+  di uno statement cresciuto oltre --cost-ratio volte, o un indice usato prima e non più.
+I piani completi e il riepilogo sono salvati in backend/query_plans/. Esce con codice 1
+se c'è almeno una regressione, quindi può essere eseguito in CI dopo il caricamento.
+
+È uno script a sé, non un test: nessuna suite (pytest o altro) lo raccoglie, va eseguito
+esplicitamente, ad esempio come passo di CI dopo il caricamento dei dati. Se il database non
+è raggiungibile il controllo è saltato con un messaggio ed esce con codice 0; con
+--require-database esce invece con codice 1 (per la CI in cui il database deve esserci).
+
+Il database è quello configurato in .env e deve essere popolato (es. con
+scripts/generate_synthetic_catasto.py e load_initial_data.py): con poche righe il planner
+sceglie legittimamente le scansioni sequenziali. I casi su TFO e predisposizioni servono
+almeno un edificio predisposto con una TFO, altrimenti sono saltati.
+
+Esecuzione dalla cartella backend/:
+    python scripts/check_query_plans.py
+    python scripts/check_query_plans.py --compare query_plans/baseline.json
+    python scripts/check_query_plans.py --output query_plans/baseline.json   # nuovo riferimento
+    python scripts/check_query_plans.py --require-database                    # in CI
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+
+import asyncpg
+import orjson
+from fastapi import HTTPException
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, BACKEND_DIR)
+from app.core.config import settings
+from app.core.clusters import cell_zoom
+from app.core.response_cache import lonlat_to_tile, snap_bbox_to_tiles
+from app.crud import (
+    crud_clusters_async, crud_data_version_async, crud_geojson_async, crud_predisposizione_async,
+    crud_tfo_async, crud_tiles_async
+)
+from app.db.async_database import _connect_kwargs
+from app.db.schema import schema_registry
+from app.schemas.predisposizioni import PredisposizioneCreate, PredisposizioneBatchCreate, BuildingSelection
+from app.schemas.tfo import TfoCreate
+from benchmark_bbox_formats import dense_bbox
+from benchmark_suite import git_commit
+
+DEFAULT_OUTPUT_DIR = os.path.join(BACKEND_DIR, "query_plans")
+CONNECT_TIMEOUT = 10 # Secondi per la connessione iniziale, prima di saltare il controllo
+
+# Indici attesi: ogni gruppo è soddisfatto se almeno uno dei suoi indici compare nei piani del caso
+CATASTO_PK = "catasto_abitazioni_pkey"
+TFO_PK = "verifiche_edifici_pkey"
+TFO_BY_BUILDING = "idx_verifiche_edifici_id_abitazione"
+GEOM = "idx_catasto_abitazioni_geom"
+CENTROIDE = "idx_catasto_abitazioni_centroide"
+PREDISPOSTI_ID = "idx_predisposti_id"
+CLUSTER_PK = "catasto_cluster_celle_pkey"
+
+TODAY = datetime.date.today()
+
+
+class ExplainingConnection:
+    """Connessione asyncpg che registra il piano di ogni statement prima di eseguirlo."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.plans = []
+
+    def __getattr__(self, name):
+        # transaction(), is_in_transaction() e il resto passano alla connessione reale
+        return getattr(self._conn, name)
+
+    async def _explain(self, query: str, args) -> None:
+        # Savepoint annullato: EXPLAIN ANALYZE esegue davvero lo statement (anche le scritture)
+        savepoint = self._conn.transaction()
+        await savepoint.start()
+        try:
+            raw = await self._conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", *args)
+        finally:
+            await savepoint.rollback()
+        self.plans.append((query, orjson.loads(raw)[0]))
+
+    async def fetch(self, query, *args, **kwargs):
+        await self._explain(query, args)
+        return await self._conn.fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        await self._explain(query, args)
+        return await self._conn.fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        await self._explain(query, args)
+        return await self._conn.fetchval(query, *args, **kwargs)
+
+    async def execute(self, query, *args, **kwargs):
+        await self._explain(query, args)
+        return await self._conn.execute(query, *args, **kwargs)
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def summarize_plan(query: str, explained: dict) -> dict:
+    """Riepilogo confrontabile di un piano: costo, tempi, buffer, scansioni e indici usati."""
+    root = explained["Plan"]
+    nodes = list(plan_nodes(root))
+    return {
+        "query": " ".join(query.split()),
+        "cost": root["Total Cost"],
+        "rows": root.get("Actual Rows"),
+        "execution_ms": explained.get("Execution Time"),
+        "planning_ms": explained.get("Planning Time"),
+        "shared_hit": root.get("Shared Hit Blocks", 0),
+        "shared_read": root.get("Shared Read Blocks", 0),
+        "seq_scans": sorted({node["Relation Name"] for node in nodes if node["Node Type"] == "Seq Scan"}),
+        "indexes": sorted({node["Index Name"] for node in nodes if "Index Name" in node}),
+        "nodes": [
+            node["Node Type"] + (f" using {node['Index Name']}" if "Index Name" in node else "")
+            + (f" on {node['Relation Name']}" if "Relation Name" in node else "")
+            for node in nodes
+        ],
+        "plan": explained,
+    }
+
+
+async def sample_inputs(conn, span: float) -> dict:
+    """Bbox denso, edifici al suo interno e, se esiste, un edificio predisposto con una TFO."""
+    bbox, origin = await dense_bbox(conn, span)
+    buildings = await conn.fetch("""
+        SELECT id FROM catasto_abitazioni WHERE centroide && ST_MakeEnvelope($1, $2, $3, $4, 4326)
+        ORDER BY id LIMIT 50;
+    """, *bbox)
+    ids = await conn.fetchrow("""
+        SELECT v.id AS tfo_id, v.id_abitazione AS building_id
+        FROM verifiche_edifici v JOIN catasto_abitazioni c ON c.id = v.id_abitazione
+        WHERE c.predisposto_fibra = true
+        ORDER BY v.id LIMIT 1;
+    """)
+    print(f"Bbox ({origin}): {', '.join(f'{v:.5f}' for v in bbox)}, {len(buildings)} edifici campione")
+    return {
+        "bbox": bbox,
+        "building_ids": [row["id"] for row in buildings],
+        "building_id": ids["building_id"] if ids else None,
+        "tfo_id": ids["tfo_id"] if ids else None,
+    }
+
+
+def plan_cases(sample: dict) -> list:
+    """(nome, gruppi di indici attesi, serve un edificio predisposto con TFO, funzione che riceve la connessione)"""
+    west, south, east, north = sample["bbox"]
+    lon, lat = (west + east) / 2, (south + north) / 2
+    building_id, tfo_id, building_ids = sample["building_id"], sample["tfo_id"], sample["building_ids"]
+    page = dict(west=west, south=south, east=east, north=north, after_id=0, limit=settings.GEOJSON_PAGE_SIZE)
+    tile_x, tile_y = lonlat_to_tile(lon, lat, 15)
+    cluster_range, _ = snap_bbox_to_tiles(west, south, east, north, cell_zoom(11))
+    tfo = TfoCreate(id_abitazione=building_id or 0, scala="A", piano="1", interno="3", id_operatore="OP",
+                    id_tfo="TFO-PIANO", id_roe="ROE-PIANO", data_predisposizione_tfo=TODAY)
+    predisposizione = PredisposizioneCreate(id=building_id or 0, indirizzo="Via del Piano 1", comune="L'Aquila",
+                                            data_predisposizione=TODAY)
+    batch_items = PredisposizioneBatchCreate(items=[
+        PredisposizioneCreate(id=building, indirizzo="Via del Piano 1", comune="L'Aquila", data_predisposizione=TODAY)
+        for building in building_ids[:20]
+    ])
+    return [
+        ("data_version", (), False, lambda c: crud_data_version_async.get_data_version(c)),
+        ("geojson_bbox_z13 (centroidi)", ((CENTROIDE, CATASTO_PK),), False,
+         lambda c: crud_geojson_async.get_feature_collection_by_bbox(c, zoom=13, **page)),
+        ("geojson_bbox_z16 (semplificati)", ((GEOM, CATASTO_PK),), False,
+         lambda c: crud_geojson_async.get_feature_collection_by_bbox(c, zoom=16, **page)),
+        ("geojson_bbox_z18 (originali)", ((GEOM, CATASTO_PK),), False,
+         lambda c: crud_geojson_async.get_feature_collection_by_bbox(c, zoom=18, **page)),
+        ("geojson_bbox_fgb_z16", ((GEOM, CATASTO_PK),), False,
+         lambda c: crud_geojson_async.get_flatgeobuf_by_bbox(c, zoom=16, **page)),
+        ("tile_mvt_z15", ((GEOM,), (CENTROIDE,)), False,
+         lambda c: crud_tiles_async.get_tile(c, 15, tile_x, tile_y)),
+        ("clusters_z11", ((CLUSTER_PK,),), False,
+         lambda c: crud_clusters_async.get_clusters_by_tile_range(c, 11, *cluster_range)),
+        ("predisposizioni_list (prima pagina, conteggio)", ((PREDISPOSTI_ID,),), False,
+         lambda c: crud_predisposizione_async.list_predisposizioni(
+             c, limit=settings.PREDISPOSIZIONI_PAGE_SIZE, count_limit=settings.PREDISPOSIZIONI_COUNT_LIMIT)),
+        ("predisposizioni_list (per comune)", (("idx_predisposti_comune",),), False,
+         lambda c: crud_predisposizione_async.list_predisposizioni(c, sort="comune", limit=settings.PREDISPOSIZIONI_PAGE_SIZE)),
+        ("predisposizioni_list (per data, filtro)", (("idx_predisposti_data", PREDISPOSTI_ID),), False,
+         lambda c: crud_predisposizione_async.list_predisposizioni(
+             c, sort="data_predisposizione", order="desc", data_da=TODAY - datetime.timedelta(days=365),
+             limit=settings.PREDISPOSIZIONI_PAGE_SIZE)),
+        ("predisposizioni_list (ricerca)", (), False,
+         lambda c: crud_predisposizione_async.list_predisposizioni(c, q="via", limit=settings.PREDISPOSIZIONI_PAGE_SIZE)),
+        ("tfos_by_building", ((TFO_BY_BUILDING,),), True,
+         lambda c: crud_tfo_async.get_tfos_by_predisposizione_id(c, building_id)),
+        ("tfos_batch_ids", ((CATASTO_PK,), (TFO_BY_BUILDING,)), False,
+         lambda c: crud_tfo_async.get_tfos_by_buildings(c, ids=building_ids)),
+        ("tfos_batch_bbox", ((CENTROIDE, PREDISPOSTI_ID),), False,
+         lambda c: crud_tfo_async.get_tfos_by_buildings(c, bbox=sample["bbox"], max_buildings=settings.TFO_BATCH_MAX_BUILDINGS)),
+        ("tfo_create", ((CATASTO_PK,),), True, lambda c: crud_tfo_async.create_new_tfo(c, tfo)),
+        ("tfo_bulk", ((CATASTO_PK,),), True, lambda c: crud_tfo_async.create_tfos_bulk(c, [(0, tfo), (1, tfo)])),
+        ("tfo_update", ((TFO_PK,), (CATASTO_PK,)), True, lambda c: crud_tfo_async.update_existing_tfo(c, tfo_id, tfo)),
+        ("tfo_delete", ((TFO_PK,),), True, lambda c: crud_tfo_async.delete_tfo_by_id(c, tfo_id)),
+        ("predisposizione_upsert", ((CATASTO_PK,),), True,
+         lambda c: crud_predisposizione_async.create_or_update_predisposizione(c, predisposizione)),
+        ("predisposizione_delete", ((TFO_BY_BUILDING,), (CATASTO_PK,)), True,
+         lambda c: crud_predisposizione_async.delete_predisposizione_by_id(c, building_id)),
+        ("predisposizioni_batch_items", ((CATASTO_PK,),), False,
+         lambda c: crud_predisposizione_async.batch_create_or_update_predisposizioni(c, batch_items)),
+        ("predisposizioni_batch_delete (bbox)", ((CENTROIDE, PREDISPOSTI_ID),), False,
+         lambda c: crud_predisposizione_async.batch_delete_predisposizioni(c, BuildingSelection(bbox=list(sample["bbox"])))),
+    ]
+
+
+async def table_sizes(conn):
+    """(righe stimate per tabella, tabella di ogni indice) dello schema corrente."""
+    rows = await conn.fetch("""
+        SELECT c.relname, c.reltuples::bigint AS reltuples
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind IN ('r', 'p') AND n.nspname = current_schema();
+    """)
+    indexes = await conn.fetch("SELECT indexname, tablename FROM pg_indexes WHERE schemaname = current_schema();")
+    return {row["relname"]: row["reltuples"] for row in rows}, {row["indexname"]: row["tablename"] for row in indexes}
+
+
+def check_case(index_groups, statements: list, sizes: dict, index_tables: dict, large_rows: int) -> list:
+    """Regressioni di un caso rispetto alle regole fisse (scansioni sequenziali e indici attesi)."""
+    problems = []
+    for position, statement in enumerate(statements):
+        for table in statement["seq_scans"]:
+            if sizes.get(table, 0) >= large_rows:
+                problems.append(f"statement {position + 1}: Seq Scan su {table} ({sizes[table]} righe stimate)")
+    used = {index for statement in statements for index in statement["indexes"]}
+    for group in index_groups:
+        existing = [index for index in group if index in index_tables]
+        if not existing:
+            problems.append(f"indice mancante nel database: {' | '.join(group)}")
+            continue
+        if all(sizes.get(index_tables[index], 0) < large_rows for index in existing):
+            continue # Tabella piccola: il planner può preferire la scansione sequenziale
+        if not used.intersection(group):
+            problems.append(f"indice non usato: {' | '.join(group)}")
+    return problems
+
+
+def compare_case(name: str, statements: list, previous: dict, cost_ratio: float, min_cost: float) -> list:
+    """Regressioni di un caso rispetto alla stessa esecuzione salvata con --compare."""
+    before = previous.get(name)
+    if before is None:
+        return []
+    problems = []
+    if len(before["statements"]) != len(statements):
+        print(f"       nota: statement {len(before['statements'])} -> {len(statements)}, confronto per posizione")
+    for position, (old, new) in enumerate(zip(before["statements"], statements)):
+        if new["cost"] > max(old["cost"] * cost_ratio, min_cost):
+            problems.append(f"statement {position + 1}: costo {old['cost']:.0f} -> {new['cost']:.0f}")
+        lost = set(old["indexes"]) - set(new["indexes"])
+        if lost:
+            problems.append(f"statement {position + 1}: indici non più usati: {', '.join(sorted(lost))}")
+    return problems
+
+
+async def connect_or_none():
+    """Connessione al database di .env, None (con il motivo stampato) se non è raggiungibile."""
+    try:
+        return await asyncpg.connect(timeout=CONNECT_TIMEOUT, **_connect_kwargs())
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        config = settings.DB_CONFIG_PSYCOPG2
+        print(f"Database {config['database']} su {config['host']}:{config['port']} non raggiungibile: {e}")
+        return None
+
+
+async def run_checks(args) -> dict:
+    conn = await connect_or_none()
+    if conn is None:
+        return None
+    try:
+        await schema_registry.warm_async(conn, ["catasto_abitazioni"])
+        sizes, index_tables = await table_sizes(conn)
+        sample = await sample_inputs(conn, args.span)
+        previous = {}
+        if args.compare:
+            with open(args.compare, "rb") as f:
+                previous = {case["name"]: case for case in orjson.loads(f.read())["cases"]}
+        cases = []
+        failed = 0
+        for name, index_groups, needs_tfo, call in plan_cases(sample):
+            if args.cases and not any(pattern in name for pattern in args.cases):
+                continue
+            if needs_tfo and sample["tfo_id"] is None:
+                print(f"SKIP {name:48} nessun edificio predisposto con TFO nel database")
+                continue
+            explaining = ExplainingConnection(conn)
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                await call(explaining)
+                error = None
+            except HTTPException as e:
+                error = f"{e.status_code} {e.detail}"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            finally:
+                await transaction.rollback()
+            statements = [summarize_plan(query, explained) for query, explained in explaining.plans]
+            problems = [f"errore della funzione CRUD: {error}"] if error else []
+            problems += check_case(index_groups, statements, sizes, index_tables, args.large_rows)
+            problems += compare_case(name, statements, previous, args.cost_ratio, args.min_cost)
+            failed += bool(problems)
+            total_ms = sum(statement["execution_ms"] or 0 for statement in statements)
+            indexes = sorted({index for statement in statements for index in statement["indexes"]})
+            print(f"{'FAIL' if problems else 'OK  '} {name:48} {len(statements)} statement, costo "
+                  f"{sum(statement['cost'] for statement in statements):10.0f}, {total_ms:8.1f} ms, "
+                  f"indici: {', '.join(indexes) or '-'}")
+            for problem in problems:
+                print(f"       {problem}")
+            if problems and args.verbose:
+                for statement in statements:
+                    print(f"       {statement['query'][:140]}")
+                    for node in statement["nodes"]:
+                        print(f"         {node}")
+            cases.append({"name": name, "problems": problems, "statements": statements})
+    finally:
+        await conn.close()
+    meta = {
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"), "git_commit": git_commit(),
+        "table_rows": sizes, "bbox": sample["bbox"], "large_rows": args.large_rows,
+    }
+    return {"meta": meta, "failed": failed, "cases": cases}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Piani di esecuzione delle query CRUD e regressioni.")
+    parser.add_argument("--compare", help="Piani salvati da un'esecuzione precedente (stesso database)")
+    parser.add_argument("--output", help=f"File JSON dei piani (default: {DEFAULT_OUTPUT_DIR}/plans_<data>.json)")
+    parser.add_argument("--large-rows", type=int, default=10000, help="Righe stimate oltre cui una Seq Scan è una regressione")
+    parser.add_argument("--cost-ratio", type=float, default=2.0, help="Aumento del costo stimato segnalato rispetto a --compare")
+    parser.add_argument("--min-cost", type=float, default=100.0, help="Costo sotto cui gli aumenti non sono segnalati")
+    parser.add_argument("--span", type=float, default=0.01, help="Lato in gradi del bbox, se manca la tabella dei cluster")
+    parser.add_argument("--cases", nargs="+", help="Esegue solo i casi il cui nome contiene uno di questi testi")
+    parser.add_argument("--verbose", action="store_true", help="Stampa query e nodi dei piani dei casi falliti")
+    parser.add_argument("--require-database", action="store_true",
+                        help="Esce con codice 1 invece di saltare il controllo se il database non è raggiungibile")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = asyncio.run(run_checks(args))
+    if result is None:
+        if args.require_database:
+            print("Controllo fallito: database non raggiungibile (--require-database).")
+            sys.exit(1)
+        print("Controllo saltato: nessun database raggiungibile, nessun piano verificato.")
+        sys.exit(0)
+    output = args.output or os.path.join(
+        DEFAULT_OUTPUT_DIR, f"plans_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "wb") as f:
+        f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+    print(f"\n✓ Piani salvati in {output}")
+    print("Controllo superato." if not result["failed"] else f"Controllo fallito: {result['failed']} casi con regressioni.")
+    sys.exit(1 if result["failed"] else 0)
@@ -0,0 +1,212 @@
+"""
+Controllo del numero di statement (round trip verso il database) eseguiti dagli endpoint
+di scrittura, perché un check di esistenza o una rilettura aggiunti in seguito non
+raddoppino di nuovo la latenza delle scritture dall'app sul campo.
+
+Ogni caso chiama l'endpoint con TestClient e conta gli statement inviati sulla connessione,
+compresi BEGIN/COMMIT di una transazione esplicita; verifica anche lo stato HTTP (i casi
+404 devono costare quanto quelli riusciti). Due modalità:
+- predefinita, senza database: la dependency get_async_db_connection è sostituita da una
+  connessione che registra le chiamate asyncpg e restituisce la riga prevista dal caso;
+- --database: connessione reale al database configurato in .env, con il query logger di
+  asyncpg, dentro una transazione annullata a fine richiesta (nessuna modifica resta).
+  Servono almeno un edificio predisposto con una TFO.
+Esce con codice 1 se un endpoint supera il numero di statement previsto o cambia stato.
+
+Esecuzione dalla cartella backend/:
+    python scripts/check_write_statements.py
+    python scripts/check_write_statements.py --database
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.main import app
+from app.db.async_database import get_async_db_connection, _connect_kwargs
+
+MISSING_ID = -1 # ID inesistente per i casi 404
+
+TODAY = datetime.date(2024, 1, 15)
+TFO_ROW = {
+    "id": 1, "id_abitazione": 10, "scala": "A", "piano": "1", "interno": "3",
+    "id_operatore": "OP", "id_tfo": "TFO-1", "id_roe": "ROE-1", "data_predisposizione_tfo": TODAY,
+    "indirizzo": "Via Roma 1", "lat": 41.9, "lon": 12.5, "codice_catastale": "H501",
+}
+EXTENT = {"extent_xmin": 12.5, "extent_ymin": 41.9, "extent_xmax": 12.5001, "extent_ymax": 41.9001}
+PREDISPOSIZIONE_ROW = {
+    "id": 10, "indirizzo": "Via Roma 1", "lat": 41.9, "lon": 12.5, "uso_edificio": "Residenziale",
+    "comune": "Roma", "codice_belfiore": "H501", "codice_catastale": "H501", "data_predisposizione": TODAY,
+    "predisposto_fibra": True,
+}
+OLD_EXTENT = {f"old_{k}": v for k, v in EXTENT.items()}
+MISSING_TFO_UPDATE_ROW = {"tfo_trovata": False, **{k: None for k in TFO_ROW}}
+MISSING_BUILDING_UPDATE_ROW = {"tfo_trovata": True, **{k: None for k in TFO_ROW}, **OLD_EXTENT}
+
+
+def write_cases(building_id: int, tfo_id: int) -> list:
+    """(nome, metodo, percorso, corpo JSON, stato atteso, statement massimi, riga restituita dalla connessione fittizia)"""
+    tfo = {"id_abitazione": building_id, "scala": "A", "piano": "1", "interno": "3",
+           "id_operatore": "OP", "id_tfo": "TFO-1", "id_roe": "ROE-1", "data_predisposizione_tfo": TODAY.isoformat()}
+    predisposizione = {"id": building_id, "indirizzo": "Via Roma 1", "comune": "Roma", "lat": 41.9, "lon": 12.5,
+                       "data_predisposizione": TODAY.isoformat()}
+    return [
+        ("crea TFO", "POST", "/tfos", tfo, 201, 1, {**TFO_ROW, **EXTENT}),
+        ("crea TFO, edificio non predisposto", "POST", "/tfos", {**tfo, "id_abitazione": MISSING_ID}, 404, 1, None),
+        ("modifica TFO", "PUT", f"/tfos/{tfo_id}", tfo, 200, 1, {"tfo_trovata": True, **TFO_ROW, **EXTENT, **OLD_EXTENT}),
+        ("modifica TFO inesistente", "PUT", f"/tfos/{MISSING_ID}", tfo, 404, 1, MISSING_TFO_UPDATE_ROW),
+        ("modifica TFO, edificio inesistente", "PUT", f"/tfos/{tfo_id}", {**tfo, "id_abitazione": MISSING_ID}, 404, 1,
+         MISSING_BUILDING_UPDATE_ROW),
+        ("registra predisposizione", "POST", "/predisposizioni", predisposizione, 201, 1, {**PREDISPOSIZIONE_ROW, **EXTENT}),
+        ("registra predisposizione, edificio inesistente", "POST", "/predisposizioni",
+         {**predisposizione, "id": MISSING_ID}, 404, 1, None),
+        ("elimina TFO", "DELETE", f"/tfos/{tfo_id}", None, 200, 1, EXTENT),
+        ("elimina TFO inesistente", "DELETE", f"/tfos/{MISSING_ID}", None, 404, 1, None),
+        ("crea TFO multiple", "POST", "/tfos/bulk", [tfo, {**tfo, "id_abitazione": MISSING_ID}], 200, 1,
+         {"ord": 1, "id": tfo_id, "id_edificio": building_id, **EXTENT}),
+        ("elimina predisposizione", "DELETE", f"/predisposizioni/{building_id}", None, 200, 1,
+         {"id": building_id, "tfos_deleted": 1, **EXTENT}),
+        ("elimina predisposizione inesistente", "DELETE", f"/predisposizioni/{MISSING_ID}", None, 404, 1, None),
+        ("predisposizione multipla", "POST", "/predisposizioni/batch", {"items": [predisposizione]}, 200, 1,
+         {"id": building_id, **EXTENT}),
+        ("predisposizione multipla per ID", "POST", "/predisposizioni/batch",
+         {"selection": {"ids": [building_id, MISSING_ID]}, "values": {"comune": "Roma", "data_predisposizione": TODAY.isoformat()}},
+         200, 1, {"id": building_id, **EXTENT}),
+        ("elimina predisposizioni multiple", "POST", "/predisposizioni/batch/delete", {"ids": [building_id, MISSING_ID]}, 200, 1,
+         {"id": building_id, "tfos_deleted": 1, **EXTENT}),
+    ]
+
+
+class _RecordingTransaction:
+    def __init__(self, statements: list):
+        self.statements = statements
+
+    async def __aenter__(self):
+        self.statements.append("BEGIN")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.statements.append("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class RecordingConnection:
+    """Connessione fittizia: registra gli statement e restituisce la riga prevista dal caso."""
+
+    def __init__(self, row):
+        self.row = row
+        self.statements = []
+
+    def transaction(self):
+        return _RecordingTransaction(self.statements)
+
+    async def fetchrow(self, query, *args):
+        self.statements.append(query)
+        return self.row
+
+    async def fetch(self, query, *args):
+        self.statements.append(query)
+        return [self.row] if self.row is not None else []
+
+    async def fetchval(self, query, *args):
+        self.statements.append(query)
+        return next(iter(self.row.values())) if self.row else None
+
+    async def execute(self, query, *args):
+        self.statements.append(query)
+        return "DELETE 1" if query.lstrip().upper().startswith("DELETE") else "UPDATE 1"
+
+
+def run_case(client: TestClient, case, statements: list):
+    name, method, path, body, expected_status, budget, _ = case
+    statements.clear()
+    response = client.request(method, path, json=body)
+    ok = response.status_code == expected_status and len(statements) <= budget
+    print(f"{'OK  ' if ok else 'FAIL'} {method:6} {path:30} {name:48} stato {response.status_code} "
+          f"(atteso {expected_status}), statement {len(statements)} (massimo {budget})")
+    if not ok:
+        for query in statements:
+            print(f"       {' '.join(query.split())[:140]}")
+    return ok
+
+
+def check_offline() -> bool:
+    ok = True
+    client = TestClient(app)
+    for case in write_cases(building_id=10, tfo_id=1):
+        conn = RecordingConnection(case[-1])
+
+        async def recording_connection():
+            yield conn
+
+        app.dependency_overrides[get_async_db_connection] = recording_connection
+        ok &= run_case(client, case, conn.statements)
+    app.dependency_overrides.clear()
+    return ok
+
+
+async def sample_ids():
+    import asyncpg
+    conn = await asyncpg.connect(**_connect_kwargs())
+    try:
+        return await conn.fetchrow("""
+            SELECT v.id AS tfo_id, v.id_abitazione AS building_id
+            FROM verifiche_edifici v JOIN catasto_abitazioni c ON c.id = v.id_abitazione
+            WHERE c.predisposto_fibra = true
+            ORDER BY v.id LIMIT 1;
+        """)
+    finally:
+        await conn.close()
+
+
+def check_database() -> bool:
+    import asyncpg
+    ids = asyncio.run(sample_ids())
+    if ids is None:
+        print("Nessun edificio predisposto con TFO nel database: impossibile eseguire i casi.")
+        return False
+    statements = []
+
+    def log_query(record):
+        statements.append(record.query)
+
+    async def logged_connection():
+        conn = await asyncpg.connect(**_connect_kwargs())
+        transaction = conn.transaction()
+        await transaction.start()
+        conn.add_query_logger(log_query)
+        try:
+            yield conn
+        finally:
+            # Il ROLLBACK finale non fa parte della richiesta: il logger è rimosso prima
+            conn.remove_query_logger(log_query)
+            await transaction.rollback()
+            await conn.close()
+
+    app.dependency_overrides[get_async_db_connection] = logged_connection
+    try:
+        client = TestClient(app)
+        ok = True
+        for case in write_cases(building_id=ids["building_id"], tfo_id=ids["tfo_id"]):
+            ok &= run_case(client, case, statements)
+        return ok
+    finally:
+        app.dependency_overrides.clear()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Statement eseguiti dagli endpoint di scrittura.")
+    parser.add_argument("--database", action="store_true", help="Usa il database configurato in .env (modifiche annullate)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    passed = check_database() if args.database else check_offline()
+    print("Controllo superato." if passed else "Controllo fallito: numero di statement o stato diverso dal previsto.")
+    sys.exit(0 if passed else 1)
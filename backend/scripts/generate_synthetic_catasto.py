@@ -0,0 +1,210 @@
+"""
+Generatore di un catasto sintetico in GeoJSON, con lo schema letto da load_initial_data.py:
+FeatureCollection di MULTIPOLYGON Z in EPSG:4326 con le proprietà OBJECTID, edifc_*,
+classid, scril, meta_ist, shape_Length e shape_Area.
+
+Gli edifici sono raggruppati in centri abitati di dimensione variabile (pochi centri
+grandi, molti piccoli), con una densità al centro di --density edifici per km² che cala
+verso la periferia. Le sagome sono rettangoli o a L di 6-40 m orientati secondo la maglia
+stradale del centro, con vertici intermedi sui lati come nei rilievi reali; la quota Z è
+quella del terreno del centro abitato. Alcuni valori riproducono le anomalie dei dati reali
+gestite dal loader (edifc_at = -9999.0, classid vuoto).
+
+Il file è scritto in streaming (memoria costante anche a milioni di edifici) e a parità
+di --seed il risultato è identico, quindi le misure sono ripetibili. Con --files N gli
+edifici sono divisi in N file nella cartella indicata, da caricare con --workers.
+
+Esecuzione dalla cartella backend/:
+    python scripts/generate_synthetic_catasto.py --buildings 100000 --output data/sintetico_100k.geojson
+    python scripts/generate_synthetic_catasto.py --buildings 5000000 --files 8 --output data/sintetico_5m/
+"""
+
+import argparse
+import math
+import os
+import random
+import time
+
+import orjson
+
+METERS_PER_DEGREE = 111320.0
+
+# Valori ricorrenti dei campi del DBT regionale, con i loro pesi
+EDIFC_USO = (("01", 60), ("02", 8), ("03", 6), ("04", 5), ("05", 4), ("06", 6), ("07", 3), ("08", 2), ("95", 6))
+EDIFC_TY = (("01", 70), ("02", 15), ("03", 10), ("04", 5))
+EDIFC_STAT = (("01", 85), ("02", 8), ("03", 5), ("04", 2))
+EDIFC_MON = (("01", 3), ("02", 97))
+NOMI = ("Chiesa di San Pietro", "Scuola elementare", "Municipio", "Palazzo ducale", "Stazione", "Ufficio postale")
+
+
+def weighted_choices(values):
+    codes, weights = zip(*values)
+    return codes, weights
+
+
+class Town:
+    def __init__(self, rng, lon, lat, buildings, density, elevation):
+        self.lon, self.lat = lon, lat
+        self.buildings = buildings
+        # Raggio del centro abitato: la densità indicata vale nel nucleo, la periferia è più rada
+        area_km2 = buildings / density
+        self.radius_m = math.sqrt(area_km2 / math.pi) * 1000.0
+        self.street_angle = rng.uniform(0, math.pi / 2)
+        self.elevation = elevation
+
+
+def make_towns(rng, total, towns, density, center_lon, center_lat):
+    """Centri abitati con dimensioni di tipo Pareto, disposti senza sovrapposizioni rilevanti."""
+    weights = [1.0 / (rank ** 1.1) for rank in range(1, towns + 1)]
+    scale = total / sum(weights)
+    sizes = [max(1, int(w * scale)) for w in weights]
+    sizes[0] += total - sum(sizes) # Il resto al centro più grande
+    total_area_km2 = sum(sizes) / density
+    # Regione circa 20 volte più estesa dell'area urbanizzata, come in un territorio montano
+    half_side_m = math.sqrt(total_area_km2 * 20) * 1000.0 / 2
+    cos_lat = math.cos(math.radians(center_lat))
+    result = []
+    for size in sizes:
+        dx, dy = rng.uniform(-half_side_m, half_side_m), rng.uniform(-half_side_m, half_side_m)
+        lon = center_lon + dx / (METERS_PER_DEGREE * cos_lat)
+        lat = center_lat + dy / METERS_PER_DEGREE
+        result.append(Town(rng, lon, lat, size, density, elevation=rng.uniform(550, 1100)))
+    return result
+
+
+def footprint(rng, width, depth, l_shape):
+    """Anello della sagoma in metri (x, y) attorno all'origine, in senso antiorario."""
+    w, d = width / 2, depth / 2
+    if not l_shape:
+        return [(-w, -d), (w, -d), (w, d), (-w, d)]
+    cut_w, cut_d = width * rng.uniform(0.3, 0.6), depth * rng.uniform(0.3, 0.6)
+    return [(-w, -d), (w, -d), (w, d - cut_d), (w - cut_w, d - cut_d), (w - cut_w, d), (-w, d)]
+
+
+def densify(ring, extra_vertices):
+    """Aggiunge vertici intermedi su ogni lato (i rilievi reali hanno sagome più dettagliate)."""
+    if extra_vertices <= 0:
+        return ring
+    result = []
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        result.append((x0, y0))
+        for k in range(1, extra_vertices + 1):
+            t = k / (extra_vertices + 1)
+            result.append((x0 + (x1 - x0) * t, y0 + (y1 - y0) * t))
+    return result
+
+
+def ring_metrics(ring):
+    perimeter = sum(math.dist(a, b) for a, b in zip(ring, ring[1:] + ring[:1]))
+    area = abs(sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))) / 2
+    return perimeter, area
+
+
+def make_feature(rng, town, objectid, extra_vertices, precision, codes):
+    uso_codes, uso_w, ty_codes, ty_w, stat_codes, stat_w, mon_codes, mon_w = codes
+    # Distanza dal centro con distribuzione normale: nucleo denso, periferia rada
+    distance = abs(rng.gauss(0, town.radius_m / 1.5))
+    bearing = rng.uniform(0, 2 * math.pi)
+    cx, cy = distance * math.cos(bearing), distance * math.sin(bearing)
+
+    width, depth = rng.uniform(6, 40), rng.uniform(6, 25)
+    ring = footprint(rng, width, depth, l_shape=rng.random() < 0.25)
+    perimeter, area = ring_metrics(ring)
+    ring = densify(ring, rng.randint(0, extra_vertices))
+
+    angle = town.street_angle + rng.gauss(0, 0.08)
+    cos_a, sin_a = math.cos(angle), math.sin(angle)
+    lat0 = town.lat + cy / METERS_PER_DEGREE
+    meters_per_lon = METERS_PER_DEGREE * math.cos(math.radians(lat0))
+    lon0 = town.lon + cx / meters_per_lon
+    z = round(town.elevation + rng.uniform(-15, 15), 2)
+    coords = [
+        [round(lon0 + (x * cos_a - y * sin_a) / meters_per_lon, precision),
+         round(lat0 + (x * sin_a + y * cos_a) / METERS_PER_DEGREE, precision), z]
+        for x, y in ring
+    ]
+    coords.append(coords[0])
+
+    height = round(rng.uniform(3, 25), 1) if rng.random() > 0.05 else -9999.0
+    properties = {
+        "OBJECTID": objectid,
+        "edifc_uso": rng.choices(uso_codes, uso_w)[0],
+        "edifc_ty": rng.choices(ty_codes, ty_w)[0],
+        "edifc_sot": "01" if rng.random() < 0.9 else "02",
+        "classid": "" if rng.random() < 0.1 else None,
+        "edifc_nome": rng.choice(NOMI) if rng.random() < 0.01 else None,
+        "edifc_stat": rng.choices(stat_codes, stat_w)[0],
+        "edifc_at": height,
+        "scril": "01",
+        "meta_ist": "01",
+        "edifc_mon": rng.choices(mon_codes, mon_w)[0],
+        "shape_Length": round(perimeter, 6),
+        "shape_Area": round(area, 6),
+    }
+    return {"type": "Feature", "properties": properties,
+            "geometry": {"type": "MultiPolygon", "coordinates": [[coords]]}}
+
+
+def output_paths(output, files):
+    if files <= 1:
+        return [output]
+    os.makedirs(output, exist_ok=True)
+    return [os.path.join(output, f"catasto_{index + 1:03d}.geojson") for index in range(files)]
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    towns = make_towns(rng, args.buildings, args.towns or max(1, args.buildings // 20000),
+                       args.density, args.center[0], args.center[1])
+    codes = (*weighted_choices(EDIFC_USO), *weighted_choices(EDIFC_TY),
+             *weighted_choices(EDIFC_STAT), *weighted_choices(EDIFC_MON))
+    paths = output_paths(args.output, args.files)
+    per_file = math.ceil(args.buildings / len(paths))
+    header = (b'{"type": "FeatureCollection", "name": "catasto_sintetico", '
+              b'"crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}}, "features": [\n')
+
+    # Sequenza degli edifici: i centri abitati uno dopo l'altro, come negli export per comune
+    def buildings():
+        for town in towns:
+            for _ in range(town.buildings):
+                yield town
+
+    start = time.perf_counter()
+    sequence = buildings()
+    objectid = 0
+    for path in paths:
+        with open(path, "wb") as f:
+            f.write(header)
+            for index in range(per_file):
+                town = next(sequence, None)
+                if town is None:
+                    break
+                objectid += 1
+                if index:
+                    f.write(b",\n")
+                f.write(orjson.dumps(make_feature(rng, town, objectid, args.extra_vertices, args.precision, codes)))
+                if objectid % 100000 == 0:
+                    print(f"   … {objectid} edifici ({objectid / (time.perf_counter() - start):.0f}/s)", flush=True)
+            f.write(b"\n]}\n")
+        print(f"✓ {path}: {os.path.getsize(path) / 1024 ** 2:.1f} MB")
+    print(f"✅ {objectid} edifici in {len(towns)} centri abitati, {len(paths)} file, {time.perf_counter() - start:.1f}s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Genera un catasto sintetico GeoJSON per load_initial_data.py.")
+    parser.add_argument("--buildings", type=int, default=10000, help="Numero di edifici (da 10.000 a 5.000.000)")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), "..", "data", "sintetico.geojson"),
+                        help="File di uscita, o cartella con --files > 1")
+    parser.add_argument("--files", type=int, default=1, help="Divide gli edifici in N file (caricamento con --workers)")
+    parser.add_argument("--density", type=float, default=1500.0, help="Edifici per km² nel nucleo dei centri abitati")
+    parser.add_argument("--towns", type=int, default=None, help="Numero di centri abitati (default: uno ogni 20.000 edifici)")
+    parser.add_argument("--center", type=float, nargs=2, default=(13.3995, 42.3498), metavar=("LON", "LAT"),
+                        help="Centro della regione generata (default: L'Aquila)")
+    parser.add_argument("--extra-vertices", type=int, default=3, help="Vertici intermedi massimi per lato delle sagome")
+    parser.add_argument("--precision", type=int, default=8, help="Cifre decimali delle coordinate")
+    parser.add_argument("--seed", type=int, default=42, help="Seme del generatore casuale (stesso seme = stesso file)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    generate(parse_args())
@@ -1,15 +1,35 @@
 """
 Script per caricare file GeoJSON del catasto in PostgreSQL/PostGIS
-(drop & recreate table ad ogni esecuzione)
+(sostituzione completa delle tabelle in un'unica transazione finale, oppure
+caricamento incrementale per objectid con --sync)
+
+Uso (dalla cartella backend/):
+    python scripts/load_initial_data.py                                # data/aquila.geojson
+    python scripts/load_initial_data.py data/comuni/ --workers 4       # tutti i *.geojson della cartella
+    python scripts/load_initial_data.py regione.geojson --workers 4 --shards 4
+    python scripts/load_initial_data.py data/comuni/ --sync            # incrementale, senza drop
 """
 
+import argparse
+import hashlib
+import io
 import json
+import re
+import time
 import psycopg2
-from psycopg2.extras import execute_values
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
+# Permette di importare il package app (livelli di dettaglio, costanti condivise) da backend/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.core.lod import PRECOMPUTED_LOD_LEVELS, simplified_geometry_expression
+from app.core.predisposizioni_listing import predisposizioni_index_statements
+from app.core.clusters import CLUSTER_TABLE, cluster_table_sql, cluster_delta_insert_sql, cluster_fold_sql, cluster_rebuild_sql
+from app.core.data_version import data_version_table_sql, data_version_bump_sql, data_version_trigger_function_sql
+from app.db.schema import SCHEMA_CHANGED_CHANNEL
+
 # Carica variabili da .env
 # Assumendo che .env sia nella root della cartella 'backend'
 dotenv_path = os.path.join(os.path.dirname(__file__), "..", ".env")
@@ -53,15 +73,11 @@ def create_table_if_not_exists(cursor):
         codice_catastale TEXT,
         data_predisposizione DATE,
         lat NUMERIC,
-        lon NUMERIC
+        lon NUMERIC,
+        content_hash TEXT, -- Hash di proprietà e geometria del catasto, confrontato dal caricamento incrementale
+        retired_at TIMESTAMP -- Edificio non più presente nel catasto ma conservato per predisposizione/TFO
     );
     """
-    create_index_sql = """
-    CREATE INDEX IF NOT EXISTS idx_catasto_abitazioni_geom
-      ON catasto_abitazioni USING GIST (geometry);
-    CREATE INDEX IF NOT EXISTS idx_catasto_abitazioni_centroide
-      ON catasto_abitazioni USING GIST (centroide);
-    """
     # La tabella verifiche_edifici ora si chiamerà tfo (Terminazioni Fibra Ottica)
     # o un nome più generico se serve per altre verifiche.
     # Manteniamo 'verifiche_edifici' per coerenza con il codice originale.
@@ -79,198 +95,770 @@ def create_table_if_not_exists(cursor):
     );
     """
     cursor.execute(create_table_sql)
-    cursor.execute(create_index_sql)
     cursor.execute(create_verifica_sql)
-    print("✓ Tabelle create/verificate con indici")
+    # Le TFO sono sempre lette per edificio (liste, GET /tfos/batch, trigger, ON DELETE CASCADE)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_verifiche_edifici_id_abitazione ON verifiche_edifici (id_abitazione);")
+    # Colonne aggiunte dopo la prima versione: presenti anche su tabelle create in passato
+    cursor.execute("ALTER TABLE catasto_abitazioni ADD COLUMN IF NOT EXISTS content_hash TEXT;")
+    cursor.execute("ALTER TABLE catasto_abitazioni ADD COLUMN IF NOT EXISTS retired_at TIMESTAMP;")
+    # Colonne con le geometrie semplificate per fascia di zoom (vedi app/core/lod.py)
+    for level in PRECOMPUTED_LOD_LEVELS:
+        cursor.execute(
+            f"ALTER TABLE catasto_abitazioni ADD COLUMN IF NOT EXISTS {level.precomputed_column} GEOMETRY(MULTIPOLYGON, 4326);"
+        )
+    print("✓ Tabelle create/verificate (indici creati dopo il caricamento)")
+
+
+def update_lod_geometries(cursor, ids=None):
+    """
+    Precalcola le geometrie semplificate usate da /geojson/bbox alle varie fasce di zoom,
+    per tutta la tabella o solo per gli edifici in `ids` (caricamento incrementale).
+    """
+    where_sql = "" if ids is None else " WHERE id = ANY(%s)"
+    params = None if ids is None else (list(ids),)
+    for level in PRECOMPUTED_LOD_LEVELS:
+        cursor.execute(
+            f"UPDATE catasto_abitazioni SET {level.precomputed_column} = {simplified_geometry_expression(level)}{where_sql};",
+            params
+        )
+        print(f"✓ Geometrie semplificate '{level.precomputed_column}' calcolate ({cursor.rowcount} righe).")
 
 
 def create_trigger_predisposto_fibra(cursor):
-    # Questo trigger non è più necessario se predisposto_fibra viene gestito dall'applicazione
-    # quando si crea/aggiorna una "predisposizione" tramite l'API.
-    # Il campo predisposto_fibra in catasto_abitazioni viene aggiornato direttamente dall'API /predisposizioni
-    # Tuttavia, se si vuole un fallback a livello DB quando una TFO viene inserita direttamente
-    # (bypassando la logica di creazione "predisposizione" dell'edificio), potrebbe ancora servire.
-    # Per ora, lo commentiamo assumendo che la logica applicativa gestisca lo stato predisposto_fibra.
-    
-    # Controlla se la funzione esiste già
+    # Il campo predisposto_fibra in catasto_abitazioni viene aggiornato direttamente dall'API /predisposizioni.
+    # Il trigger resta attivo come fallback a livello DB quando una TFO viene inserita direttamente
+    # (bypassando la logica di creazione "predisposizione" dell'edificio).
+
+    # Trigger a livello di istruzione con tabella di transizione: un inserimento multiplo
+    # di TFO (POST /tfos/bulk) esegue un solo UPDATE per tutti gli edifici coinvolti,
+    # invece di uno per ogni riga inserita. Il vecchio trigger FOR EACH ROW viene
+    # rimosso prima di sostituire la funzione, così anche i database esistenti si aggiornano.
+    cursor.execute("DROP TRIGGER IF EXISTS trg_aggiorna_predisposto_fibra_on_tfo_insert ON verifiche_edifici;")
     cursor.execute("""
-        SELECT EXISTS (
-            SELECT 1
-            FROM pg_proc
-            WHERE proname = 'aggiorna_predisposto_fibra_da_tfo'
-        );
+    CREATE OR REPLACE FUNCTION aggiorna_predisposto_fibra_da_tfo()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      -- Solo se l'edificio non è già predisposto, lo segna come tale.
+      -- Questo evita di sovrascrivere una data_predisposizione già impostata
+      -- manualmente tramite l'interfaccia principale di predisposizione.
+      -- L'idea è che l'inserimento di una TFO implica che l'edificio è, di fatto, predisposto.
+      UPDATE catasto_abitazioni c
+      SET 
+        predisposto_fibra = TRUE
+        -- Non aggiorniamo altri campi (indirizzo, data_predisposizione etc.) qui,
+        -- quelli sono gestiti dal form di predisposizione principale.
+      FROM (
+        SELECT DISTINCT id_abitazione FROM nuove_tfo
+        WHERE id_tfo IS NOT NULL -- Solo le righe con un codice TFO
+      ) n
+      WHERE c.id = n.id_abitazione AND (c.predisposto_fibra IS NULL OR c.predisposto_fibra = FALSE);
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
     """)
-    func_exists = cursor.fetchone()[0]
-
-    if not func_exists:
-        cursor.execute("""
-        CREATE OR REPLACE FUNCTION aggiorna_predisposto_fibra_da_tfo()
-        RETURNS TRIGGER AS $$
-        BEGIN
-          -- Solo se l'edificio non è già predisposto, lo segna come tale.
-          -- Questo evita di sovrascrivere una data_predisposizione già impostata
-          -- manualmente tramite l'interfaccia principale di predisposizione.
-          -- L'idea è che l'inserimento di una TFO implica che l'edificio è, di fatto, predisposto.
-          UPDATE catasto_abitazioni
-          SET 
-            predisposto_fibra = TRUE
-            -- Non aggiorniamo altri campi (indirizzo, data_predisposizione etc.) qui,
-            -- quelli sono gestiti dal form di predisposizione principale.
-          WHERE id = NEW.id_abitazione AND (predisposto_fibra IS NULL OR predisposto_fibra = FALSE);
-          RETURN NEW;
-        END;
-        $$ LANGUAGE plpgsql;
-        """)
-        print("✓ Funzione Trigger aggiorna_predisposto_fibra_da_tfo creata/verificata.")
-    else:
-        print("✓ Funzione Trigger aggiorna_predisposizone_fibra_da_tfo già esistente.")
+    print("✓ Funzione Trigger aggiorna_predisposto_fibra_da_tfo creata/verificata.")
 
-    # Controlla se il trigger esiste già
     cursor.execute("""
-        SELECT EXISTS (
-            SELECT 1
-            FROM pg_trigger
-            WHERE tgname = 'trg_aggiorna_predisposto_fibra_on_tfo_insert'
-        );
+    CREATE TRIGGER trg_aggiorna_predisposto_fibra_on_tfo_insert
+    AFTER INSERT ON verifiche_edifici
+    REFERENCING NEW TABLE AS nuove_tfo
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION aggiorna_predisposto_fibra_da_tfo();
     """)
-    trigger_exists = cursor.fetchone()[0]
-    
-    if not trigger_exists:
-        cursor.execute("""
-        CREATE TRIGGER trg_aggiorna_predisposto_fibra_on_tfo_insert
-        AFTER INSERT ON verifiche_edifici
-        FOR EACH ROW
-        WHEN (NEW.id_tfo IS NOT NULL) -- Si attiva solo se viene inserito un codice TFO
-        EXECUTE FUNCTION aggiorna_predisposto_fibra_da_tfo();
+    print("✓ Trigger trg_aggiorna_predisposto_fibra_on_tfo_insert creato/verificato.")
+
+
+# Delta delle righe scritte per gli aggregati a cluster: colonne centroide, buildings, predisposti, tfos.
+# Contano solo gli edifici attivi (retired_at IS NULL) e le TFO con codice (id_tfo IS NOT NULL),
+# come GET /clusters e la lista delle TFO.
+_BUILDING_CHANGED = """(
+    (ST_X(o.centroide), ST_Y(o.centroide)) IS DISTINCT FROM (ST_X(n.centroide), ST_Y(n.centroide))
+    OR o.predisposto_fibra IS DISTINCT FROM n.predisposto_fibra
+    OR o.retired_at IS DISTINCT FROM n.retired_at
+)"""
+_BUILDING_TFOS = "(SELECT count(*) FROM verifiche_edifici v WHERE v.id_abitazione = {alias}.id AND v.id_tfo IS NOT NULL)::int"
+CLUSTER_DELTA_CATASTO = {
+    "INSERT": """
+        SELECT n.centroide, 1 AS buildings, (n.predisposto_fibra IS TRUE)::int AS predisposti, 0 AS tfos
+        FROM nuovi n WHERE n.retired_at IS NULL
+    """,
+    # Le TFO di un edificio eliminato sono rimosse in cascata quando l'edificio non esiste già più:
+    # il caricamento incrementale elimina solo edifici senza TFO, negli altri casi ricalcola_cluster_celle()
+    "DELETE": """
+        SELECT o.centroide, -1 AS buildings, -(o.predisposto_fibra IS TRUE)::int AS predisposti, 0 AS tfos
+        FROM vecchi o WHERE o.retired_at IS NULL
+    """,
+    # Solo le righe in cui cambia qualcosa che conta: l'edificio esce dalla cella vecchia
+    # ed entra in quella nuova insieme alle sue TFO
+    "UPDATE": f"""
+        SELECT o.centroide, -1 AS buildings, -(o.predisposto_fibra IS TRUE)::int AS predisposti,
+               -{_BUILDING_TFOS.format(alias="o")} AS tfos
+        FROM vecchi o JOIN nuovi n ON n.id = o.id
+        WHERE o.retired_at IS NULL AND {_BUILDING_CHANGED}
+        UNION ALL
+        SELECT n.centroide, 1, (n.predisposto_fibra IS TRUE)::int, {_BUILDING_TFOS.format(alias="n")}
+        FROM vecchi o JOIN nuovi n ON n.id = o.id
+        WHERE n.retired_at IS NULL AND {_BUILDING_CHANGED}
+    """,
+}
+CLUSTER_DELTA_TFO = {
+    "INSERT": """
+        SELECT c.centroide, 0 AS buildings, 0 AS predisposti, 1 AS tfos
+        FROM nuovi n JOIN catasto_abitazioni c ON c.id = n.id_abitazione
+        WHERE n.id_tfo IS NOT NULL AND c.retired_at IS NULL
+    """,
+    "DELETE": """
+        SELECT c.centroide, 0 AS buildings, 0 AS predisposti, -1 AS tfos
+        FROM vecchi o JOIN catasto_abitazioni c ON c.id = o.id_abitazione
+        WHERE o.id_tfo IS NOT NULL AND c.retired_at IS NULL
+    """,
+    "UPDATE": """
+        SELECT c.centroide, 0 AS buildings, 0 AS predisposti, -1 AS tfos
+        FROM vecchi o JOIN nuovi n ON n.id = o.id JOIN catasto_abitazioni c ON c.id = o.id_abitazione
+        WHERE o.id_tfo IS NOT NULL AND c.retired_at IS NULL
+          AND (o.id_abitazione IS DISTINCT FROM n.id_abitazione OR n.id_tfo IS NULL)
+        UNION ALL
+        SELECT c.centroide, 0, 0, 1
+        FROM vecchi o JOIN nuovi n ON n.id = o.id JOIN catasto_abitazioni c ON c.id = n.id_abitazione
+        WHERE n.id_tfo IS NOT NULL AND c.retired_at IS NULL
+          AND (o.id_abitazione IS DISTINCT FROM n.id_abitazione OR o.id_tfo IS NULL)
+    """,
+}
+
+
+def _cluster_trigger_function_sql(function_name, deltas):
+    """Funzione trigger FOR EACH STATEMENT che accoda il delta dell'operazione (TG_OP) in catasto_cluster_delta."""
+    branches = "\n      ".join(
+        f"{'IF' if i == 0 else 'ELSIF'} TG_OP = '{op}' THEN{cluster_delta_insert_sql(delta_sql)}"
+        for i, (op, delta_sql) in enumerate(deltas.items())
+    )
+    return f"""
+    CREATE OR REPLACE FUNCTION {function_name}()
+    RETURNS TRIGGER AS $$
+    BEGIN
+      {branches}
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+
+
+def create_cluster_aggregates(cursor, rebuild=False):
+    """
+    Crea la tabella degli aggregati per GET /clusters (vedi app/core/clusters.py), la coda
+    dei delta e i trigger che vi accodano ogni scrittura su edifici e TFO. La ricostruisce
+    da zero se rebuild=True o se la tabella non esisteva.
+    """
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (CLUSTER_TABLE,))
+    table_exists = cursor.fetchone()[0]
+    cursor.execute(cluster_table_sql())
+    cursor.execute(cluster_fold_sql())
+    cursor.execute(cluster_rebuild_sql())
+    cursor.execute(_cluster_trigger_function_sql("aggiorna_cluster_da_catasto", CLUSTER_DELTA_CATASTO))
+    cursor.execute(_cluster_trigger_function_sql("aggiorna_cluster_da_tfo", CLUSTER_DELTA_TFO))
+    # Le tabelle di transizione richiedono un trigger per operazione
+    for table, function_name in (("catasto_abitazioni", "aggiorna_cluster_da_catasto"),
+                                 ("verifiche_edifici", "aggiorna_cluster_da_tfo")):
+        for op, referencing in (("INSERT", "NEW TABLE AS nuovi"),
+                                ("DELETE", "OLD TABLE AS vecchi"),
+                                ("UPDATE", "OLD TABLE AS vecchi NEW TABLE AS nuovi")):
+            trigger_name = f"trg_cluster_{table}_{op.lower()}"
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name} ON {table};")
+            cursor.execute(f"""
+            CREATE TRIGGER {trigger_name}
+            AFTER {op} ON {table}
+            REFERENCING {referencing}
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION {function_name}();
+            """)
+    print("✓ Trigger degli aggregati a cluster creati/verificati.")
+    if rebuild or not table_exists:
+        start = time.perf_counter()
+        cursor.execute("SELECT ricalcola_cluster_celle();")
+        cursor.execute(f"SELECT count(*) FROM {CLUSTER_TABLE};")
+        print(f"✓ Aggregati a cluster ricalcolati: {cursor.fetchone()[0]} celle in {time.perf_counter() - start:.1f}s")
+
+
+def create_data_version(cursor):
+    """
+    Crea il contatore della versione dei dati usato per ETag/304 (vedi app/core/data_version.py)
+    e i trigger che lo incrementano a ogni statement di scrittura su edifici e TFO.
+    Lo incrementa anche subito: il caricamento appena eseguito rende non valide le copie dei client.
+    """
+    cursor.execute(data_version_table_sql())
+    cursor.execute(data_version_trigger_function_sql())
+    for table in ("catasto_abitazioni", "verifiche_edifici"):
+        trigger_name = f"trg_versione_dati_{table}"
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name} ON {table};")
+        cursor.execute(f"""
+        CREATE TRIGGER {trigger_name}
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION incrementa_versione_dati();
         """)
-        print("✓ Trigger trg_aggiorna_predisposto_fibra_on_tfo_insert creato/verificato.")
-    else:
-        print("✓ Trigger trg_aggiorna_predisposto_fibra_on_tfo_insert già esistente.")
+    cursor.execute(data_version_bump_sql())
+    print("✓ Versione dei dati e relativi trigger creati/verificati.")
+
+
+def notify_schema_changed(cursor, table_name):
+    """
+    Avvisa il backend in esecuzione che la tabella è stata ricreata, così invalida
+    la cache delle colonne e gli statement preparati (vedi app/db/schema.py).
+    """
+    cursor.execute("SELECT pg_notify(%s, %s);", (SCHEMA_CHANGED_CHANNEL, table_name))
+
 
+# Caratteri letti dal file per volta e feature caricate per ogni COPY: la memoria usata
+# dal caricamento dipende da questi valori, non dalla dimensione del file
+READ_CHUNK_SIZE = 1024 * 1024
+LOAD_BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", "5000"))
 
-def load_geojson_file(file_path):
+_FEATURES_ARRAY_RE = re.compile(r'"features"\s*:\s*\[')
+_WHITESPACE_RE = re.compile(r'[\s,]*')
+
+
+def iter_geojson_features(file_path, read_size=READ_CHUNK_SIZE):
+    """
+    Legge un FeatureCollection in modo incrementale e restituisce le feature una alla volta,
+    senza caricare il file intero: il testo viene letto a blocchi e ogni elemento
+    dell'array 'features' viene decodificato non appena è completo.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        # Cerca l'inizio dell'array 'features' (le chiavi precedenti, es. 'crs', vengono saltate)
+        buffer = ""
+        while True:
+            chunk = f.read(read_size)
+            if not chunk:
+                raise ValueError("Array 'features' non trovato nel file GeoJSON")
+            buffer += chunk
+            match = _FEATURES_ARRAY_RE.search(buffer)
+            if match:
+                buffer = buffer[match.end():]
+                break
+            buffer = buffer[-64:] # Il marcatore può essere a cavallo di due blocchi
+
+        pos = 0
+        eof = False
+        while True:
+            pos = _WHITESPACE_RE.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                feature, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Feature incompleta: servono altri dati dal file
+                if eof:
+                    raise
+                chunk = f.read(read_size)
+                if not chunk:
+                    eof = True
+                # Scarta la parte già decodificata prima di accodare il nuovo blocco
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield feature
+            pos = end
+
+
+def batched(iterable, size):
+    """Raggruppa un iterabile in liste di al massimo `size` elementi."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def peak_rss_mb():
+    """Picco di memoria residente del processo in MB (None dove resource non esiste, es. Windows)."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print(f"❌ File non trovato: {file_path}")
-        sys.exit(1)
-    except json.JSONDecodeError as e:
-        print(f"❌ Errore nel parsing JSON: {e}")
-        sys.exit(1)
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KB, macOS byte
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# Colonne del catasto copiate nella tabella di staging, nell'ordine delle righe COPY
+STAGING_COLUMNS = (
+    "objectid", "edifc_uso", "edifc_ty", "edifc_sot", "classid",
+    "edifc_nome", "edifc_stat", "edifc_at", "scril", "meta_ist",
+    "edifc_mon", "shape_length", "shape_area", "geometry_geojson", "content_hash"
+)
 
-def insert_features(cursor, features):
-    data_to_insert = []
-    for feature_idx, feature in enumerate(features):
-        props = feature.get('properties', {})
-        geom = feature.get('geometry', {})
 
-        if not geom or 'type' not in geom or 'coordinates' not in geom or not geom['coordinates']:
-            print(f"⚠️ Feature {feature_idx} (OBJECTID: {props.get('OBJECTID', 'N/A')}) scartata: geometria mancante o invalida.")
+def create_staging_table(cursor):
+    """
+    Tabella temporanea (per sessione, senza WAL né indici) in cui COPY scrive le feature
+    così come sono: geometria ancora in GeoJSON testuale, conversione fatta poi in SQL.
+    """
+    cursor.execute("""
+    CREATE TEMP TABLE IF NOT EXISTS staging_catasto_abitazioni (
+        objectid INTEGER,
+        edifc_uso TEXT,
+        edifc_ty TEXT,
+        edifc_sot TEXT,
+        classid TEXT,
+        edifc_nome TEXT,
+        edifc_stat TEXT,
+        edifc_at NUMERIC,
+        scril TEXT,
+        meta_ist TEXT,
+        edifc_mon TEXT,
+        shape_length NUMERIC,
+        shape_area NUMERIC,
+        geometry_geojson TEXT,
+        content_hash TEXT
+    );
+    """)
+
+
+def create_indexes(cursor):
+    """Indici spaziali, creati dopo il caricamento: costruirli una volta costa meno che aggiornarli riga per riga."""
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_catasto_abitazioni_geom
+      ON catasto_abitazioni USING GIST (geometry);
+    CREATE INDEX IF NOT EXISTS idx_catasto_abitazioni_centroide
+      ON catasto_abitazioni USING GIST (centroide);
+    CREATE INDEX IF NOT EXISTS idx_catasto_abitazioni_objectid
+      ON catasto_abitazioni (objectid);
+    """)
+    create_predisposizioni_indexes(cursor)
+    cursor.execute("ANALYZE catasto_abitazioni;")
+    print("✓ Indici creati e statistiche aggiornate")
+
+
+def create_predisposizioni_indexes(cursor):
+    """Indici parziali e composti della lista paginata GET /predisposizioni (vedi app/core/predisposizioni_listing.py)."""
+    # pg_trgm serve solo alla ricerca su indirizzo: se non si può installare (permessi)
+    # la ricerca funziona comunque, senza indice
+    cursor.execute("SAVEPOINT pg_trgm;")
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        trigram = True
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT pg_trgm;")
+        print(f"⚠️ Estensione pg_trgm non disponibile, ricerca su indirizzo senza indice: {e}")
+        trigram = False
+    cursor.execute("RELEASE SAVEPOINT pg_trgm;")
+    for statement in predisposizioni_index_statements(trigram=trigram):
+        cursor.execute(statement)
+    print("✓ Indici della lista predisposizioni creati/verificati")
+
+
+def _copy_text_value(value):
+    """Valore nel formato testo di COPY: \\N per NULL, escape di backslash, tab e a capo."""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def feature_to_row(feature_idx, feature):
+    """Converte una feature nella tupla di STAGING_COLUMNS; None se la geometria manca o è invalida."""
+    props = feature.get('properties', {})
+    geom = feature.get('geometry', {})
+
+    if not geom or 'type' not in geom or 'coordinates' not in geom or not geom['coordinates']:
+        print(f"⚠️ Feature {feature_idx} (OBJECTID: {props.get('OBJECTID', 'N/A')}) scartata: geometria mancante o invalida.")
+        return None
+
+    classid = props.get('classid')
+    if classid and isinstance(classid, str) and not classid.strip(): # Gestisce stringa vuota
+        classid = None
+
+    # Gestione di edifc_at che potrebbe essere -9999.0
+    edifc_at_val = props.get('edifc_at')
+    if edifc_at_val == -9999.0:
+        edifc_at_val = None
+
+    row = (
+        props.get('OBJECTID'),
+        props.get('edifc_uso'),
+        props.get('edifc_ty'),
+        props.get('edifc_sot'),
+        classid,
+        props.get('edifc_nome'),
+        props.get('edifc_stat'),
+        edifc_at_val,
+        props.get('scril'),
+        props.get('meta_ist'),
+        props.get('edifc_mon'),
+        props.get('shape_Length'),
+        props.get('shape_Area'),
+        json.dumps(geom) # ST_GeomFromGeoJSON si aspetta una stringa GeoJSON
+    )
+    # L'hash del contenuto permette al caricamento incrementale di aggiornare solo gli edifici cambiati
+    content_hash = hashlib.md5(json.dumps(row, default=str).encode("utf-8")).hexdigest()
+    return row + (content_hash,)
+
+
+def copy_features_to_staging(cursor, features, start_idx=0):
+    """Scrive le feature valide nella tabella di staging con un solo COPY FROM STDIN. Restituisce quante."""
+    buffer = io.StringIO()
+    copied = 0
+    for feature_idx, feature in enumerate(features, start=start_idx):
+        row = feature_to_row(feature_idx, feature)
+        if row is None:
             continue
-        
-        geom_wkt = json.dumps(geom) # ST_GeomFromGeoJSON si aspetta una stringa GeoJSON
-
-        # Calcolo centroide
-        try:
-            cursor.execute(
-                "SELECT ST_AsText(ST_Centroid(ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326)))", # Assicura SRID
-                (geom_wkt,)
-            )
-            centroide_wkt = cursor.fetchone()[0]
-            if centroide_wkt is None: # Gestione di geometrie che potrebbero non avere un centroide calcolabile
-                 print(f"⚠️ Feature {feature_idx} (OBJECTID: {props.get('OBJECTID', 'N/A')}): centroide non calcolabile, impostato a NULL.")
-                 centroide_wkt = None # Esplicito None per ST_GeomFromText
-        except Exception as e:
-            print(f"⚠️ Errore calcolo centroide per feature {feature_idx} (OBJECTID: {props.get('OBJECTID', 'N/A')}): {e}. Centroide impostato a NULL.")
-            centroide_wkt = None
-
-
-        classid = props.get('classid')
-        if classid and isinstance(classid, str) and not classid.strip(): # Gestisce stringa vuota
-            classid = None
-        
-        # Gestione di edifc_at che potrebbe essere -9999.0
-        edifc_at_val = props.get('edifc_at')
-        if edifc_at_val == -9999.0:
-            edifc_at_val = None
-
-        data_row = (
-            props.get('OBJECTID'),
-            props.get('edifc_uso'),
-            props.get('edifc_ty'),
-            props.get('edifc_sot'),
-            classid,
-            props.get('edifc_nome'),
-            props.get('edifc_stat'),
-            edifc_at_val,
-            props.get('scril'),
-            props.get('meta_ist'),
-            props.get('edifc_mon'),
-            props.get('shape_Length'),
-            props.get('shape_Area'),
-            geom_wkt,
-            centroide_wkt,  # For the CASE WHEN check
-            centroide_wkt   # For the ST_GeomFromText function
-        )
-        data_to_insert.append(data_row)
+        buffer.write("\t".join(_copy_text_value(v) for v in row))
+        buffer.write("\n")
+        copied += 1
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY staging_catasto_abitazioni ({', '.join(STAGING_COLUMNS)}) FROM STDIN",
+        buffer
+    )
+    return copied
 
-    if not data_to_insert:
-        print("ℹ️ Nessun dato valido da inserire.")
-        return 0
 
-    insert_sql_template = """
+# Tabella (UNLOGGED, condivisa tra i worker) in cui il caricamento completo scrive le righe
+# già convertite; catasto_abitazioni viene sostituita solo alla fine, in un'unica transazione
+LOAD_TABLE = "catasto_abitazioni_caricamento"
+
+
+def create_load_table(cursor):
+    """
+    Ricrea la tabella di caricamento: stesse colonne del catasto ma senza id, indici né trigger.
+    Resta fuori dalla transazione di pubblicazione, così i worker la riempiono in parallelo
+    con connessioni proprie; se il caricamento fallisce catasto_abitazioni non viene toccata.
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {LOAD_TABLE};")
+    cursor.execute(f"""
+    CREATE UNLOGGED TABLE {LOAD_TABLE} (
+        objectid INTEGER,
+        edifc_uso TEXT,
+        edifc_ty TEXT,
+        edifc_sot TEXT,
+        classid TEXT,
+        edifc_nome TEXT,
+        edifc_stat TEXT,
+        edifc_at NUMERIC,
+        scril TEXT,
+        meta_ist TEXT,
+        edifc_mon TEXT,
+        shape_length NUMERIC,
+        shape_area NUMERIC,
+        geometry GEOMETRY(MULTIPOLYGONZ, 4326),
+        centroide GEOMETRY(POINT, 4326),
+        content_hash TEXT
+    );
+    """)
+
+
+def publish_load_table(cursor):
+    """
+    Copia le righe caricate dai worker in catasto_abitazioni (appena ricreata nella stessa
+    transazione) ed elimina la tabella di caricamento. Restituisce le righe copiate.
+    """
+    cursor.execute(f"""
     INSERT INTO catasto_abitazioni (
         objectid, edifc_uso, edifc_ty, edifc_sot, classid,
         edifc_nome, edifc_stat, edifc_at, scril, meta_ist,
-        edifc_mon, shape_length, shape_area, geometry, centroide
-    ) VALUES (
-        %s, %s, %s, %s, %s,
-        %s, %s, %s, %s, %s,
-        %s, %s, %s,
-        ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326),
-        CASE WHEN %s IS NOT NULL THEN ST_GeomFromText(%s, 4326) ELSE NULL END
+        edifc_mon, shape_length, shape_area, geometry, centroide, content_hash
     )
+    SELECT
+        objectid, edifc_uso, edifc_ty, edifc_sot, classid,
+        edifc_nome, edifc_stat, edifc_at, scril, meta_ist,
+        edifc_mon, shape_length, shape_area, geometry, centroide, content_hash
+    FROM {LOAD_TABLE};
+    """)
+    published = cursor.rowcount
+    cursor.execute(f"DROP TABLE {LOAD_TABLE};")
+    return published
+
+
+def drop_load_table(conn):
+    """Dopo un errore: elimina la tabella di caricamento rimasta, senza mascherare l'errore originale."""
+    try:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {LOAD_TABLE};")
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"⚠️ Tabella {LOAD_TABLE} non eliminata: {e}")
+
+
+def insert_from_staging(cursor):
     """
-    # Usare execute_batch per efficienza se psycopg2 è >= 2.7
-    # o un loop con execute per maggiore controllo/logging per riga in caso di problemi
-    
-    # execute_values è buono per multiple rows, ma il template complesso per ST_GeomFromGeoJSON e ST_Centroid
-    # rende più semplice un loop di execute per questo scenario specifico.
-    # Tuttavia, per mantenere la struttura originale:
-    
-    # Il template per execute_values deve essere adattato per gestire ST_GeomFromGeoJSON
-    # e il centroide WKT. ST_GeomFromGeoJSON si aspetta una stringa per ogni riga.
-    
-    # Dato che ST_GeomFromGeoJSON e ST_Centroid sono per riga, execute_values
-    # non è l'ideale qui se le funzioni SQL sono nel template di execute_values.
-    # È meglio iterare e fare execute per riga.
-    
-    inserted_count_actual = 0
-    for row_data in data_to_insert:
-        try:
-            cursor.execute(insert_sql_template, row_data)
-            inserted_count_actual +=1
-        except psycopg2.Error as insert_err:
-            print(f"❌ Errore inserimento riga (OBJECTID: {row_data[0]}): {insert_err}")
-            # Decidi se fare rollback parziale o continuare
-            # conn.rollback() # Esempio se vuoi fermarti al primo errore grave
-            # sys.exit(1)
-
-    return inserted_count_actual
+    Sposta le righe di staging in LOAD_TABLE con un unico INSERT ... SELECT:
+    conversione della geometria, SRID e centroide sono calcolati dal database in blocco
+    (nei worker, quindi in parallelo).
+    """
+    cursor.execute(f"""
+    INSERT INTO {LOAD_TABLE} (
+        objectid, edifc_uso, edifc_ty, edifc_sot, classid,
+        edifc_nome, edifc_stat, edifc_at, scril, meta_ist,
+        edifc_mon, shape_length, shape_area, geometry, centroide, content_hash
+    )
+    SELECT
+        objectid, edifc_uso, edifc_ty, edifc_sot, classid,
+        edifc_nome, edifc_stat, edifc_at, scril, meta_ist,
+        edifc_mon, shape_length, shape_area, geom, ST_Centroid(geom), content_hash
+    FROM (
+        SELECT s.*, ST_SetSRID(ST_GeomFromGeoJSON(s.geometry_geojson), 4326) AS geom
+        FROM staging_catasto_abitazioni s
+    ) g;
+    """)
+    inserted = cursor.rowcount
+    cursor.execute("TRUNCATE staging_catasto_abitazioni;")
+    return inserted
 
 
-def main():
-    # Assumendo che il file aquila.geojson sia in backend/data/
-    geojson_file_path = os.path.join(os.path.dirname(__file__), "..", "data", "aquila.geojson")
+def insert_features(cursor, features, start_idx=0):
+    """Carica le feature con COPY nella tabella di staging e INSERT ... SELECT in LOAD_TABLE. Restituisce le righe inserite."""
+    create_staging_table(cursor)
+    if copy_features_to_staging(cursor, features, start_idx) == 0:
+        return 0
+    return insert_from_staging(cursor)
 
-    if not os.path.exists(geojson_file_path):
-        print(f"❌ File {geojson_file_path} non trovato.")
-        print(f"Assicurati che il file sia in: {os.path.abspath(geojson_file_path)}")
+
+def sync_from_staging(cursor):
+    """
+    Caricamento incrementale: confronta la tabella di staging con catasto_abitazioni per objectid
+    e content_hash, con istruzioni set-based. Le colonne operative (predisposizione) e le TFO non
+    vengono toccate. Restituisce (conteggi, id degli edifici inseriti o aggiornati, tempi per fase).
+
+    Nota: le righe caricate prima dell'introduzione di content_hash lo hanno a NULL, quindi la
+    prima sincronizzazione dopo l'aggiornamento riscrive tutti gli edifici; le successive
+    aggiornano solo quelli effettivamente cambiati. Gli edifici senza objectid non sono
+    confrontabili e non vengono mai eliminati né ritirati.
+    """
+    counts = {}
+    timings = {}
+
+    phase_start = time.perf_counter()
+    # Senza objectid un edificio non è riconoscibile tra due caricamenti; con objectid duplicati vale l'ultimo
+    cursor.execute("DELETE FROM staging_catasto_abitazioni WHERE objectid IS NULL;")
+    counts["senza_objectid"] = cursor.rowcount
+    cursor.execute("""
+        DELETE FROM staging_catasto_abitazioni a
+        USING staging_catasto_abitazioni b
+        WHERE a.objectid = b.objectid AND a.ctid < b.ctid;
+    """)
+    counts["duplicati"] = cursor.rowcount
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_staging_objectid ON staging_catasto_abitazioni (objectid);")
+    cursor.execute("ANALYZE staging_catasto_abitazioni;")
+    timings["preparazione"] = time.perf_counter() - phase_start
+
+    # Edifici cambiati (o tornati nel catasto dopo essere stati ritirati): geometria e centroide ricalcolati solo per questi
+    phase_start = time.perf_counter()
+    cursor.execute("""
+        UPDATE catasto_abitazioni c SET
+            edifc_uso = g.edifc_uso, edifc_ty = g.edifc_ty, edifc_sot = g.edifc_sot, classid = g.classid,
+            edifc_nome = g.edifc_nome, edifc_stat = g.edifc_stat, edifc_at = g.edifc_at, scril = g.scril,
+            meta_ist = g.meta_ist, edifc_mon = g.edifc_mon, shape_length = g.shape_length, shape_area = g.shape_area,
+            geometry = g.geom, centroide = ST_Centroid(g.geom),
+            content_hash = g.content_hash, retired_at = NULL
+        FROM (
+            SELECT s.*, ST_SetSRID(ST_GeomFromGeoJSON(s.geometry_geojson), 4326) AS geom
+            FROM staging_catasto_abitazioni s
+            JOIN catasto_abitazioni e ON e.objectid = s.objectid
+            WHERE e.content_hash IS DISTINCT FROM s.content_hash OR e.retired_at IS NOT NULL
+        ) g
+        WHERE c.objectid = g.objectid
+        RETURNING c.id;
+    """)
+    changed_ids = [row[0] for row in cursor.fetchall()]
+    counts["aggiornati"] = len(changed_ids)
+    timings["aggiornamento"] = time.perf_counter() - phase_start
+
+    phase_start = time.perf_counter()
+    cursor.execute("""
+        INSERT INTO catasto_abitazioni (
+            objectid, edifc_uso, edifc_ty, edifc_sot, classid,
+            edifc_nome, edifc_stat, edifc_at, scril, meta_ist,
+            edifc_mon, shape_length, shape_area, geometry, centroide, content_hash
+        )
+        SELECT
+            objectid, edifc_uso, edifc_ty, edifc_sot, classid,
+            edifc_nome, edifc_stat, edifc_at, scril, meta_ist,
+            edifc_mon, shape_length, shape_area, geom, ST_Centroid(geom), content_hash
+        FROM (
+            SELECT s.*, ST_SetSRID(ST_GeomFromGeoJSON(s.geometry_geojson), 4326) AS geom
+            FROM staging_catasto_abitazioni s
+            WHERE NOT EXISTS (SELECT 1 FROM catasto_abitazioni c WHERE c.objectid = s.objectid)
+        ) g
+        RETURNING id;
+    """)
+    inserted_ids = [row[0] for row in cursor.fetchall()]
+    counts["inseriti"] = len(inserted_ids)
+    timings["inserimento"] = time.perf_counter() - phase_start
+
+    # Edifici spariti dal catasto: eliminati se non hanno dati operativi, altrimenti solo
+    # marcati come ritirati, così predisposizione e TFO restano consultabili
+    phase_start = time.perf_counter()
+    missing_sql = """
+        c.retired_at IS NULL
+        AND c.objectid IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM staging_catasto_abitazioni s WHERE s.objectid = c.objectid)
+    """
+    cursor.execute(f"""
+        DELETE FROM catasto_abitazioni c
+        WHERE {missing_sql}
+          AND c.predisposto_fibra IS NOT TRUE
+          AND NOT EXISTS (SELECT 1 FROM verifiche_edifici v WHERE v.id_abitazione = c.id);
+    """)
+    counts["eliminati"] = cursor.rowcount
+    cursor.execute(f"UPDATE catasto_abitazioni c SET retired_at = CURRENT_TIMESTAMP WHERE {missing_sql};")
+    counts["ritirati"] = cursor.rowcount
+    timings["ritiro"] = time.perf_counter() - phase_start
+
+    cursor.execute("SELECT COUNT(*) FROM staging_catasto_abitazioni;")
+    counts["invariati"] = cursor.fetchone()[0] - counts["aggiornati"] - counts["inseriti"]
+    cursor.execute("TRUNCATE staging_catasto_abitazioni;")
+    return counts, changed_ids + inserted_ids, timings
+
+
+def run_sync(conn, cursor, geojson_files):
+    """Sincronizza catasto_abitazioni con i file senza ricreare le tabelle (opzione --sync)."""
+    create_table_if_not_exists(cursor)
+    create_trigger_predisposto_fibra(cursor)
+    # I trigger aggiornano gli aggregati a cluster con le sole righe cambiate dalla sincronizzazione
+    create_cluster_aggregates(cursor)
+    create_data_version(cursor)
+    create_staging_table(cursor)
+    conn.commit()
+
+    sync_start = time.perf_counter()
+    feature_count = 0
+    staged_count = 0
+    for file_path in geojson_files:
+        for batch in batched(iter_geojson_features(file_path), LOAD_BATCH_SIZE):
+            staged_count += copy_features_to_staging(cursor, batch, start_idx=feature_count)
+            feature_count += len(batch)
+            print(f"   … {feature_count} feature lette, {staged_count} in staging", flush=True)
+    if feature_count == 0:
+        print("❌ Nessuna feature trovata nei file GeoJSON.")
+        sys.exit(1)
+    staging_elapsed = time.perf_counter() - sync_start
+
+    counts, touched_ids, timings = sync_from_staging(cursor)
+    phase_start = time.perf_counter()
+    create_indexes(cursor)
+    update_lod_geometries(cursor, touched_ids)
+    timings["indici_e_lod"] = time.perf_counter() - phase_start
+    notify_schema_changed(cursor, "catasto_abitazioni")
+    conn.commit() # Tutta la sincronizzazione è un'unica transazione
+    # I delta dei cluster accodati dalla sincronizzazione passano subito nelle celle
+    phase_start = time.perf_counter()
+    cursor.execute("SELECT consolida_cluster_delta();")
+    conn.commit()
+    timings["consolidamento_cluster"] = time.perf_counter() - phase_start
+
+    print("📋 Riepilogo sincronizzazione:")
+    print(f"   feature lette: {feature_count} (staging {staging_elapsed:.1f}s)")
+    for key in ("inseriti", "aggiornati", "invariati", "ritirati", "eliminati", "senza_objectid", "duplicati"):
+        print(f"   {key}: {counts[key]}")
+    for key, elapsed in timings.items():
+        print(f"   ⏱️ {key}: {elapsed:.2f}s")
+    print(f"   ⏱️ totale: {time.perf_counter() - sync_start:.1f}s")
+    peak = peak_rss_mb()
+    if peak is not None:
+        print(f"🧠 Picco memoria (RSS): {peak:.1f} MB")
+
+
+DEFAULT_GEOJSON_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "aquila.geojson")
+
+
+def collect_geojson_files(paths):
+    """Espande le cartelle nei file *.geojson / *.json contenuti; errore se un percorso non esiste."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith((".geojson", ".json"))
+            ))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"❌ File {path} non trovato.")
+            print(f"Assicurati che il file sia in: {os.path.abspath(path)}")
+            sys.exit(1)
+    return files
+
+
+def load_task(task):
+    """
+    Carica un file (o una sua parte) in LOAD_TABLE su una connessione dedicata, in una
+    transazione propria: le righe diventano visibili all'API solo con publish_load_table.
+    task = (percorso, indice della parte, numero di parti): con più parti ogni processo legge
+    e decodifica comunque l'intero file in streaming, ma converte, calcola l'hash e carica
+    solo le feature con indice % parti == parte. Le parti dividono quindi il lavoro di
+    conversione e quello del database, non la lettura del JSON.
+    Eseguita nei processi del pool: restituisce un dict con i conteggi per il controllo finale.
+    """
+    file_path, shard, shard_count = task
+    label = os.path.basename(file_path) + (f" [{shard + 1}/{shard_count}]" if shard_count > 1 else "")
+    features = iter_geojson_features(file_path)
+    if shard_count > 1:
+        features = (feature for idx, feature in enumerate(features) if idx % shard_count == shard)
+
+    start = time.perf_counter()
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cursor:
+            read_count = 0
+            inserted_count = 0
+            for batch in batched(features, LOAD_BATCH_SIZE):
+                inserted_count += insert_features(cursor, batch, start_idx=read_count)
+                read_count += len(batch)
+                print(f"   [{label}] … {read_count} feature lette, {inserted_count} righe inserite", flush=True)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+    print(f"   [{label}] ✓ completato: {inserted_count} righe in {elapsed:.1f}s ({inserted_count / max(elapsed, 1e-9):.0f} righe/s)", flush=True)
+    return {"label": label, "read": read_count, "inserted": inserted_count, "elapsed": elapsed, "peak_rss_mb": peak_rss_mb()}
+
+
+def run_load_tasks(tasks, workers):
+    """Esegue i task in un pool di processi (o nel processo corrente con un solo worker)."""
+    if workers <= 1 or len(tasks) == 1:
+        return [load_task(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(load_task, tasks))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Carica uno o più file GeoJSON del catasto in PostgreSQL/PostGIS "
+                                                 "(sostituisce le tabelle, o le aggiorna per objectid con --sync).")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_GEOJSON_PATH],
+                        help="File GeoJSON o cartelle da cui caricare tutti i *.geojson (default: data/aquila.geojson)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processi paralleli, ciascuno con la propria connessione (default: 1)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Divide ogni file in N parti caricate da processi diversi, utile per un solo file molto grande: "
+                             "ogni parte rilegge e decodifica l'intero file, quindi si parallelizzano conversione e "
+                             "scrittura nel database, non la lettura del JSON")
+    parser.add_argument("--sync", action="store_true",
+                        help="Caricamento incrementale per objectid: non elimina le tabelle e conserva predisposizioni e TFO "
+                             "(la prima esecuzione su dati caricati senza content_hash riscrive tutti gli edifici)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    geojson_files = collect_geojson_files(args.paths)
+    if not geojson_files:
+        print("❌ Nessun file GeoJSON da caricare.")
         sys.exit(1)
+    shard_count = max(1, args.shards)
+    tasks = [(file_path, shard, shard_count) for file_path in geojson_files for shard in range(shard_count)]
 
     conn = None # Definisci conn qui per averlo nello scope del finally
     cursor = None # Definisci cursor qui
+    load_table_created = False # Tabella di caricamento da eliminare se il caricamento non arriva al commit
     try:
         print("🔌 Connessione al database...")
         conn = psycopg2.connect(**DB_CONFIG)
@@ -279,6 +867,32 @@ def main():
         cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis;")
         print("✓ Estensione PostGIS assicurata.")
 
+        if args.sync:
+            if args.workers > 1 or args.shards > 1:
+                print("ℹ️ --sync usa una sola connessione: --workers e --shards vengono ignorati.")
+            run_sync(conn, cursor, geojson_files)
+            return
+
+        load_table_created = True
+        create_load_table(cursor)
+        conn.commit() # Commit della tabella di caricamento: i worker usano connessioni proprie
+
+        print(f"📖 Caricamento di {len(geojson_files)} file in {len(tasks)} task con {max(1, args.workers)} processi, "
+              f"a blocchi di {LOAD_BATCH_SIZE} feature (COPY + INSERT ... SELECT)...")
+        load_start = time.perf_counter()
+        results = run_load_tasks(tasks, args.workers)
+        load_elapsed = time.perf_counter() - load_start
+
+        feature_count = sum(r["read"] for r in results)
+        inserted_count = sum(r["inserted"] for r in results)
+        if feature_count == 0:
+            print("❌ Nessuna feature trovata nei file GeoJSON.")
+            sys.exit(1)
+        print(f"📊 Lette {feature_count} feature dai GeoJSON.")
+        print(f"⏱️ Caricamento: {inserted_count} righe in {load_elapsed:.1f}s ({inserted_count / max(load_elapsed, 1e-9):.0f} righe/s)")
+
+        # Da qui un'unica transazione: durante la pubblicazione le letture attendono il commit
+        # invece di vedere tabelle vuote o parziali, e un errore lascia i dati precedenti intatti
         print("🗑️ Drop delle tabelle 'verifiche_edifici' e 'catasto_abitazioni' (se esistono)...")
         cursor.execute("DROP TABLE IF EXISTS verifiche_edifici CASCADE;")
         cursor.execute("DROP TABLE IF EXISTS catasto_abitazioni CASCADE;")
@@ -286,26 +900,32 @@ def main():
 
         create_table_if_not_exists(cursor) # Crea le tabelle
         create_trigger_predisposto_fibra(cursor) # Crea il trigger
-        conn.commit() # Commit dopo DDL e creazione trigger
-
-        print(f"📖 Caricamento file {geojson_file_path}...")
-        geojson_data = load_geojson_file(geojson_file_path)
-        features = geojson_data.get('features', [])
-
-        if not features:
-            print("❌ Nessuna feature trovata nel file GeoJSON.")
+        published_count = publish_load_table(cursor)
+        # Controllo di coerenza prima del commit: le righe pubblicate devono essere quelle dichiarate dai worker
+        if published_count != inserted_count:
+            print(f"❌ Conteggi incoerenti: {inserted_count} righe inserite dai worker, {published_count} nella tabella di caricamento.")
+            conn.rollback()
             sys.exit(1)
-        print(f"📊 Trovate {len(features)} feature nel GeoJSON.")
-
-        print("💾 Inserimento dati in corso...")
-        inserted_count = insert_features(cursor, features) # Passa la connessione per il calcolo del centroide
-        conn.commit() # Commit dopo l'inserimento dei dati
-        print(f"✅ Inserimento completato: {inserted_count} record inseriti in 'catasto_abitazioni'.")
-
-        cursor.execute("SELECT COUNT(*) FROM catasto_abitazioni;")
-        total = cursor.fetchone()[0]
-        print(f"📈 Totale record nella tabella 'catasto_abitazioni': {total}")
-
+        create_indexes(cursor)
+        update_lod_geometries(cursor)
+        # Trigger creati dopo il caricamento: gli aggregati si calcolano una volta sola alla fine
+        create_cluster_aggregates(cursor, rebuild=True)
+        # Anche questi trigger dopo il caricamento: la versione dei dati è incrementata una volta sola, qui
+        create_data_version(cursor)
+        notify_schema_changed(cursor, "catasto_abitazioni")
+        conn.commit() # Pubblicazione: tabelle nuove, indici e trigger visibili insieme (la notifica parte al commit)
+        load_table_created = False
+        print(f"✅ Inserimento completato: {published_count} record inseriti in 'catasto_abitazioni'.")
+        print("✓ Conteggi coerenti tra worker e tabella.")
+        peaks = [r["peak_rss_mb"] for r in results if r["peak_rss_mb"] is not None]
+        if peaks:
+            print(f"🧠 Picco memoria (RSS) per processo: {max(peaks):.1f} MB")
+
+    except (ValueError, UnicodeDecodeError) as e: # json.JSONDecodeError è una ValueError
+        print(f"❌ Errore nel parsing JSON: {e}")
+        if conn:
+            conn.rollback()
+        sys.exit(1)
     except psycopg2.Error as e:
         print(f"❌ Errore database: {e}")
         if conn:
@@ -320,6 +940,8 @@ def main():
         if cursor:
             cursor.close()
         if conn:
+            if load_table_created:
+                drop_load_table(conn)
             conn.close()
         print("🔌 Connessione chiusa.")
 
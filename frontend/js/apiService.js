@@ -1,5 +1,83 @@
+// Ultima risposta delle GET con ETag/Last-Modified, per URL (LRU, al massimo API_CONDITIONAL_CACHE_MAX_ENTRIES voci).
+// La richiesta successiva allo stesso URL invia If-None-Match/If-Modified-Since: se i dati non sono cambiati
+// il backend risponde 304 senza corpo e vengono riusati i dati già scaricati.
+const conditionalResponseCache = new Map();
+
+/**
+ * Converte una risposta HTTP di errore in un'eccezione con il messaggio del backend e lo status.
+ * @param {Response} response Risposta fetch con status non 2xx
+ */
+function throwApiError(response) {
+    const status = response.status; // Cattura lo status code
+    // Tenta di leggere il corpo dell'errore JSON
+    return response.json().then(err => {
+         console.error("API Error Response Body:", err);
+         // Usa il messaggio di dettaglio se presente, altrimenti un errore generico HTTP
+         const error = new Error(err.detail || `Errore HTTP ${status}`);
+         error.status = status; // Aggiungi lo status all'oggetto errore
+         throw error;
+    }).catch(() => {
+        // Se il corpo non è JSON o c'è un altro errore nella lettura
+        const error = new Error(`Errore HTTP ${status} - Impossibile leggere il dettaglio dell'errore.`);
+        error.status = status; // Aggiungi lo status all'oggetto errore
+        throw error;
+    });
+}
+
+/**
+ * GET condizionale: restituisce una Promise con i dati letti da parseBody(response),
+ * presi dalla copia locale se il backend risponde 304 Not Modified.
+ * @param {string} url URL completo della risorsa
+ * @param {string} accept Formato richiesto (intestazione Accept), parte della chiave della copia locale
+ * @param {function} parseBody Funzione (response) => Promise dei dati
+ */
+function fetchConditional(url, accept, parseBody) {
+    const cacheKey = `${accept} ${url}`;
+    const cached = conditionalResponseCache.get(cacheKey);
+    const headers = { 'Accept': accept };
+    if (cached && cached.etag) {
+        headers['If-None-Match'] = cached.etag;
+    } else if (cached && cached.lastModified) {
+        headers['If-Modified-Since'] = cached.lastModified;
+    }
+
+    // 'no-store': la cache HTTP del browser non interviene, il 304 arriva qui
+    return fetch(url, { method: 'GET', headers: headers, cache: 'no-store' })
+        .then(response => {
+            if (response.status === 304 && cached) {
+                conditionalResponseCache.delete(cacheKey); // Reinserita come voce più recente
+                conditionalResponseCache.set(cacheKey, cached);
+                return cached.data;
+            }
+            if (!response.ok) {
+                return throwApiError(response);
+            }
+            return parseBody(response).then(data => {
+                const etag = response.headers.get('ETag');
+                const lastModified = response.headers.get('Last-Modified');
+                conditionalResponseCache.delete(cacheKey);
+                if (etag || lastModified) {
+                    conditionalResponseCache.set(cacheKey, { etag: etag, lastModified: lastModified, data: data });
+                    if (conditionalResponseCache.size > API_CONDITIONAL_CACHE_MAX_ENTRIES) {
+                        conditionalResponseCache.delete(conditionalResponseCache.keys().next().value); // La meno recente
+                    }
+                }
+                return data;
+            });
+        });
+}
+
+/**
+ * GET condizionale di una risorsa JSON (vedi fetchConditional).
+ * @param {string} url URL completo della risorsa
+ */
+function fetchJsonConditional(url) {
+    return fetchConditional(url, 'application/json', response => response.json());
+}
+
 /**
  * Invia una richiesta API al backend.
+ * Le GET sono condizionali (vedi fetchJsonConditional).
  * @param {string} method Metodo HTTP (GET, POST, PUT, DELETE)
  * @param {string} endpoint Endpoint API (es. /predisposizioni)
  * @param {object|null} data Dati da inviare nel body (per POST, PUT)
@@ -10,6 +88,22 @@ function sendApiRequest(method, endpoint, data, successCallback, errorCallback)
     const url = API_BASE_URL + endpoint;
     console.log(`API Request: ${method} ${url}`, data); // Log per debug
 
+    if (method === 'GET') {
+        fetchJsonConditional(url)
+            .then(responseData => {
+                console.log('API Success Response:', responseData);
+                successCallback(responseData);
+            })
+            .catch(error => {
+                console.error('API Fetch Error:', error);
+                errorCallback({
+                    message: error.message || 'Errore di rete o backend non raggiungibile.',
+                    status: error.status
+                });
+            });
+        return;
+    }
+
     const options = {
         method: method,
         headers: {
@@ -25,20 +119,7 @@ function sendApiRequest(method, endpoint, data, successCallback, errorCallback)
     fetch(url, options)
         .then(response => {
             if (!response.ok) {
-                const status = response.status; // Cattura lo status code
-                // Tenta di leggere il corpo dell'errore JSON
-                return response.json().then(err => {
-                     console.error("API Error Response Body:", err);
-                     // Usa il messaggio di dettaglio se presente, altrimenti un errore generico HTTP
-                     const error = new Error(err.detail || `Errore HTTP ${status}`);
-                     error.status = status; // Aggiungi lo status all'oggetto errore
-                     throw error;
-                }).catch(() => {
-                    // Se il corpo non è JSON o c'è un altro errore nella lettura
-                    const error = new Error(`Errore HTTP ${status} - Impossibile leggere il dettaglio dell'errore.`);
-                    error.status = status; // Aggiungi lo status all'oggetto errore
-                    throw error;
-                });
+                return throwApiError(response);
             }
              // Gestisce risposte senza contenuto (es. 204 No Content per DELETE)
             if (response.status === 204) {
@@ -4,4 +4,9 @@ const API_BASE_URL = 'http://127.0.0.1:8000'; // URL base del backend API
 const MAP_DEFAULT_CENTER = [42.3498, 13.3995]; // L'Aquila
 const MAP_DEFAULT_ZOOM = 14;
 const MAP_MIN_ZOOM_TO_LOAD_DATA = 14;
-const MAP_ZOOM_SHOW_POLYGONS = 16; // Zoom oltre il quale mostrare i poligoni invece che solo centroidi (se implementato)
\ No newline at end of file
+const MAP_ZOOM_SHOW_POLYGONS = 16; // Zoom oltre il quale mostrare i poligoni invece che solo centroidi (se implementato)
+const MAP_USE_VECTOR_TILES = true; // Usa le tile vettoriali /tiles/{z}/{x}/{y}.mvt (richiede Leaflet.VectorGrid) invece di /geojson/bbox
+const MAP_VECTOR_TILES_MIN_ZOOM = 12; // Sotto questo zoom le tile non vengono richieste (a zoom < 14 contengono solo centroidi)
+const MAP_CLUSTER_MAX_ZOOM = 13; // Zoom massimo con i cluster precalcolati (GET /clusters); sotto lo zoom degli edifici la mappa mostra i cluster
+const MAP_BBOX_FORMAT = 'flatgeobuf'; // Formato delle pagine /geojson/bbox senza tile vettoriali: 'flatgeobuf' (binario, libreria flatgeobuf) o 'geojson'
+const API_CONDITIONAL_CACHE_MAX_ENTRIES = 200; // Risposte GET tenute in memoria da apiService.js per le richieste condizionali (ETag/304)
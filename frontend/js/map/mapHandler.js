@@ -11,6 +11,8 @@ let debounceTimer = null;
 // let lastBounds = null; // Non usato nell'originale
 let errorMessageTimeout = null;
 let mapErrorElement = null;
+let bboxRequestSeq = 0; // Incrementato ad ogni nuovo caricamento: le pagine di richieste superate vengono scartate
+let clusterRequestSeq = 0; // Come bboxRequestSeq, per le richieste dei cluster
 
 
 // Funzione per inizializzare la mappa (chiamata da main.js)
@@ -29,6 +31,8 @@ function initMap() {
             mapInstance: null,
             geoJsonLayer: null,
             centroidLayer: null,
+            vectorTileLayer: null,
+            clusterLayer: null,
             buildingLayers: {},
             predispostoIds: new Set()
         };
@@ -78,6 +82,23 @@ function initMap() {
     }
 
 
+    // Con le tile vettoriali Leaflet richiede solo le tile mancanti e le riusa dalla cache:
+    // non serve ricaricare il bbox ad ogni spostamento della mappa.
+    if (MAP_USE_VECTOR_TILES && L.vectorGrid) {
+        initVectorTileLayer();
+        // Sotto lo zoom minimo delle tile la mappa mostra i cluster
+        window.mapContext.mapInstance.on('moveend zoomend', function() {
+            if (debounceTimer) clearTimeout(debounceTimer);
+            debounceTimer = setTimeout(() => updateClusterLayer(MAP_VECTOR_TILES_MIN_ZOOM), 300);
+        });
+        updateClusterLayer(MAP_VECTOR_TILES_MIN_ZOOM);
+        console.log("Mappa inizializzata (tile vettoriali).");
+        return;
+    }
+    if (MAP_USE_VECTOR_TILES) {
+        console.warn("Leaflet.VectorGrid non disponibile, uso del caricamento per bbox.");
+    }
+
     window.mapContext.mapInstance.on('moveend zoomend', function() {
         if (debounceTimer) clearTimeout(debounceTimer);
         debounceTimer = setTimeout(loadBuildingsDataByBounds, 300);
@@ -118,17 +139,23 @@ function loadBuildingsDataByBounds() {
     const zoom = currentMap.getZoom();
 
     if (zoom < minZoomToLoad) {
+        bboxRequestSeq++; // Interrompe l'eventuale caricamento a pagine in corso
         if (window.mapContext.geoJsonLayer) currentMap.removeLayer(window.mapContext.geoJsonLayer);
         if (window.mapContext.centroidLayer) currentMap.removeLayer(window.mapContext.centroidLayer);
         window.mapContext.buildingLayers = {}; // Resetta i layer tracciati
-        showMapErrorMessage(`Zoom troppo basso (attuale: ${zoom}). Eseguire uno zoom maggiore (min: ${minZoomToLoad}) per visualizzare i dati.`);
         if (loadingIndicatorEl) loadingIndicatorEl.style.display = 'none';
+        if (zoom <= MAP_CLUSTER_MAX_ZOOM) {
+            updateClusterLayer(minZoomToLoad); // Al posto dei singoli edifici, i cluster con i conteggi
+        } else {
+            showMapErrorMessage(`Zoom troppo basso (attuale: ${zoom}). Eseguire uno zoom maggiore (min: ${minZoomToLoad}) per visualizzare i dati.`);
+        }
         return;
     }
      if (mapErrorElement) mapErrorElement.style.display = 'none'; // Nascondi errori precedenti se lo zoom è ok
+    updateClusterLayer(minZoomToLoad); // Rimuove i cluster: da questo zoom si vedono gli edifici
 
 
-    const bounds = currentMap.getBounds();
+    const bounds = snapBoundsToTiles(currentMap.getBounds(), zoom); // Stesso allineamento del backend: URL riutilizzabili
     // La logica geometry_type 'both' o solo centroidi potrebbe essere basata su MAP_ZOOM_SHOW_POLYGONS
     // Per ora, l'originale caricava 'both' se zoom > 16, altrimenti nulla.
     // Modifichiamo per caricare sempre 'both' se zoom >= minZoomToLoad
@@ -147,40 +174,50 @@ function loadBuildingsDataByBounds() {
 
 
     const params = {
-        west: bounds.getWest(),
-        south: bounds.getSouth(),
-        east: bounds.getEast(),
-        north: bounds.getNorth(),
+        west: bounds.west,
+        south: bounds.south,
+        east: bounds.east,
+        north: bounds.north,
         zoom: zoom, // Inviato al backend, anche se non strettamente usato nella query SQL attuale
         geometry_type: geometry_type // Backend potrebbe usare questo per ottimizzare
     };
 
     const query = Object.keys(params).map(k => `${encodeURIComponent(k)}=${encodeURIComponent(params[k])}`).join('&');
-    const fetchUrl = `${API_BASE_URL}/geojson/bbox?${query}`; // API_BASE_URL da config.js
+    const baseUrl = `${API_BASE_URL}/geojson/bbox?${query}`; // API_BASE_URL da config.js
+    const requestSeq = ++bboxRequestSeq;
 
     if (loadingIndicatorEl) {
         loadingIndicatorEl.innerHTML = `Caricamento dati (zoom: ${zoom})...`;
         loadingIndicatorEl.style.display = 'block';
     }
 
-    fetch(fetchUrl)
-        .then(response => {
-            if (!response.ok) {
-                return response.json().then(err => {
-                    throw new Error(err.detail || `Errore HTTP: ${response.status}`);
-                }).catch(() => new Error(`Errore HTTP: ${response.status} - Impossibile leggere il messaggio.`));
-            }
-            return response.json();
-        })
+    // Il backend restituisce i dati a pagine: ogni pagina viene aggiunta alla mappa appena arriva
+    // e, finché 'next' non è null, si richiede la successiva
+    fetchBuildingsPage(baseUrl, null, requestSeq, 0);
+}
+
+function fetchBuildingsPage(baseUrl, cursor, requestSeq, loadedCount) {
+    const currentMap = window.mapContext.mapInstance;
+    const fetchUrl = cursor ? `${baseUrl}&cursor=${encodeURIComponent(cursor)}` : baseUrl;
+
+    // GET condizionale (apiService.js): se la pagina non è cambiata il backend risponde 304 e si riusano i dati già scaricati.
+    // FlatGeobuf se configurato e se la libreria è stata caricata, altrimenti GeoJSON
+    const useFlatGeobuf = MAP_BBOX_FORMAT === 'flatgeobuf' && typeof flatgeobuf !== 'undefined';
+    (useFlatGeobuf ? fetchFlatGeobufPage(fetchUrl) : fetchJsonConditional(fetchUrl))
         .then(data => {
-            if (window.mapContext.geoJsonLayer) currentMap.removeLayer(window.mapContext.geoJsonLayer);
-            if (window.mapContext.centroidLayer) currentMap.removeLayer(window.mapContext.centroidLayer);
-            
-            window.mapContext.buildingLayers = {}; // Resetta i layer prima di ripopolare
+            if (requestSeq !== bboxRequestSeq) return; // La mappa è stata spostata: pagina non più utile
+
+            const isFirstPage = cursor === null;
+            if (isFirstPage) {
+                if (window.mapContext.geoJsonLayer) currentMap.removeLayer(window.mapContext.geoJsonLayer);
+                if (window.mapContext.centroidLayer) currentMap.removeLayer(window.mapContext.centroidLayer);
 
-            // Popola predispostoIds in base al campo predisposto_fibra dai dati caricati
-            // Questo assicura che lo stato sia aggiornato con i dati freschi dal backend.
-            window.mapContext.predispostoIds.clear(); // Svuota prima di ripopolare
+                window.mapContext.buildingLayers = {}; // Resetta i layer prima di ripopolare
+
+                // Popola predispostoIds in base al campo predisposto_fibra dai dati caricati
+                // Questo assicura che lo stato sia aggiornato con i dati freschi dal backend.
+                window.mapContext.predispostoIds.clear(); // Svuota prima di ripopolare
+            }
             if (data.features) {
                 data.features.forEach(feature => {
                     // Considera solo le feature che non sono centroidi per questo check,
@@ -192,22 +229,22 @@ function loadBuildingsDataByBounds() {
                 });
             }
 
-            const featureCount = data.features ? data.features.length : 0;
+            const featureCount = loadedCount + (data.features ? data.features.length : 0);
             if (loadingIndicatorEl) {
-                loadingIndicatorEl.innerHTML = `Caricati ${featureCount} elementi.`;
-                setTimeout(() => {
-                    if (loadingIndicatorEl) loadingIndicatorEl.style.display = 'none';
-                }, 2000);
-            }
-            if (featureCount === 3000) { // Limite hardcoded nel backend
-                 showMapErrorMessage("Numero massimo di elementi caricati (3000). Alcuni dati potrebbero mancare. Prova a zoomare di più.", 10000);
+                if (data.next) {
+                    loadingIndicatorEl.innerHTML = `Caricati ${featureCount} elementi, caricamento in corso...`;
+                } else {
+                    loadingIndicatorEl.innerHTML = `Caricati ${featureCount} elementi.`;
+                    setTimeout(() => {
+                        if (loadingIndicatorEl) loadingIndicatorEl.style.display = 'none';
+                    }, 2000);
+                }
             }
 
-
             const polygonFeatures = [];
             const centroidFeatures = [];
 
-            data.features.forEach(feature => {
+            (data.features || []).forEach(feature => {
                 if (feature.properties && feature.properties.is_centroid) {
                     centroidFeatures.push(feature);
                 } else {
@@ -215,129 +252,18 @@ function loadBuildingsDataByBounds() {
                 }
             });
             
-            // Layer Poligoni Edifici
-            window.mapContext.geoJsonLayer = L.geoJSON({
-                type: "FeatureCollection",
-                features: polygonFeatures
-            }, {
-                style: function(feature) {
-                    const buildingId = feature.properties.id || feature.properties.objectid;
-                    const isPredisposto = window.mapContext.predispostoIds.has(String(buildingId));
-                    
-                    // Stile di default per poligoni
-                    let style = {
-                        weight: 1,
-                        fillOpacity: 0.3,
-                        smoothFactor: 0.5 // Leggermente più liscio
-                    };
-                    if (isPredisposto) {
-                        style.color = 'orange'; // Giallo/Arancio per predisposto
-                        style.fillColor = 'orange';
-                        style.fillOpacity = 0.4;
-                    } else {
-                        style.color = 'blue'; // Blu per non predisposto (diverso da rosso per centroidi)
-                        style.fillColor = 'blue';
-                    }
-                    return style;
-                },
-                onEachFeature: function(feature, layer) {
-                    const props = feature.properties;
-                    const buildingId = String(props.id || props.objectid); // Assicura stringa
-                    if (buildingId) {
-                         window.mapContext.buildingLayers[buildingId] = layer; // Traccia il layer
-                    }
-
-                    let popupContent = '<div style="font-family: Arial, sans-serif; font-size: 12px; max-width: 250px;">';
-                    popupContent += '<strong>ID Edificio:</strong> ' + (buildingId || 'N/D') + '<br>';
-                    popupContent += '<strong>Uso:</strong> ' + (props.edifc_uso || 'N/D') + '<br>';
-                    
-                    // Coordinate dal centroide della geometria del poligono se non specificato diversamente
-                    const center = layer.getBounds().getCenter();
-                    popupContent += `<strong>Coord. Poligono (centro):</strong> ${center.lat.toFixed(6)}, ${center.lng.toFixed(6)}<br>`;
-                    if(props.predisposto_fibra) popupContent += '<strong style="color: orange;">Predisposto Fibra</strong><br>';
-                    popupContent += '</div>';
-                    layer.bindPopup(popupContent);
-
-                    layer.on('click', function(e) {
-                        const clickedProps = e.target.feature.properties;
-                        const latlng = e.latlng; // Lat/Lng del punto cliccato sul poligono
-
-                        // Popola il form nella sezione edifici (se il form è visibile/attivo)
-                        // Questi ID sono definiti in index.html
-                        const formIndirizzo = document.getElementById('formIndirizzo');
-                        const formLat = document.getElementById('formLatitudine');
-                        const formLon = document.getElementById('formLongitudine');
-                        const formDbId = document.getElementById('formDbId'); // ID da catasto_abitazioni.id
-                        const formObjectId = document.getElementById('formObjectId'); // OBJECTID originale
-                        const formEdifcUso = document.getElementById('formEdifcUso');
-                        // const formComune = document.getElementById('formComune');
-                        // const formCodiceBelfiore = document.getElementById('formCodiceBelfiore');
-                        // const formCodiceCatastale = document.getElementById('formCodiceCatastale');
-
-                        if (formIndirizzo) formIndirizzo.value = clickedProps.edifc_nome || clickedProps.indirizzo || `Edificio ID ${clickedProps.id || clickedProps.objectid}` ;
-                        if (formObjectId) formObjectId.value = clickedProps.objectid || '';
-                        if (formDbId) formDbId.value = clickedProps.id || ''; // Usa 'id' (PK) se disponibile
-                        if (formEdifcUso) formEdifcUso.value = clickedProps.edifc_uso || '';
-                        
-                        // Usa le coordinate del click o il centroide del poligono
-                        if (formLat) formLat.value = latlng.lat.toFixed(8);
-                        if (formLon) formLon.value = latlng.lng.toFixed(8);
-
-                        // Se il backend fornisce lat/lon pre-calcolate (es. da predisposizione), usarle
-                        if (clickedProps.lat && clickedProps.lon && formLat && formLon) {
-                            formLat.value = parseFloat(clickedProps.lat).toFixed(8);
-                            formLon.value = parseFloat(clickedProps.lon).toFixed(8);
-                        }
-                        
-                        // Popola altri campi se disponibili nelle proprietà e se i campi esistono nel form
-                        if (document.getElementById('formComune') && clickedProps.comune) document.getElementById('formComune').value = clickedProps.comune;
-                        if (document.getElementById('formCodiceBelfiore') && clickedProps.codice_belfiore) document.getElementById('formCodiceBelfiore').value = clickedProps.codice_belfiore;
-                        if (document.getElementById('formCodiceCatastale') && clickedProps.codice_catastale) document.getElementById('formCodiceCatastale').value = clickedProps.codice_catastale;
-                         if (document.getElementById('formDataPredisposizione') && clickedProps.data_predisposizione) {
-                            try {
-                                document.getElementById('formDataPredisposizione').value = new Date(clickedProps.data_predisposizione).toISOString().split('T')[0];
-                            } catch (dateErr) { /* ignora se la data non è valida */ }
-                        }
-                    });
-                }
-            }).addTo(currentMap);
-
-            // Layer Centroidi (se presenti)
-            if (centroidFeatures.length > 0) {
-                window.mapContext.centroidLayer = L.geoJSON({
-                    type: "FeatureCollection",
-                    features: centroidFeatures
-                }, {
-                    pointToLayer: function(feature, latlng) {
-                        const isParentPredisposto = window.mapContext.predispostoIds.has(String(feature.properties.parent_id));
-                        return L.circleMarker(latlng, {
-                            radius: 5, // Leggermente più grande
-                            fillColor: isParentPredisposto ? "#FFA500" : "#FF0000", // Arancio se predisposto, Rosso altrimenti
-                            color: "#000",
-                            weight: 1,
-                            opacity: 1,
-                            fillOpacity: 0.8
-                        });
-                    },
-                    onEachFeature: function(feature, layer) {
-                        let popupContent = '<div style="font-family: Arial, sans-serif; font-size: 12px;">';
-                        popupContent += '<strong>Centroide Edificio</strong><br>';
-                        if (feature.properties.parent_id) {
-                            popupContent += '<strong>ID Edificio:</strong> ' + feature.properties.parent_id + '<br>';
-                        }
-                        const coordinates = feature.geometry.coordinates;
-                        popupContent += `<strong>Coordinate:</strong> ${coordinates[1].toFixed(6)}, ${coordinates[0].toFixed(6)}<br>`;
-                        if(feature.properties.predisposto_fibra) popupContent += '<strong style="color: orange;">Predisposto Fibra</strong><br>';
-                        popupContent += '</div>';
-                        layer.bindPopup(popupContent);
-                        // Nessun evento di click per popolare il form, i poligoni lo fanno già.
-                    }
-                })//.addTo(currentMap); // Decommenta se vuoi aggiungere il layer dei centroidi alla mappa
+            if (isFirstPage) {
+                createBuildingLayers(currentMap);
             }
+            window.mapContext.geoJsonLayer.addData(polygonFeatures);
+            window.mapContext.centroidLayer.addData(centroidFeatures);
 
-
+            if (data.next) {
+                fetchBuildingsPage(baseUrl, data.next, requestSeq, featureCount);
+            }
         })
         .catch(err => {
+            if (requestSeq !== bboxRequestSeq) return;
             console.error('Errore nel caricamento o processamento dei dati GeoJSON:', err);
             if (loadingIndicatorEl) {
                 loadingIndicatorEl.innerHTML = `<span style="color: red;">Errore caricamento!</span>`;
@@ -347,4 +273,305 @@ function loadBuildingsDataByBounds() {
             }
             showMapErrorMessage(`Dati mappa non caricati: ${err.message}`);
         });
-}
\ No newline at end of file
+}
+
+// Pagina di /geojson/bbox in formato FlatGeobuf, convertita nello stesso FeatureCollection del GeoJSON
+function fetchFlatGeobufPage(url) {
+    return fetchConditional(url, 'application/flatgeobuf', response => {
+        const next = response.headers.get('X-Next-Cursor'); // Il cursore non è nel corpo binario
+        if (response.status === 204) { // Pagina senza edifici
+            return Promise.resolve({ type: 'FeatureCollection', features: [], next: next });
+        }
+        return response.arrayBuffer().then(buffer => flatGeobufToFeatureCollection(new Uint8Array(buffer), next));
+    });
+}
+
+// Il FlatGeobuf ha una feature per edificio con il centroide nelle proprietà centroide_lon/centroide_lat:
+// ricrea le feature separate di poligono e centroide restituite da /geojson/bbox in GeoJSON
+function flatGeobufToFeatureCollection(bytes, next) {
+    const features = [];
+    flatgeobuf.deserialize(bytes).features.forEach(feature => {
+        const props = feature.properties || {};
+        const parentId = props.id || props.objectid;
+        if (props.centroide_lon === undefined) { // Zoom bassi: la geometria è già il centroide
+            features.push({
+                type: 'Feature', geometry: feature.geometry,
+                properties: { is_centroid: true, parent_id: parentId, predisposto_fibra: props.predisposto_fibra }
+            });
+            return;
+        }
+        const centroid = [props.centroide_lon, props.centroide_lat];
+        delete props.centroide_lon;
+        delete props.centroide_lat;
+        features.push({ type: 'Feature', geometry: feature.geometry, properties: props });
+        if (centroid[0] !== null && centroid[1] !== null) {
+            features.push({
+                type: 'Feature', geometry: { type: 'Point', coordinates: centroid },
+                properties: { is_centroid: true, parent_id: parentId, predisposto_fibra: props.predisposto_fibra }
+            });
+        }
+    });
+    return { type: 'FeatureCollection', features: features, next: next };
+}
+
+// Rimuove il layer dei cluster e scarta le risposte ancora in arrivo
+function clearClusterLayer() {
+    clusterRequestSeq++;
+    if (window.mapContext.clusterLayer) {
+        window.mapContext.mapInstance.removeLayer(window.mapContext.clusterLayer);
+        window.mapContext.clusterLayer = null;
+    }
+}
+
+// Icona di un cluster: cerchio con il numero di edifici, arancione se contiene edifici predisposti
+function clusterIcon(properties) {
+    const size = Math.round(Math.min(56, 24 + 4 * Math.log10(Math.max(properties.buildings, 1)) * 2));
+    const color = properties.predisposti > 0 ? 'rgba(255, 165, 0, 0.85)' : 'rgba(30, 100, 200, 0.75)';
+    const label = properties.buildings >= 1000 ? `${(properties.buildings / 1000).toFixed(1)}k` : properties.buildings;
+    return L.divIcon({
+        className: 'building-cluster',
+        html: `<div style="width:${size}px;height:${size}px;line-height:${size}px;border-radius:50%;` +
+              `background:${color};border:2px solid #fff;color:#fff;font:bold 11px Arial, sans-serif;` +
+              `text-align:center;box-shadow:0 1px 4px rgba(0,0,0,0.4);">${label}</div>`,
+        iconSize: [size, size]
+    });
+}
+
+/**
+ * Mostra i cluster di edifici (GET /clusters) quando lo zoom è sotto minZoomForBuildings,
+ * altrimenti li rimuove. Ogni cluster riporta edifici, predisposti e TFO della sua cella;
+ * un click ingrandisce la mappa sul cluster.
+ */
+function updateClusterLayer(minZoomForBuildings) {
+    const currentMap = window.mapContext.mapInstance;
+    const zoom = currentMap.getZoom();
+    if (zoom >= minZoomForBuildings || zoom > MAP_CLUSTER_MAX_ZOOM) {
+        clearClusterLayer();
+        return;
+    }
+    const bounds = currentMap.getBounds();
+    const params = new URLSearchParams({
+        west: bounds.getWest(),
+        south: bounds.getSouth(),
+        east: bounds.getEast(),
+        north: bounds.getNorth(),
+        zoom: zoom
+    });
+    const requestSeq = ++clusterRequestSeq;
+
+    fetch(`${API_BASE_URL}/clusters?${params.toString()}`)
+        .then(response => {
+            if (!response.ok) {
+                return response.json().then(err => {
+                    throw new Error(err.detail || `Errore HTTP: ${response.status}`);
+                }).catch(() => new Error(`Errore HTTP: ${response.status} - Impossibile leggere il messaggio.`));
+            }
+            return response.json();
+        })
+        .then(data => {
+            if (requestSeq !== clusterRequestSeq) return; // Mappa spostata nel frattempo
+            if (window.mapContext.clusterLayer) currentMap.removeLayer(window.mapContext.clusterLayer);
+            window.mapContext.clusterLayer = L.geoJSON(data, {
+                pointToLayer: function(feature, latlng) {
+                    return L.marker(latlng, { icon: clusterIcon(feature.properties) });
+                },
+                onEachFeature: function(feature, layer) {
+                    const props = feature.properties;
+                    layer.bindTooltip(
+                        `<strong>Edifici:</strong> ${props.buildings}<br>` +
+                        `<strong style="color: orange;">Predisposti:</strong> ${props.predisposti}<br>` +
+                        `<strong>TFO:</strong> ${props.tfos}`
+                    );
+                    layer.on('click', function(e) {
+                        currentMap.setView(e.latlng, Math.min(currentMap.getZoom() + 2, minZoomForBuildings));
+                    });
+                }
+            }).addTo(currentMap);
+        })
+        .catch(err => {
+            if (requestSeq !== clusterRequestSeq) return;
+            console.error('Errore nel caricamento dei cluster:', err);
+            showMapErrorMessage(`Cluster non caricati: ${err.message}`);
+        });
+}
+
+// Crea i layer (vuoti) dei poligoni e dei centroidi, popolati poi pagina per pagina con addData
+function createBuildingLayers(currentMap) {
+    // Layer Poligoni Edifici
+    window.mapContext.geoJsonLayer = L.geoJSON(null, {
+        style: function(feature) {
+            const buildingId = feature.properties.id || feature.properties.objectid;
+            const isPredisposto = window.mapContext.predispostoIds.has(String(buildingId));
+            
+            // Stile di default per poligoni
+            let style = {
+                weight: 1,
+                fillOpacity: 0.3,
+                smoothFactor: 0.5 // Leggermente più liscio
+            };
+            if (isPredisposto) {
+                style.color = 'orange'; // Giallo/Arancio per predisposto
+                style.fillColor = 'orange';
+                style.fillOpacity = 0.4;
+            } else {
+                style.color = 'blue'; // Blu per non predisposto (diverso da rosso per centroidi)
+                style.fillColor = 'blue';
+            }
+            return style;
+        },
+        onEachFeature: function(feature, layer) {
+            const props = feature.properties;
+            const buildingId = String(props.id || props.objectid); // Assicura stringa
+            if (buildingId) {
+                 window.mapContext.buildingLayers[buildingId] = layer; // Traccia il layer
+            }
+
+            let popupContent = '<div style="font-family: Arial, sans-serif; font-size: 12px; max-width: 250px;">';
+            popupContent += '<strong>ID Edificio:</strong> ' + (buildingId || 'N/D') + '<br>';
+            popupContent += '<strong>Uso:</strong> ' + (props.edifc_uso || 'N/D') + '<br>';
+            
+            // Coordinate dal centroide della geometria del poligono se non specificato diversamente
+            const center = layer.getBounds().getCenter();
+            popupContent += `<strong>Coord. Poligono (centro):</strong> ${center.lat.toFixed(6)}, ${center.lng.toFixed(6)}<br>`;
+            if(props.predisposto_fibra) popupContent += '<strong style="color: orange;">Predisposto Fibra</strong><br>';
+            popupContent += '</div>';
+            layer.bindPopup(popupContent);
+
+            layer.on('click', function(e) {
+                populateBuildingFormFromProperties(e.target.feature.properties, e.latlng);
+            });
+        }
+    }).addTo(currentMap);
+
+    // Layer Centroidi
+    window.mapContext.centroidLayer = L.geoJSON(null, {
+        pointToLayer: function(feature, latlng) {
+            const isParentPredisposto = window.mapContext.predispostoIds.has(String(feature.properties.parent_id));
+            return L.circleMarker(latlng, {
+                radius: 5, // Leggermente più grande
+                fillColor: isParentPredisposto ? "#FFA500" : "#FF0000", // Arancio se predisposto, Rosso altrimenti
+                color: "#000",
+                weight: 1,
+                opacity: 1,
+                fillOpacity: 0.8
+            });
+        },
+        onEachFeature: function(feature, layer) {
+            let popupContent = '<div style="font-family: Arial, sans-serif; font-size: 12px;">';
+            popupContent += '<strong>Centroide Edificio</strong><br>';
+            if (feature.properties.parent_id) {
+                popupContent += '<strong>ID Edificio:</strong> ' + feature.properties.parent_id + '<br>';
+            }
+            const coordinates = feature.geometry.coordinates;
+            popupContent += `<strong>Coordinate:</strong> ${coordinates[1].toFixed(6)}, ${coordinates[0].toFixed(6)}<br>`;
+            if(feature.properties.predisposto_fibra) popupContent += '<strong style="color: orange;">Predisposto Fibra</strong><br>';
+            popupContent += '</div>';
+            layer.bindPopup(popupContent);
+            // Nessun evento di click per popolare il form, i poligoni lo fanno già.
+        }
+    })//.addTo(currentMap); // Decommenta se vuoi aggiungere il layer dei centroidi alla mappa
+}
+
+// Stile dei poligoni nel layer a tile vettoriali (stessi colori del layer GeoJSON)
+function vectorTileBuildingStyle(properties) {
+    const isPredisposto = window.mapContext.predispostoIds.has(String(properties.id)) || properties.predisposto_fibra;
+    const color = isPredisposto ? 'orange' : 'blue';
+    return { weight: 1, color: color, fill: true, fillColor: color, fillOpacity: isPredisposto ? 0.4 : 0.3 };
+}
+
+// Stile dei centroidi: visibili solo agli zoom in cui le tile non contengono poligoni
+function vectorTileCentroidStyle(properties, zoom) {
+    if (zoom >= MAP_MIN_ZOOM_TO_LOAD_DATA) return [];
+    const isPredisposto = window.mapContext.predispostoIds.has(String(properties.id)) || properties.predisposto_fibra;
+    return { radius: 3, weight: 1, color: '#000', fill: true, fillColor: isPredisposto ? '#FFA500' : '#FF0000', fillOpacity: 0.8 };
+}
+
+// Crea il layer a tile vettoriali servito da /tiles/{z}/{x}/{y}.mvt
+function initVectorTileLayer() {
+    const currentMap = window.mapContext.mapInstance;
+    const tileLayer = L.vectorGrid.protobuf(`${API_BASE_URL}/tiles/{z}/{x}/{y}.mvt`, {
+        rendererFactory: L.canvas.tile,
+        interactive: true,
+        minZoom: MAP_VECTOR_TILES_MIN_ZOOM,
+        maxZoom: 19,
+        // I centroidi hanno un ID distinto, così setFeatureStyle(id) agisce solo sui poligoni
+        getFeatureId: function(feature) {
+            return feature.properties.is_centroid ? `c${feature.properties.id}` : feature.properties.id;
+        },
+        vectorTileLayerStyles: {
+            edifici: vectorTileBuildingStyle,
+            centroidi: vectorTileCentroidStyle
+        }
+    });
+
+    tileLayer.on('click', function(e) {
+        const props = e.layer.properties;
+        const isPredisposto = window.mapContext.predispostoIds.has(String(props.id)) || props.predisposto_fibra;
+        let popupContent = '<div style="font-family: Arial, sans-serif; font-size: 12px; max-width: 250px;">';
+        popupContent += '<strong>ID Edificio:</strong> ' + (props.id || 'N/D') + '<br>';
+        if (props.edifc_uso) popupContent += '<strong>Uso:</strong> ' + props.edifc_uso + '<br>';
+        if (isPredisposto) popupContent += '<strong style="color: orange;">Predisposto Fibra</strong><br>';
+        popupContent += '</div>';
+        L.popup().setLatLng(e.latlng).setContent(popupContent).openOn(currentMap);
+
+        if (!props.is_centroid) { // Solo i poligoni hanno tutte le proprietà per il form
+            populateBuildingFormFromProperties(props, e.latlng);
+        }
+    });
+
+    tileLayer.on('loading', function() {
+        if (loadingIndicatorEl) {
+            loadingIndicatorEl.innerHTML = `Caricamento tile (zoom: ${currentMap.getZoom()})...`;
+            loadingIndicatorEl.style.display = 'block';
+        }
+    });
+    tileLayer.on('load', function() {
+        if (loadingIndicatorEl) loadingIndicatorEl.style.display = 'none';
+    });
+    tileLayer.on('tileerror', function() {
+        showMapErrorMessage('Alcune tile della mappa non sono state caricate.');
+    });
+
+    tileLayer.addTo(currentMap);
+    window.mapContext.vectorTileLayer = tileLayer;
+}
+
+// Popola il form nella sezione edifici con le proprietà dell'edificio cliccato sulla mappa
+// (usata sia dal layer GeoJSON sia dal layer a tile vettoriali)
+function populateBuildingFormFromProperties(clickedProps, latlng) {
+    // Questi ID sono definiti in index.html
+    const formIndirizzo = document.getElementById('formIndirizzo');
+    const formLat = document.getElementById('formLatitudine');
+    const formLon = document.getElementById('formLongitudine');
+    const formDbId = document.getElementById('formDbId'); // ID da catasto_abitazioni.id
+    const formObjectId = document.getElementById('formObjectId'); // OBJECTID originale
+    const formEdifcUso = document.getElementById('formEdifcUso');
+    // const formComune = document.getElementById('formComune');
+    // const formCodiceBelfiore = document.getElementById('formCodiceBelfiore');
+    // const formCodiceCatastale = document.getElementById('formCodiceCatastale');
+
+    if (formIndirizzo) formIndirizzo.value = clickedProps.edifc_nome || clickedProps.indirizzo || `Edificio ID ${clickedProps.id || clickedProps.objectid}` ;
+    if (formObjectId) formObjectId.value = clickedProps.objectid || '';
+    if (formDbId) formDbId.value = clickedProps.id || ''; // Usa 'id' (PK) se disponibile
+    if (formEdifcUso) formEdifcUso.value = clickedProps.edifc_uso || '';
+    
+    // Usa le coordinate del click o il centroide del poligono
+    if (formLat) formLat.value = latlng.lat.toFixed(8);
+    if (formLon) formLon.value = latlng.lng.toFixed(8);
+
+    // Se il backend fornisce lat/lon pre-calcolate (es. da predisposizione), usarle
+    if (clickedProps.lat && clickedProps.lon && formLat && formLon) {
+        formLat.value = parseFloat(clickedProps.lat).toFixed(8);
+        formLon.value = parseFloat(clickedProps.lon).toFixed(8);
+    }
+    
+    // Popola altri campi se disponibili nelle proprietà e se i campi esistono nel form
+    if (document.getElementById('formComune') && clickedProps.comune) document.getElementById('formComune').value = clickedProps.comune;
+    if (document.getElementById('formCodiceBelfiore') && clickedProps.codice_belfiore) document.getElementById('formCodiceBelfiore').value = clickedProps.codice_belfiore;
+    if (document.getElementById('formCodiceCatastale') && clickedProps.codice_catastale) document.getElementById('formCodiceCatastale').value = clickedProps.codice_catastale;
+     if (document.getElementById('formDataPredisposizione') && clickedProps.data_predisposizione) {
+        try {
+            document.getElementById('formDataPredisposizione').value = new Date(clickedProps.data_predisposizione).toISOString().split('T')[0];
+        } catch (dateErr) { /* ignora se la data non è valida */ }
+    }
+}
@@ -33,6 +33,11 @@ function markBuildingAsPredispostoOnMap(buildingId) {
     } else {
         console.warn(`MAP_UTILS: Layer ${idStr} non trovato sulla mappa per marcare come predisposto. Potrebbe essere fuori BBox/Zoom.`);
     }
+
+    if (window.mapContext && window.mapContext.vectorTileLayer) {
+        // Le tile già scaricate hanno ancora il vecchio stato: aggiorna lo stile della feature
+        window.mapContext.vectorTileLayer.setFeatureStyle(buildingId, { weight: 1, color: 'yellow', fill: true, fillColor: 'yellow', fillOpacity: 0.4 });
+    }
 }
 // Esponi globalmente per compatibilità con il codice originale che chiama window.markBuildingAsPredispostoOnMap
 window.markBuildingAsPredispostoOnMap = markBuildingAsPredispostoOnMap;
@@ -61,15 +66,46 @@ function unmarkBuildingAsPredispostoOnMap(buildingId) {
     } else {
         console.warn(`MAP_UTILS: Layer ${idStr} non trovato sulla mappa per rimuovere marcatura predisposto.`);
     }
+
+    if (window.mapContext && window.mapContext.vectorTileLayer) {
+        window.mapContext.vectorTileLayer.setFeatureStyle(buildingId, { weight: 1, color: 'red', fill: true, fillColor: 'red', fillOpacity: 0.3 });
+    }
 }
 // Esponi globalmente
 window.unmarkBuildingAsPredispostoOnMap = unmarkBuildingAsPredispostoOnMap;
 
+/**
+ * Riduce i confini della mappa alle tile Web Mercator che li coprono allo zoom indicato, come fa
+ * il backend (snap_bbox_to_tiles): piccoli spostamenti producono lo stesso URL, quindi la stessa
+ * risposta in cache e, se i dati non sono cambiati, un 304. Le coordinate restituite sono i centri
+ * delle tile agli angoli, che il backend riallinea esattamente allo stesso range di tile.
+ * @param {L.LatLngBounds} bounds Confini attuali della mappa
+ * @param {number} zoom Livello di zoom
+ * @returns {{west: number, south: number, east: number, north: number}}
+ */
+function snapBoundsToTiles(bounds, zoom) {
+    const n = Math.pow(2, zoom);
+    const maxLat = 85.0511287798;
+    const clampTile = v => Math.min(Math.max(v, 0), n - 1);
+    const tileX = lon => clampTile(Math.floor((lon + 180) / 360 * n));
+    const tileY = lat => {
+        const latRad = Math.max(-maxLat, Math.min(maxLat, lat)) * Math.PI / 180;
+        return clampTile(Math.floor((1 - Math.asinh(Math.tan(latRad)) / Math.PI) / 2 * n));
+    };
+    const tileLon = x => x / n * 360 - 180;
+    const tileLat = y => Math.atan(Math.sinh(Math.PI * (1 - 2 * y / n))) * 180 / Math.PI;
+    const xMin = tileX(bounds.getWest()), xMax = tileX(bounds.getEast());
+    const yMin = tileY(bounds.getNorth()), yMax = tileY(bounds.getSouth());
+    return { west: tileLon(xMin + 0.5), south: tileLat(yMax + 0.5), east: tileLon(xMax + 0.5), north: tileLat(yMin + 0.5) };
+}
+
 // Contesto per la mappa condiviso, inizializzato da mapHandler.js
 window.mapContext = {
     mapInstance: null,
     geoJsonLayer: null,
     centroidLayer: null,
+    vectorTileLayer: null, // Layer Leaflet.VectorGrid quando MAP_USE_VECTOR_TILES è attivo
+    clusterLayer: null, // Cluster di edifici mostrati agli zoom bassi (GET /clusters)
     buildingLayers: {}, // Oggetto per mappare ID edificio -> layer Leaflet
     predispostoIds: new Set() // Set per memorizzare gli ID degli edifici predisposti
 };
\ No newline at end of file
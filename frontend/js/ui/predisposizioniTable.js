@@ -6,7 +6,27 @@ const btnEliminaPredisposizioneEl = document.getElementById('btnEliminaPredispos
 const tfoSectionTitleEl = document.getElementById('tfoSectionTitle'); // Titolo sopra il form/tabella TFO
 const formTfoContainerEl = document.getElementById('formTfoContainer'); // Form TFO
 
+const predisposizioniCountEl = document.getElementById('predisposizioniCount');
+const btnCaricaAltrePredisposizioniEl = document.getElementById('btnCaricaAltrePredisposizioni');
+const btnFiltraPredisposizioniEl = document.getElementById('btnFiltraPredisposizioni');
+
+// Filtri della lista: id dell'input -> parametro di GET /predisposizioni
+const PREDISPOSIZIONI_FILTERS = {
+    filtroIndirizzo: 'q',
+    filtroComune: 'comune',
+    filtroUsoEdificio: 'uso_edificio',
+    filtroDataDa: 'data_da',
+    filtroDataA: 'data_a'
+};
+const PREDISPOSIZIONI_PAGE_SIZE = 50;
+
 let selectedPredisposizioneRow = null; // Riga selezionata nella tabella predisposizioni
+let predisposizioniSort = { field: 'id', order: 'asc' };
+let predisposizioniNextCursor = null; // Cursore della pagina successiva (null = nessuna)
+let predisposizioniTotal = null; // Totale restituito con la prima pagina
+let predisposizioniTotalCapped = false;
+let predisposizioniLoadedCount = 0;
+let predisposizioniRequestSeq = 0; // Le risposte di richieste superate (filtri/ordinamento cambiati) vengono scartate
 
 function updatePredisposizioniActionButtonsVisibility() {
     const isRowSelected = selectedPredisposizioneRow !== null;
@@ -81,32 +101,111 @@ function addPredisposizioneToTable(pred) {
 }
 
 
-function loadPredisposizioni() {
-    if (!predisposizioniTableBodyEl) {
-        console.warn("Elemento predisposizioniTableBody non trovato. Impossibile caricare predisposizioni.");
-        return;
+function buildPredisposizioniEndpoint(cursor) {
+    const params = new URLSearchParams({
+        sort: predisposizioniSort.field,
+        order: predisposizioniSort.order,
+        limit: PREDISPOSIZIONI_PAGE_SIZE
+    });
+    Object.entries(PREDISPOSIZIONI_FILTERS).forEach(([inputId, param]) => {
+        const inputEl = document.getElementById(inputId);
+        const value = inputEl ? inputEl.value.trim() : '';
+        if (value) params.set(param, value);
+    });
+    if (cursor) params.set('cursor', cursor);
+    return `/predisposizioni?${params.toString()}`;
+}
+
+function updatePredisposizioniCount() {
+    if (predisposizioniCountEl) {
+        if (predisposizioniTotal === null) {
+            predisposizioniCountEl.textContent = '';
+        } else {
+            const total = predisposizioniTotalCapped ? `oltre ${predisposizioniTotal}` : predisposizioniTotal;
+            predisposizioniCountEl.textContent = `Mostrate ${predisposizioniLoadedCount} di ${total} predisposizioni`;
+        }
     }
-    predisposizioniTableBodyEl.innerHTML = '<tr><td colspan="5">Caricamento predisposizioni...</td></tr>';
-    clearPredisposizioneSelection(); // Deseleziona e nascondi bottoni/sezione TFO
+    if (btnCaricaAltrePredisposizioniEl) {
+        btnCaricaAltrePredisposizioniEl.style.display = predisposizioniNextCursor ? 'inline-block' : 'none';
+    }
+}
+
+function updatePredisposizioniSortIndicators() {
+    document.querySelectorAll('#predisposizioniTable th[data-sort]').forEach(th => {
+        if (!th.dataset.label) th.dataset.label = th.textContent;
+        const isActive = th.dataset.sort === predisposizioniSort.field;
+        th.textContent = th.dataset.label + (isActive ? (predisposizioniSort.order === 'asc' ? ' ▲' : ' ▼') : '');
+    });
+}
+
+/**
+ * Carica una pagina della lista. Senza cursore riparte dalla prima pagina
+ * (filtri o ordinamento cambiati), con il cursore aggiunge le righe in fondo.
+ */
+function fetchPredisposizioniPage(cursor) {
+    const requestSeq = ++predisposizioniRequestSeq;
+    if (btnCaricaAltrePredisposizioniEl) btnCaricaAltrePredisposizioniEl.disabled = true;
 
-    sendApiRequest('GET', '/predisposizioni', null,
+    sendApiRequest('GET', buildPredisposizioniEndpoint(cursor), null,
         function(data) {
-            predisposizioniTableBodyEl.innerHTML = ''; // Svuota la tabella
-            if (data && data.length > 0) {
-                data.forEach(pred => addPredisposizioneToTable(pred));
-            } else {
+            if (requestSeq !== predisposizioniRequestSeq) return; // Risposta superata da una richiesta più recente
+            if (btnCaricaAltrePredisposizioniEl) btnCaricaAltrePredisposizioniEl.disabled = false;
+            if (!cursor) {
+                predisposizioniTableBodyEl.innerHTML = ''; // Svuota la tabella
+                predisposizioniLoadedCount = 0;
+                predisposizioniTotal = data.total;
+                predisposizioniTotalCapped = data.total_capped;
+            }
+            const items = data.items || [];
+            items.forEach(pred => addPredisposizioneToTable(pred));
+            // TFO di tutti gli edifici della pagina con una sola richiesta
+            if (typeof prefetchTfosForPredisposizioni === 'function') {
+                if (!cursor) clearTfoPrefetch();
+                prefetchTfosForPredisposizioni(items.map(pred => pred.id));
+            }
+            predisposizioniLoadedCount += items.length;
+            predisposizioniNextCursor = data.next;
+            if (!cursor && items.length === 0) {
                 predisposizioniTableBodyEl.innerHTML = '<tr><td colspan="5">Nessuna predisposizione trovata.</td></tr>';
             }
+            updatePredisposizioniCount();
             // Assicurati che i bottoni azione predisposizione siano nascosti se non ci sono dati
             updatePredisposizioniActionButtonsVisibility();
         },
         function(error) {
+            if (requestSeq !== predisposizioniRequestSeq) return;
+            if (btnCaricaAltrePredisposizioniEl) btnCaricaAltrePredisposizioniEl.disabled = false;
+            if (cursor) {
+                showModal('Errore', `Caricamento predisposizioni fallito: ${error}`, 'error');
+                return;
+            }
             predisposizioniTableBodyEl.innerHTML = `<tr><td colspan="5">Errore nel caricamento: ${error}</td></tr>`;
+            predisposizioniNextCursor = null;
+            predisposizioniTotal = null;
+            updatePredisposizioniCount();
             updatePredisposizioniActionButtonsVisibility(); // Nascondi bottoni in caso di errore
         }
     );
 }
 
+function loadPredisposizioni() {
+    if (!predisposizioniTableBodyEl) {
+        console.warn("Elemento predisposizioniTableBody non trovato. Impossibile caricare predisposizioni.");
+        return;
+    }
+    predisposizioniTableBodyEl.innerHTML = '<tr><td colspan="5">Caricamento predisposizioni...</td></tr>';
+    clearPredisposizioneSelection(); // Deseleziona e nascondi bottoni/sezione TFO
+    predisposizioniNextCursor = null;
+    updatePredisposizioniSortIndicators();
+    fetchPredisposizioniPage(null);
+}
+
+function loadMorePredisposizioni() {
+    if (predisposizioniNextCursor) {
+        fetchPredisposizioniPage(predisposizioniNextCursor);
+    }
+}
+
 function handleModificaPredisposizione() {
     if (!selectedPredisposizioneRow) {
         showModal('Attenzione', 'Seleziona un edificio dalla tabella per modificarlo.', 'warning');
@@ -186,6 +285,35 @@ function setupPredisposizioniTableActions() {
     if (btnEliminaPredisposizioneEl) {
         btnEliminaPredisposizioneEl.addEventListener('click', handleEliminaPredisposizione);
     }
+
+    if (btnCaricaAltrePredisposizioniEl) {
+        btnCaricaAltrePredisposizioniEl.addEventListener('click', loadMorePredisposizioni);
+    }
+
+    // Filtri: applicati con il bottone o premendo Invio in un campo
+    if (btnFiltraPredisposizioniEl) {
+        btnFiltraPredisposizioniEl.addEventListener('click', loadPredisposizioni);
+    }
+    Object.keys(PREDISPOSIZIONI_FILTERS).forEach(inputId => {
+        const inputEl = document.getElementById(inputId);
+        if (inputEl) {
+            inputEl.addEventListener('keydown', (event) => {
+                if (event.key === 'Enter') loadPredisposizioni();
+            });
+        }
+    });
+
+    // Ordinamento: click sull'intestazione, un secondo click inverte la direzione
+    document.querySelectorAll('#predisposizioniTable th[data-sort]').forEach(th => {
+        th.addEventListener('click', () => {
+            if (predisposizioniSort.field === th.dataset.sort) {
+                predisposizioniSort.order = predisposizioniSort.order === 'asc' ? 'desc' : 'asc';
+            } else {
+                predisposizioniSort = { field: th.dataset.sort, order: 'asc' };
+            }
+            loadPredisposizioni();
+        });
+    });
     
     // Inizialmente nascondi i bottoni di azione dato che nessuna riga è selezionata
     updatePredisposizioniActionButtonsVisibility();
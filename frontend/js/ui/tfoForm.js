@@ -153,7 +153,7 @@ function handleSalvaTfo() {
             hideTfoForm();
             // Ricarica la tabella delle TFO per la predisposizione corrente
             if (typeof loadTfosForSelectedPredisposizione === 'function') {
-                loadTfosForSelectedPredisposizione(abitazioneId);
+                loadTfosForSelectedPredisposizione(abitazioneId, true);
             }
         },
         function(error) {
@@ -7,6 +7,9 @@ const btnEliminaTfoEl = document.getElementById('btnEliminaTfo');
 
 let selectedTfoRow = null; // Riga TFO selezionata
 let currentTfoDataStore = {}; // Oggetto per memorizzare { tfo_id_db: tfo_data_completa }
+// TFO degli edifici nelle pagine caricate della tabella predisposizioni, lette con una sola
+// richiesta GET /tfos/batch per pagina: { id_abitazione: [tfo, ...] }
+let tfosByBuilding = {};
 
 function updateTfoActionButtonsVisibility() {
     const isRowSelected = selectedTfoRow !== null;
@@ -92,28 +95,67 @@ function addTfoToTable(tfoData) {
 }
 
 
-function loadTfosForSelectedPredisposizione(abitazioneId) {
+/**
+ * Legge con una sola richiesta le TFO degli edifici indicati (es. una pagina della tabella
+ * predisposizioni), così la selezione di una riga le mostra senza altre chiamate al backend.
+ * @param {Array<number|string>} abitazioneIds ID degli edifici
+ */
+function prefetchTfosForPredisposizioni(abitazioneIds) {
+    if (!abitazioneIds || abitazioneIds.length === 0) return;
+    const params = new URLSearchParams();
+    abitazioneIds.forEach(id => params.append('ids', id));
+    sendApiRequest('GET', `/tfos/batch?${params.toString()}`, null,
+        function(data) {
+            (data.buildings || []).forEach(group => {
+                tfosByBuilding[group.id_abitazione] = group.tfos;
+            });
+        },
+        function(error) { // Non bloccante: alla selezione le TFO vengono richieste per il singolo edificio
+            console.warn(`Lettura multipla delle TFO non riuscita: ${error.message}`);
+        }
+    );
+}
+
+// Svuota le TFO già lette (la tabella predisposizioni riparte dalla prima pagina)
+function clearTfoPrefetch() {
+    tfosByBuilding = {};
+}
+
+function renderTfosForPredisposizione(tfos) {
+    if (tfoTableBodyEl) tfoTableBodyEl.innerHTML = ''; // Svuota prima di riempire
+    currentTfoDataStore = {}; // Resetta i dati TFO memorizzati
+    clearTfoSelection(); // Deseleziona qualsiasi TFO precedente
+
+    if (tfos && tfos.length > 0) {
+        tfos.forEach(tfo => addTfoToTable(tfo));
+        if (tfoTableEl) tfoTableEl.style.display = ''; // Mostra la tabella
+        if (tfoTablePlaceholderEl) tfoTablePlaceholderEl.style.display = 'none'; // Nascondi placeholder
+    } else {
+        // Questo è il percorso corretto se il backend restituisce 200 OK con una lista vuota
+        displayTfoTableWithMessage("Nessuna TFO trovata per questo edificio.");
+    }
+}
+
+/**
+ * Mostra le TFO dell'edificio: quelle già lette da prefetchTfosForPredisposizioni,
+ * altrimenti (o con forceReload, dopo una modifica) le richiede al backend.
+ */
+function loadTfosForSelectedPredisposizione(abitazioneId, forceReload = false) {
     if (!abitazioneId) {
         displayTfoTableWithMessage("ID edificio non fornito per caricare le TFO.");
         return;
     }
+    if (!forceReload && tfosByBuilding[abitazioneId]) {
+        renderTfosForPredisposizione(tfosByBuilding[abitazioneId]);
+        return;
+    }
     
     displayTfoTableWithMessage("Caricamento TFO in corso..."); // Messaggio di caricamento
 
     sendApiRequest('GET', `/tfos/predisposizioni/${abitazioneId}/tfos`, null,
         function(tfos) { // Success callback
-            if (tfoTableBodyEl) tfoTableBodyEl.innerHTML = ''; // Svuota prima di riempire
-            currentTfoDataStore = {}; // Resetta i dati TFO memorizzati
-            clearTfoSelection(); // Deseleziona qualsiasi TFO precedente
-
-            if (tfos && tfos.length > 0) {
-                tfos.forEach(tfo => addTfoToTable(tfo));
-                if (tfoTableEl) tfoTableEl.style.display = ''; // Mostra la tabella
-                if (tfoTablePlaceholderEl) tfoTablePlaceholderEl.style.display = 'none'; // Nascondi placeholder
-            } else {
-                // Questo è il percorso corretto se il backend restituisce 200 OK con una lista vuota
-                displayTfoTableWithMessage("Nessuna TFO trovata per questo edificio.");
-            }
+            tfosByBuilding[abitazioneId] = tfos || [];
+            renderTfosForPredisposizione(tfos);
         },
         function(errorDetails) { // Error callback - errorDetails è ora { message: string, status: number }
             if (errorDetails.status === 404) {
@@ -169,7 +211,7 @@ function handleEliminaTfo() {
                     showModal('Successo', response.message || `TFO ${tfoCodice} eliminata con successo.`, 'success');
                     // Ricarica le TFO per la predisposizione corrente
                     if (selectedPredisposizioneRow && selectedPredisposizioneRow.dataset.id) {
-                        loadTfosForSelectedPredisposizione(selectedPredisposizioneRow.dataset.id);
+                        loadTfosForSelectedPredisposizione(selectedPredisposizioneRow.dataset.id, true);
                     } else {
                         // Fallback se non si può ricaricare, pulisce la tabella
                         displayTfoTableWithMessage("TFO eliminata. Selezionare nuovamente una predisposizione per aggiornare la lista.");